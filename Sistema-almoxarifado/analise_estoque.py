@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Análise de Estoque - Previsões e sugestões de compra em lote
+Em vez de duas consultas e uma regressão por item, lê os totais diários de saída
+do período (movimentacao_diaria, já agrupados no banco), monta uma matriz
+item × dia e calcula todas as tendências lineares de uma vez (mínimos quadrados
+em forma fechada).
+"""
+
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from supabase_client import select_all
+import movimentacao_diaria
+
+# Janela de histórico usada nas previsões (dias)
+HISTORICO_DIAS = 90
+# Horizonte padrão quando o item não tem tempo de reposição cadastrado
+HORIZONTE_PADRAO = 7
+
+ITEM_COLUMNS = 'id, codigo, descricao, qtd_estoque, estoque_minimo, estoque_ideal_compra, tempo_reposicao'
+
+
+def carregar_saidas(dias: int = HISTORICO_DIAS, hoje: Optional[date] = None) -> pd.DataFrame:
+    """
+    Saídas dos últimos `dias` dias, já somadas por item e dia (tabela movimentacao_diaria).
+
+    Returns:
+        DataFrame com item_id, dia (datetime64, sem hora) e quantidade
+    """
+    hoje = hoje or date.today()
+    inicio = (hoje - timedelta(days=dias)).strftime('%Y-%m-%d')
+    rows = movimentacao_diaria.carregar(inicio, tipo='SAIDA')
+
+    df = pd.DataFrame(rows, columns=['item_id', 'dia', 'quantidade'])
+    return pd.DataFrame({
+        'item_id': df['item_id'],
+        'dia': pd.to_datetime(df['dia'].astype(str).str[:10]),
+        'quantidade': pd.to_numeric(df['quantidade'], errors='coerce').fillna(0.0),
+    })
+
+
+def matriz_diaria(saidas: pd.DataFrame, item_ids: List[Any]) -> Tuple[np.ndarray, np.ndarray, pd.DatetimeIndex]:
+    """
+    Pivota as saídas em uma matriz densa item × dia.
+
+    Returns:
+        (quantidades, presenca, dias) - `quantidades[i, j]` é a soma do item i no dia j;
+        `presenca[i, j]` indica se houve alguma movimentação (mesmo de quantidade 0)
+    """
+    if saidas.empty:
+        return np.zeros((len(item_ids), 0)), np.zeros((len(item_ids), 0), dtype=bool), pd.DatetimeIndex([])
+
+    dias = pd.date_range(saidas['dia'].min(), saidas['dia'].max())
+    linhas = pd.Index(item_ids).get_indexer(saidas['item_id'])
+    validas = linhas >= 0
+    colunas = dias.get_indexer(saidas['dia'])
+
+    quantidades = np.zeros((len(item_ids), len(dias)))
+    presenca = np.zeros((len(item_ids), len(dias)), dtype=bool)
+    np.add.at(quantidades, (linhas[validas], colunas[validas]), saidas['quantidade'].to_numpy()[validas])
+    presenca[linhas[validas], colunas[validas]] = True
+    return quantidades, presenca, dias
+
+
+def tendencias_lineares(quantidades: np.ndarray, presenca: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Ajusta y = m·x + b para cada linha, com x = 0..n-1 contado a partir do primeiro dia
+    com movimentação do item até o último (a mesma janela que np.polyfit recebia por item).
+
+    Returns:
+        dict com 'm', 'b', 'n' (dias na janela), 'ultimo' (coluna do último dia)
+        e 'tem_historico' (item com ao menos uma saída)
+    """
+    tem_historico = presenca.any(axis=1)
+    total_dias = presenca.shape[1]
+    if total_dias == 0:
+        # Nenhuma saída no período: argmax de uma linha vazia falharia
+        zeros = np.zeros(presenca.shape[0])
+        return {'m': zeros, 'b': zeros.copy(), 'n': zeros.copy(),
+                'ultimo': np.zeros(presenca.shape[0], dtype=int), 'tem_historico': tem_historico}
+    primeiro = np.where(tem_historico, presenca.argmax(axis=1), 0)
+    ultimo = np.where(tem_historico, total_dias - 1 - presenca[:, ::-1].argmax(axis=1), 0)
+    n = np.where(tem_historico, ultimo - primeiro + 1, 0).astype(float)
+
+    # Fora da janela não há movimentação, então as somas podem percorrer a linha toda
+    colunas = np.arange(total_dias, dtype=float)
+    soma_y = quantidades.sum(axis=1)
+    soma_xy = quantidades @ colunas - primeiro * soma_y
+    soma_x = n * (n - 1) / 2
+    soma_xx = (n - 1) * n * (2 * n - 1) / 6
+
+    denominador = n * soma_xx - soma_x ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m = np.where(denominador > 0, (n * soma_xy - soma_x * soma_y) / denominador, 0.0)
+        b = np.where(n > 0, (soma_y - m * soma_x) / n, 0.0)
+
+    return {'m': m, 'b': b, 'n': n, 'ultimo': ultimo, 'tem_historico': tem_historico}
+
+
+def consumo_previsto(tendencias: Dict[str, np.ndarray], horizontes: np.ndarray) -> np.ndarray:
+    """
+    Soma da previsão diária (limitada a 0 e arredondada a 2 casas, como na previsão
+    por item) nos próximos `horizontes[i]` dias de cada item. Janelas com menos de
+    2 dias não geram previsão (consumo 0).
+    """
+    horizontes = np.asarray(horizontes, dtype=int)
+    passos = np.arange(1, max(int(horizontes.max(initial=0)), 0) + 1)
+    if passos.size == 0:
+        return np.zeros(len(horizontes))
+
+    m, b, n = tendencias['m'][:, None], tendencias['b'][:, None], tendencias['n'][:, None]
+    previsto = np.maximum(0, np.round(m * (n + passos - 1) + b, 2))
+    previsto[passos[None, :] > horizontes[:, None]] = 0
+    previsto[tendencias['n'] < 2] = 0
+    return previsto.sum(axis=1)
+
+
+def gerar_sugestoes_compra(hoje: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Sugestões de compra para todos os itens com estoque > 0.
+
+    Para cada item com histórico de saídas, projeta o consumo durante o tempo de
+    reposição; se o estoque projetado ficar abaixo do mínimo, sugere a compra
+    (estoque ideal, ou 2× mínimo − projetado) e a data limite do pedido.
+    Itens sem saídas no período ou sem consumo previsto não geram sugestão.
+    """
+    hoje = hoje or date.today()
+    itens = pd.DataFrame(
+        select_all('item_estoque', columns=ITEM_COLUMNS, order_by='id',
+                   refine=lambda q: q.gt('qtd_estoque', 0)),
+        columns=[c.strip() for c in ITEM_COLUMNS.split(',')]
+    )
+    if itens.empty:
+        return []
+
+    quantidades, presenca, _ = matriz_diaria(carregar_saidas(hoje=hoje), itens['id'].tolist())
+    tendencias = tendencias_lineares(quantidades, presenca)
+
+    def numerico(coluna: str, default: float = 0.0) -> np.ndarray:
+        return pd.to_numeric(itens[coluna], errors='coerce').fillna(default).to_numpy(dtype=float)
+
+    qtd = numerico('qtd_estoque')
+    minimo = numerico('estoque_minimo')
+    ideal = numerico('estoque_ideal_compra')
+    horizonte = pd.to_numeric(itens['tempo_reposicao'], errors='coerce').fillna(0).to_numpy(dtype=int)
+    horizonte = np.where(horizonte > 0, horizonte, HORIZONTE_PADRAO)
+
+    consumo = consumo_previsto(tendencias, horizonte)
+    projetado = qtd - consumo
+
+    sugerir = tendencias['tem_historico'] & (projetado < minimo) & (consumo > 0)
+    quantidade_sugerida = np.where(ideal > 0, ideal, minimo * 2 - projetado)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dias_ate_critico = np.maximum(0, (qtd - minimo) / (consumo / horizonte))
+
+    sugestoes = []
+    for i in np.flatnonzero(sugerir):
+        try:
+            data_limite = hoje + timedelta(days=float(dias_ate_critico[i]))
+        except OverflowError:
+            continue  # consumo previsto ínfimo: data limite fora do calendário
+        sugestoes.append({
+            'item_id': int(itens['id'].iat[i]),
+            'item_descricao': itens['descricao'].iat[i],
+            'item_codigo': itens['codigo'].iat[i],
+            'quantidade_sugerida': round(float(quantidade_sugerida[i]), 2),
+            'data_limite_pedido': data_limite,
+        })
+
+    sugestoes.sort(key=lambda s: s['data_limite_pedido'])
+    for s in sugestoes:
+        s['data_limite_pedido'] = s['data_limite_pedido'].strftime('%d/%m/%Y')
+    return sugestoes
+
+
+def calcular_giro_estoque(dias: int = HISTORICO_DIAS, top: int = 10,
+                          hoje: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Giro de estoque (saídas no período ÷ estoque atual) de todos os itens com estoque > 0.
+
+    Totais diários de saída do período, somados por item no pandas e cruzados com qtd_estoque.
+
+    Returns:
+        Os `top` itens de MENOR giro (parados há mais tempo), em ordem crescente
+    """
+    itens = pd.DataFrame(
+        select_all('item_estoque', columns='id, codigo, descricao, qtd_estoque', order_by='id',
+                   refine=lambda q: q.gt('qtd_estoque', 0)),
+        columns=['id', 'codigo', 'descricao', 'qtd_estoque']
+    )
+    if itens.empty:
+        return []
+
+    saidas = carregar_saidas(dias=dias, hoje=hoje)
+    totais = saidas.groupby('item_id')['quantidade'].sum()
+
+    itens['total_saidas'] = itens['id'].map(totais).fillna(0.0)
+    qtd = pd.to_numeric(itens['qtd_estoque'], errors='coerce').fillna(0.0)
+    itens['giro_estoque'] = (itens['total_saidas'] / qtd.where(qtd > 0)).fillna(0.0).round(2)
+
+    menores = itens.sort_values('giro_estoque', kind='stable').head(top)
+    return menores[['id', 'descricao', 'codigo', 'giro_estoque', 'qtd_estoque', 'total_saidas']].to_dict('records')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Busca de Itens - Índice em memória para o autocompletar de /api/items/search
+Indexa os itens do catálogo em memória (catalogo.py: id, codigo, descricao,
+codigo_opcional) com postings de n-gramas sobre o texto normalizado (sem acentos,
+maiúsculo). As escritas de item (database_helpers) atualizam o índice
+incrementalmente; alterações feitas fora da aplicação seguem as regras do
+catálogo (assinatura e idade máxima): quando ele recarrega a tabela, o índice
+é reconstruído a partir da nova carga.
+"""
+
+import bisect
+import heapq
+import itertools
+import threading
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+import catalogo
+
+INDEX_FIELDS = ('id', 'codigo', 'descricao', 'codigo_opcional')
+SEARCH_FIELDS = ('codigo', 'descricao', 'codigo_opcional')
+NGRAM = 3
+DEFAULT_LIMIT = 15
+
+_lock = threading.RLock()
+_index: Optional['ItemSearchIndex'] = None
+# Reconstrução em andamento (fora de _lock) e deltas recebidos enquanto isso
+_construindo: Optional[threading.Event] = None
+_deltas: Optional[List[Tuple[str, Any]]] = None
+
+
+def normalize_text(s: Any) -> str:
+    """Normaliza texto para comparação: sem acentos/ordinais, maiúsculo e espaços simples."""
+    if not isinstance(s, str):
+        s = '' if pd.isna(s) else str(s)
+    s = s.strip()
+    s = s.replace('º', '').replace('°', '').replace('ª', '')
+    s = unicodedata.normalize('NFKD', s)
+    s = ''.join(ch for ch in s if not unicodedata.combining(ch))
+    s = s.upper()
+    s = ' '.join(s.split())
+    return s
+
+
+def _ngrams(texto: str) -> Set[str]:
+    """Todos os n-gramas de 1 a NGRAM caracteres (consultas curtas usam os menores)."""
+    return {texto[i:i + n] for n in range(1, NGRAM + 1) for i in range(len(texto) - n + 1)}
+
+
+def _query_grams(consulta: str) -> Set[str]:
+    n = min(NGRAM, len(consulta))
+    return {consulta[i:i + n] for i in range(len(consulta) - n + 1)}
+
+
+class ItemSearchIndex:
+    """
+    Catálogo estreito de itens + estruturas de busca:
+    - `by_codigo`: código normalizado -> ids (casamento exato);
+    - `sorted_fields`: por campo, lista ordenada de (texto normalizado, str(id), id) para prefixos via bisect;
+    - `postings`: n-grama -> ids, para casamentos no meio do texto.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], carga: Optional[int]):
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.normalized: Dict[Any, Tuple[str, ...]] = {}
+        self.by_codigo: Dict[str, Set[Any]] = {}
+        self.sorted_fields: List[List[Tuple[str, str, Any]]] = [[] for _ in SEARCH_FIELDS]
+        self.postings: Dict[str, Set[Any]] = {}
+        self.carga = carga  # carga do catálogo de onde veio (None: invalidado)
+
+        for row in rows:
+            item_id = row['id']
+            self.docs[item_id] = {k: row.get(k) for k in INDEX_FIELDS}
+            self._index_doc(item_id, tuple(normalize_text(row.get(k)) for k in SEARCH_FIELDS), bulk=True)
+        for campo in self.sorted_fields:
+            campo.sort()
+
+    # --- Manutenção ---------------------------------------------------------
+
+    def _index_doc(self, item_id: Any, textos: Tuple[str, ...], bulk: bool = False):
+        self.normalized[item_id] = textos
+        self.by_codigo.setdefault(textos[0], set()).add(item_id)
+        for campo, texto in zip(self.sorted_fields, textos):
+            if not texto:
+                continue
+            # str(id) desempata sem comparar ids de tipos diferentes
+            entrada = (texto, str(item_id), item_id)
+            if bulk:
+                campo.append(entrada)
+            else:
+                bisect.insort(campo, entrada)
+        for gram in set().union(*(_ngrams(t) for t in textos)):
+            self.postings.setdefault(gram, set()).add(item_id)
+
+    def _unindex(self, item_id: Any):
+        antigos = self.normalized.pop(item_id, None)
+        if antigos is None:
+            return
+        ids = self.by_codigo.get(antigos[0])
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del self.by_codigo[antigos[0]]
+        for campo, texto in zip(self.sorted_fields, antigos):
+            if not texto:
+                continue
+            pos = bisect.bisect_left(campo, (texto, str(item_id)))
+            if pos < len(campo) and campo[pos][2] == item_id:
+                del campo[pos]
+        for gram in set().union(*(_ngrams(t) for t in antigos)):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def upsert(self, row: Dict[str, Any]):
+        item_id = row['id']
+        doc = dict(self.docs.get(item_id, {}))
+        doc.update({k: row[k] for k in INDEX_FIELDS if k in row})
+        self.docs[item_id] = doc
+
+        novos = tuple(normalize_text(doc.get(k)) for k in SEARCH_FIELDS)
+        if self.normalized.get(item_id) != novos:
+            self._unindex(item_id)
+            self._index_doc(item_id, novos)
+
+    def remove(self, item_id: Any):
+        self._unindex(item_id)
+        self.docs.pop(item_id, None)
+
+    # --- Consulta -----------------------------------------------------------
+
+    def _prefixed(self, campo: int, consulta: str) -> Iterator[Any]:
+        """Ids cujo campo começa com `consulta`, em ordem alfabética do campo."""
+        entradas = self.sorted_fields[campo]
+        pos = bisect.bisect_left(entradas, (consulta,))
+        while pos < len(entradas) and entradas[pos][0].startswith(consulta):
+            yield entradas[pos][2]
+            pos += 1
+
+    def _contains(self, consulta: str) -> Set[Any]:
+        """Ids que contêm `consulta` em algum campo (interseção das postings + verificação)."""
+        listas = sorted((self.postings.get(g, set()) for g in _query_grams(consulta)), key=len)
+        if not listas or not listas[0]:
+            return set()
+        candidatos = set(listas[0]).intersection(*listas[1:])
+        return {i for i in candidatos if any(consulta in t for t in self.normalized[i])}
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+        """
+        Ranqueia: 1) código exato; 2) código começa com; 3) descrição/código opcional
+        começa com; 4) contém no meio do texto (ordem alfabética do código).
+        """
+        consulta = normalize_text(query)
+        if not consulta:
+            return list(itertools.islice(self.docs.values(), limit))
+
+        encontrados: Dict[Any, None] = {}
+
+        def adicionar(ids) -> bool:
+            for item_id in ids:
+                encontrados.setdefault(item_id)
+                if len(encontrados) >= limit:
+                    return True
+            return False
+
+        if (adicionar(sorted(self.by_codigo.get(consulta, ()), key=str))
+                or adicionar(self._prefixed(0, consulta))
+                or adicionar(self._prefixed(1, consulta))
+                or adicionar(self._prefixed(2, consulta))):
+            return [self.docs[i] for i in encontrados]
+
+        restantes = self._contains(consulta).difference(encontrados)
+        adicionar(heapq.nsmallest(limit - len(encontrados), restantes,
+                                  key=lambda i: (self.normalized[i][0], str(i))))
+        return [self.docs[i] for i in encontrados]
+
+
+# ============================================================
+# CICLO DE VIDA
+# ============================================================
+
+def build_index() -> ItemSearchIndex:
+    """Monta o índice a partir dos itens do catálogo em memória."""
+    carga = catalogo.carga('item_estoque')
+    return ItemSearchIndex(catalogo.itens(), carga)
+
+
+def get_index() -> ItemSearchIndex:
+    """
+    Retorna o índice atual, reconstruindo-o se estiver ausente ou o catálogo tiver recarregado.
+
+    Catálogo e reconstrução rodam fora de _lock, uma thread por vez; as demais buscas
+    seguem com o índice atual, ou esperam se ainda não há nenhum.
+    """
+    global _index, _construindo, _deltas
+    while True:
+        carga = catalogo.carga('item_estoque')
+        with _lock:
+            if _index is not None and _index.carga == carga:
+                return _index
+            construindo = _construindo
+            if construindo is None:
+                construindo = _construindo = threading.Event()
+                _deltas = []
+                break
+            if _index is not None:
+                return _index
+        construindo.wait()
+
+    try:
+        novo = build_index()
+        with _lock:
+            # Escritas durante a construção: a linha do catálogo pode ser anterior a elas
+            for metodo, valor in _deltas:
+                if metodo == 'invalidar':
+                    novo.carga = None
+                else:
+                    getattr(novo, metodo)(valor)
+            _index = novo
+        return novo
+    finally:
+        with _lock:
+            _construindo = None
+            _deltas = None
+        construindo.set()
+
+
+def invalidate():
+    """Descarta o índice (próxima busca reconstrói)."""
+    global _index
+    with _lock:
+        if _deltas is not None:
+            _deltas.append(('invalidar', None))
+        _index = None
+
+
+def search(query: str, limit: int = DEFAULT_LIMIT) -> List[Dict[str, Any]]:
+    """Itens que casam com `query`, ranqueados (código exato, prefixo, substring)."""
+    return get_index().search(query, limit)
+
+
+# ============================================================
+# DELTAS (chamados pelos helpers de escrita de item)
+# ============================================================
+
+def apply_item(row: Optional[Dict[str, Any]]):
+    """Item criado/atualizado (aceita linha parcial; só campos indexados importam)."""
+    if not row or row.get('id') is None:
+        return
+    with _lock:
+        if _deltas is not None:
+            _deltas.append(('upsert', dict(row)))
+        if _index is not None:
+            _index.upsert(row)
+
+
+def remove_item(item_id: Any):
+    """Item excluído."""
+    with _lock:
+        if _deltas is not None:
+            _deltas.append(('remove', item_id))
+        if _index is not None:
+            _index.remove(item_id)
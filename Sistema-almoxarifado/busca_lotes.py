@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Busca de Lotes - Índice em memória para a busca de /estoque
+Cada lote é indexado com os campos do próprio lote (lote, nf, item_nf) e os do
+seu item, denormalizados (codigo, descricao, endereco): o operador acha o lote
+pelo código ou descrição da peça, o que o filtro or_/ilike do PostgREST não
+alcança (não combina colunas da tabela embutida).
+
+A busca devolve os ids na ordem de /estoque (validade, sem validade por último,
+depois id) e pagina por cursor na memória; as linhas da página vêm do banco numa
+única consulta por id. Termos separados por espaço precisam aparecer todos.
+
+Consistência (mesmo esquema de catalogo.py):
+- as escritas de lote e de item da aplicação atualizam o índice incrementalmente;
+- alterações externas são detectadas por TTL + assinatura (contagem e maior id
+  de estoque_detalhe) e, no limite, por reconstrução a cada LOTE_SEARCH_MAX_AGE;
+- verificação e reconstrução rodam fora do lock; os deltas recebidos enquanto
+  isso são reaplicados no índice novo;
+- lotes que o banco devolve já sem saldo saem do índice na própria consulta.
+"""
+
+import os
+import time
+import bisect
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from supabase_client import supabase, select_all, select_in, encode_cursor, decode_cursor
+from busca_itens import normalize_text, _ngrams, _query_grams
+import catalogo
+
+# Intervalo (segundos) entre verificações de alterações externas
+LOTE_SEARCH_TTL: int = int(os.getenv('LOTE_SEARCH_TTL', '60'))
+# Idade máxima (segundos) do índice (ex.: saldo alterado fora da aplicação)
+LOTE_SEARCH_MAX_AGE: int = int(os.getenv('LOTE_SEARCH_MAX_AGE', '600'))
+
+LOTE_FIELDS = ('id', 'item_estoque_id', 'lote', 'nf', 'item_nf', 'validade', 'quantidade')
+LOTE_SEARCH_FIELDS = ('lote', 'nf', 'item_nf')
+ITEM_SEARCH_FIELDS = ('codigo', 'descricao', 'endereco')
+PAGE_COLUMNS = '*, item_estoque(id, codigo, descricao, endereco)'
+
+_lock = threading.RLock()
+_index: Optional['LoteSearchIndex'] = None
+# Verificação/reconstrução em andamento (fora de _lock) e deltas recebidos enquanto isso
+_construindo: Optional[threading.Event] = None
+_deltas: Optional[List[Tuple[Callable, Any]]] = None
+
+
+def _com_saldo(lote: Dict[str, Any]) -> bool:
+    try:
+        return float(lote.get('quantidade') or 0) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _ordem(lote_id: Any, validade: Any) -> Tuple:
+    """Chave da ordem de /estoque: validade ASC com nulos por último, id como desempate."""
+    return (validade is None, str(validade)[:10] if validade is not None else '', lote_id)
+
+
+class LoteSearchIndex:
+    """
+    Lotes + campos do item denormalizados:
+    - `texto`: lote -> texto normalizado (campos do lote e do item);
+    - `postings`: n-grama -> lotes, para casamentos em qualquer parte do texto;
+    - `ordenados`: chaves (validade, id) dos lotes com saldo, em ordem, para paginar.
+    """
+
+    def __init__(self, lotes: List[Dict[str, Any]], itens: List[Dict[str, Any]], signature: Tuple[int, Any]):
+        self.lotes: Dict[Any, Dict[str, Any]] = {}
+        self.itens: Dict[Any, Dict[str, Any]] = {i['id']: {k: i.get(k) for k in ITEM_SEARCH_FIELDS} for i in itens}
+        self.por_item: Dict[Any, Set[Any]] = {}
+        self.texto: Dict[Any, str] = {}
+        self.postings: Dict[str, Set[Any]] = {}
+        self.ordenados: List[Tuple] = []
+        self.signature = signature
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+
+        for row in lotes:
+            self._index_lote(row, bulk=True)
+        self.ordenados.sort()
+
+    # --- Manutenção ---------------------------------------------------------
+
+    def _texto(self, lote: Dict[str, Any]) -> str:
+        item = self.itens.get(lote.get('item_estoque_id'), {})
+        campos = [lote.get(k) for k in LOTE_SEARCH_FIELDS] + [item.get(k) for k in ITEM_SEARCH_FIELDS]
+        # Separador que nenhuma consulta contém: termos não casam atravessando campos
+        return '\x1f'.join(normalize_text(c) for c in campos)
+
+    def _index_lote(self, row: Dict[str, Any], bulk: bool = False):
+        lote_id = row['id']
+        lote = {k: row.get(k) for k in LOTE_FIELDS}
+        self.lotes[lote_id] = lote
+        self.por_item.setdefault(lote['item_estoque_id'], set()).add(lote_id)
+        texto = self._texto(lote)
+        self.texto[lote_id] = texto
+        for gram in _ngrams(texto):
+            self.postings.setdefault(gram, set()).add(lote_id)
+        if _com_saldo(lote):
+            chave = _ordem(lote_id, lote['validade'])
+            if bulk:
+                self.ordenados.append(chave)
+            else:
+                bisect.insort(self.ordenados, chave)
+
+    def _unindex_lote(self, lote_id: Any):
+        lote = self.lotes.pop(lote_id, None)
+        if lote is None:
+            return
+        ids = self.por_item.get(lote['item_estoque_id'])
+        if ids is not None:
+            ids.discard(lote_id)
+            if not ids:
+                del self.por_item[lote['item_estoque_id']]
+        for gram in _ngrams(self.texto.pop(lote_id, '')):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(lote_id)
+                if not ids:
+                    del self.postings[gram]
+        chave = _ordem(lote_id, lote['validade'])
+        pos = bisect.bisect_left(self.ordenados, chave)
+        if pos < len(self.ordenados) and self.ordenados[pos] == chave:
+            del self.ordenados[pos]
+
+    def upsert_lote(self, row: Dict[str, Any]):
+        lote = dict(self.lotes.get(row['id'], {}))
+        lote.update({k: row[k] for k in LOTE_FIELDS if k in row})
+        self._unindex_lote(row['id'])
+        self._index_lote(lote)
+
+    def remove_lote(self, lote_id: Any):
+        self._unindex_lote(lote_id)
+
+    def upsert_item(self, row: Dict[str, Any]):
+        item = dict(self.itens.get(row['id'], {}))
+        item.update({k: row[k] for k in ITEM_SEARCH_FIELDS if k in row})
+        if self.itens.get(row['id']) == item:
+            return
+        self.itens[row['id']] = item
+        # Campos do item estão copiados em cada lote dele
+        for lote_id in list(self.por_item.get(row['id'], ())):
+            self.upsert_lote(self.lotes[lote_id])
+
+    def remove_item(self, item_id: Any):
+        for lote_id in list(self.por_item.get(item_id, ())):
+            self._unindex_lote(lote_id)
+        self.itens.pop(item_id, None)
+
+    # --- Consulta -----------------------------------------------------------
+
+    def _contains(self, termo: str) -> Set[Any]:
+        listas = sorted((self.postings.get(g, set()) for g in _query_grams(termo)), key=len)
+        if not listas or not listas[0]:
+            return set()
+        candidatos = set(listas[0]).intersection(*listas[1:])
+        return {i for i in candidatos if termo in self.texto[i]}
+
+    def matches(self, query: str) -> List[Tuple]:
+        """Chaves (validade, id) dos lotes com saldo que contêm todos os termos, em ordem."""
+        encontrados: Optional[Set[Any]] = None
+        for termo in normalize_text(query).split():
+            ids = self._contains(termo)
+            encontrados = ids if encontrados is None else encontrados & ids
+            if not encontrados:
+                return []
+        if encontrados is None:
+            return list(self.ordenados)
+        return sorted(_ordem(i, self.lotes[i]['validade']) for i in encontrados if _com_saldo(self.lotes[i]))
+
+
+# ============================================================
+# CICLO DE VIDA
+# ============================================================
+
+def _signature() -> Optional[Tuple[int, Any]]:
+    """(contagem, maior id) de estoque_detalhe - detecta inserções/exclusões externas."""
+    if not supabase:
+        return None
+    try:
+        response = supabase.table('estoque_detalhe').select('id', count='exact') \
+            .order('id', desc=True).limit(1).execute()
+        maior_id = response.data[0]['id'] if response.data else 0
+        return (response.count or 0, maior_id)
+    except Exception as e:
+        print(f"⚠️ Busca de lotes: falha ao verificar assinatura: {e}")
+        return None
+
+
+def build_index() -> LoteSearchIndex:
+    """Monta o índice: lotes (projeção estreita) + campos dos itens (catálogo em memória)."""
+    lotes = select_all('estoque_detalhe', columns=', '.join(LOTE_FIELDS), order_by='id')
+    signature = (len(lotes), max((r['id'] for r in lotes), default=0))
+    return LoteSearchIndex(lotes, catalogo.itens(), signature)
+
+
+def _acao(index: Optional[LoteSearchIndex]) -> str:
+    """'usar', 'verificar' (assinatura) ou 'reconstruir' - decisão local, sem rede."""
+    if index is None:
+        return 'reconstruir'
+    agora = time.monotonic()
+    if agora - index.built_at > LOTE_SEARCH_MAX_AGE:
+        return 'reconstruir'
+    if agora - index.checked_at < LOTE_SEARCH_TTL:
+        return 'usar'
+    return 'verificar'
+
+
+def get_index() -> LoteSearchIndex:
+    """
+    Retorna o índice atual, (re)construindo-o se estiver ausente ou desatualizado.
+
+    Assinatura e reconstrução rodam fora de _lock, uma thread por vez; as demais
+    buscas seguem com o índice atual, ou esperam se ainda não há nenhum.
+    """
+    global _index, _construindo, _deltas
+    while True:
+        with _lock:
+            index = _index
+            acao = _acao(index)
+            if acao == 'usar':
+                return index
+            construindo = _construindo
+            if construindo is None:
+                construindo = _construindo = threading.Event()
+                _deltas = []
+                break
+            if index is not None:
+                return index
+        construindo.wait()
+
+    try:
+        if acao == 'verificar':
+            signature = _signature()
+            if signature is None or signature == index.signature:
+                index.checked_at = time.monotonic()
+                return index
+        novo = build_index()
+        with _lock:
+            # Escritas durante a construção: a leitura do banco pode ser anterior a elas
+            for funcao, valor in _deltas:
+                funcao(novo, valor)
+            _index = novo
+        return novo
+    finally:
+        with _lock:
+            _construindo = None
+            _deltas = None
+        construindo.set()
+
+
+def _invalidar(index: LoteSearchIndex, _valor: Any = None):
+    index.built_at = float('-inf')
+
+
+def invalidate():
+    """Descarta o índice (próxima busca reconstrói)."""
+    global _index
+    with _lock:
+        if _deltas is not None:
+            _deltas.append((_invalidar, None))
+        _index = None
+
+
+def _fatia(chaves: List[Tuple], size: int, after: Optional[str], before: Optional[str]):
+    """(chaves da página, há página anterior, há próxima): size chaves depois de `after` ou antes de `before`."""
+    cursor = decode_cursor(before)
+    if cursor is not None:
+        fim = bisect.bisect_left(chaves, _ordem(cursor[1], cursor[0]))
+        inicio = max(0, fim - size)
+        return chaves[inicio:fim], inicio > 0, True
+    cursor = decode_cursor(after)
+    inicio = bisect.bisect_right(chaves, _ordem(cursor[1], cursor[0])) if cursor is not None else 0
+    janela = chaves[inicio:inicio + size + 1]
+    return janela[:size], inicio > 0, len(janela) > size
+
+
+def search_page(query: str, size: int = 25, after: Optional[str] = None,
+                before: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Uma página de lotes com saldo que casam com `query`, na ordem de /estoque.
+
+    Returns:
+        {'rows': [...] (com item_estoque embutido), 'next_cursor', 'prev_cursor', 'total'}
+        com os mesmos cursores de supabase_client.select_page.
+    """
+    index = get_index()
+    with _lock:
+        chaves = index.matches(query)
+    janela, tem_anterior, tem_proxima = _fatia(chaves, size, after, before)
+
+    ids = [chave[2] for chave in janela]
+    por_id = {r['id']: r for r in select_in('estoque_detalhe', 'id', ids, columns=PAGE_COLUMNS)} if ids else {}
+    rows = []
+    with _lock:
+        for lote_id in ids:
+            row = por_id.get(lote_id)
+            if row is None:
+                remove_lote(lote_id)
+                continue
+            apply_lote(row)
+            if _com_saldo(row):
+                rows.append(row)
+    # Lotes que perderam o saldo fora da aplicação saem da página (e do índice); a
+    # página fica menor, mas os cursores seguem válidos
+
+    total = len(chaves) - (len(ids) - len(rows))
+    return {
+        'rows': rows,
+        'next_cursor': encode_cursor(rows[-1]['validade'], rows[-1]['id']) if rows and tem_proxima else None,
+        'prev_cursor': encode_cursor(rows[0]['validade'], rows[0]['id']) if rows and tem_anterior else None,
+        'total': total,
+    }
+
+
+# ============================================================
+# DELTAS (chamados pelas escritas de lote e de item)
+# ============================================================
+
+def _delta(funcao: Callable, valor: Any):
+    """Aplica no índice atual e guarda para uma reconstrução em andamento."""
+    with _lock:
+        if _deltas is not None:
+            _deltas.append((funcao, valor))
+        if _index is not None:
+            funcao(_index, valor)
+
+
+def _apply_lote(index: LoteSearchIndex, row: Dict[str, Any]):
+    novo = row['id'] not in index.lotes
+    if novo and 'item_estoque_id' not in row:
+        return
+    index.upsert_lote(row)
+    if novo:
+        contagem, maior_id = index.signature
+        index.signature = (contagem + 1, max(maior_id, row['id']))
+
+
+def _remove_lote(index: LoteSearchIndex, lote_id: Any):
+    if lote_id not in index.lotes:
+        return
+    index.remove_lote(lote_id)
+    contagem, maior_id = index.signature
+    if lote_id == maior_id:
+        maior_id = max(index.lotes, default=0)
+    index.signature = (contagem - 1, maior_id)
+
+
+def _remove_item(index: LoteSearchIndex, item_id: Any):
+    for lote_id in list(index.por_item.get(item_id, ())):
+        _remove_lote(index, lote_id)
+    index.remove_item(item_id)
+
+
+def apply_lote(row: Optional[Dict[str, Any]]):
+    """Lote criado/atualizado (aceita linha parcial; só campos indexados importam)."""
+    if not row or row.get('id') is None:
+        return
+    _delta(_apply_lote, dict(row))
+
+
+def remove_lote(lote_id: Any):
+    """Lote excluído."""
+    _delta(_remove_lote, lote_id)
+
+
+def apply_item(row: Optional[Dict[str, Any]]):
+    """Item criado/atualizado: recopia codigo/descricao/endereco nos lotes dele."""
+    if not row or row.get('id') is None:
+        return
+    _delta(LoteSearchIndex.upsert_item, dict(row))
+
+
+def remove_item(item_id: Any):
+    """Item excluído (os lotes dele saem junto)."""
+    _delta(_remove_item, item_id)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Catálogo - Cache em memória (read-through) de item_estoque e consumivel_estoque
+Várias páginas e APIs baixavam a tabela inteira a cada requisição (métricas e
+snapshot do dashboard, /consumivel, /consumivel/movimentacao). Aqui cada tabela
+é carregada uma vez numa projeção estreita e servida da memória.
+
+Consistência:
+- as escritas feitas pela aplicação (helpers de database_helpers, movimentacoes,
+  importacao e as rotas que gravam direto) aplicam a linha no cache ou o invalidam;
+- alterações feitas fora da aplicação são detectadas a cada CATALOGO_TTL segundos
+  por uma assinatura barata (contagem e maior id) e, no limite, pela idade máxima
+  CATALOGO_MAX_AGE, que força a recarga (edições externas que não mudam a assinatura);
+- verificação e recarga rodam fora do lock, uma thread por tabela; enquanto isso as
+  demais leituras seguem com a cópia atual e os deltas são reaplicados na cópia nova.
+"""
+
+import os
+import time
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from supabase_client import supabase, select_all, capture_failures, record_failure
+
+# Intervalo (segundos) entre verificações de alterações externas
+CATALOGO_TTL: int = int(os.getenv('CATALOGO_TTL', '30'))
+# Idade máxima (segundos) antes de recarregar a tabela inteira
+CATALOGO_MAX_AGE: int = int(os.getenv('CATALOGO_MAX_AGE', '600'))
+
+# Projeções estreitas: só o que as listagens, a busca e o dashboard usam
+CAMPOS = {
+    'item_estoque': ('id', 'codigo', 'descricao', 'codigo_opcional', 'endereco', 'un', 'tipo',
+                     'qtd_estoque', 'estoque_minimo'),
+    'consumivel_estoque': ('id', 'n_produto', 'codigo_produto', 'descricao', 'categoria', 'unidade_medida',
+                           'quantidade_atual', 'estoque_minimo', 'status_consumo'),
+}
+
+_lock = threading.RLock()
+_tabelas: Dict[str, 'TabelaCatalogo'] = {}
+_cargas = itertools.count(1)
+_stats = {'hits': 0, 'misses': 0, 'verificacoes': 0, 'recargas_externas': 0}
+# Carga/verificação em andamento por tabela (fora de _lock) e deltas recebidos enquanto isso
+_carregando: Dict[str, threading.Event] = {}
+_deltas: Dict[str, List[Tuple[str, Any]]] = {}
+
+
+class TabelaCatalogo:
+    """Linhas de uma tabela por id + assinatura (contagem, maior id) da carga."""
+
+    def __init__(self, table: str, rows: List[Dict[str, Any]]):
+        self.table = table
+        self.rows: Dict[Any, Dict[str, Any]] = {r['id']: r for r in rows}
+        self.signature: Tuple[int, Any] = (len(self.rows), max(self.rows, default=0))
+        self.built_at = time.monotonic()
+        self.checked_at = self.built_at
+        self.carga = next(_cargas)
+
+    def upsert(self, row: Dict[str, Any]):
+        campos = CAMPOS[self.table]
+        novo = row['id'] not in self.rows
+        atual = self.rows.setdefault(row['id'], {campo: None for campo in campos})
+        atual.update({k: v for k, v in row.items() if k in campos})
+        if novo:
+            contagem, maior_id = self.signature
+            self.signature = (contagem + 1, max(maior_id, row['id']))
+
+    def remove(self, row_id: Any):
+        if self.rows.pop(row_id, None) is None:
+            return
+        contagem, maior_id = self.signature
+        if row_id == maior_id:
+            maior_id = max(self.rows, default=0)
+        self.signature = (contagem - 1, maior_id)
+
+
+# ============================================================
+# CICLO DE VIDA
+# ============================================================
+
+def _signature(table: str) -> Optional[Tuple[int, Any]]:
+    """(contagem, maior id) - detecta inserções/exclusões feitas fora da aplicação."""
+    if not supabase:
+        return None
+    try:
+        response = supabase.table(table).select('id', count='exact') \
+            .order('id', desc=True).limit(1).execute()
+        maior_id = response.data[0]['id'] if response.data else 0
+        return (response.count or 0, maior_id)
+    except Exception as e:
+        print(f"⚠️ Catálogo: falha ao verificar assinatura de {table}: {e}")
+        return None
+
+
+def _carregar(table: str) -> TabelaCatalogo:
+    rows = select_all(table, columns=', '.join(CAMPOS[table]), order_by='id')
+    return TabelaCatalogo(table, rows)
+
+
+def _acao(tabela: Optional[TabelaCatalogo]) -> str:
+    """'usar', 'verificar' (assinatura) ou 'recarregar' - decisão local, sem rede."""
+    if tabela is None:
+        return 'recarregar'
+    agora = time.monotonic()
+    if agora - tabela.built_at > CATALOGO_MAX_AGE:
+        return 'recarregar'
+    if agora - tabela.checked_at < CATALOGO_TTL:
+        return 'usar'
+    return 'verificar'
+
+
+def _instalar(table: str, nova: TabelaCatalogo):
+    """Troca a tabela (chamar com _lock) reaplicando os deltas recebidos durante a carga."""
+    for operacao, valor in _deltas.get(table, ()):
+        if operacao == 'upsert':
+            nova.upsert(valor)
+        elif operacao == 'remove':
+            nova.remove(valor)
+        else:
+            # Invalidada durante a carga: a cópia pode ser anterior à escrita
+            nova.built_at = float('-inf')
+    _tabelas[table] = nova
+
+
+def _atualizar(table: str, tabela: Optional[TabelaCatalogo], acao: str) -> TabelaCatalogo:
+    """Verifica a assinatura e/ou recarrega fora de _lock (só uma thread por tabela)."""
+    if acao == 'verificar':
+        with _lock:
+            _stats['verificacoes'] += 1
+        signature = _signature(table)
+        if signature is None or signature == tabela.signature:
+            tabela.checked_at = time.monotonic()
+            return tabela
+        with _lock:
+            _stats['recargas_externas'] += 1
+
+    with _lock:
+        _stats['misses'] += 1
+    with capture_failures() as falhas:
+        try:
+            nova = _carregar(table)
+        except Exception as e:
+            erro = e
+        else:
+            with _lock:
+                _instalar(table, nova)
+            return nova
+    if tabela is None:
+        for falha in falhas:
+            record_failure(**falha)
+        raise erro
+    # Banco indisponível: segue com a cópia antiga (não conta como falha para quem leu)
+    # e tenta de novo na próxima verificação
+    print(f"⚠️ Catálogo: falha ao recarregar {table}, usando cópia em memória: {erro}")
+    tabela.checked_at = time.monotonic()
+    return tabela
+
+
+def _get(table: str) -> TabelaCatalogo:
+    """
+    Tabela em cache, verificada/recarregada quando preciso.
+
+    A consulta ao banco roda fora de _lock e uma única thread por tabela a faz; as
+    demais seguem com a cópia atual, ou esperam se ainda não há nenhuma.
+    """
+    while True:
+        with _lock:
+            tabela = _tabelas.get(table)
+            acao = _acao(tabela)
+            if acao == 'usar':
+                _stats['hits'] += 1
+                return tabela
+            carregando = _carregando.get(table)
+            if carregando is None:
+                _carregando[table] = threading.Event()
+                _deltas[table] = []
+                break
+            if tabela is not None:
+                _stats['hits'] += 1
+                return tabela
+        carregando.wait()
+
+    try:
+        return _atualizar(table, tabela, acao)
+    finally:
+        with _lock:
+            _deltas.pop(table, None)
+            _carregando.pop(table).set()
+
+
+def get_rows(table: str, order_by: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Cópia das linhas em cache ('-coluna' ordena decrescente; None por último)."""
+    tabela = _get(table)
+    with _lock:
+        rows = [dict(r) for r in tabela.rows.values()]
+    if order_by:
+        desc = order_by.startswith('-')
+        col = order_by.lstrip('-')
+        com_valor = [r for r in rows if r.get(col) is not None]
+        sem_valor = [r for r in rows if r.get(col) is None]
+        rows = sorted(com_valor, key=lambda r: r[col], reverse=desc) + sem_valor
+    return rows
+
+
+def carga(table: str) -> int:
+    """
+    Número da carga atual da tabela (verificando/recarregando como numa leitura).
+    Muda a cada recarga: quem deriva estruturas do catálogo reconstrói quando ele muda.
+    """
+    return _get(table).carga
+
+
+def itens(order_by: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Projeção estreita de item_estoque."""
+    return get_rows('item_estoque', order_by)
+
+
+def consumiveis(order_by: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Projeção estreita de consumivel_estoque."""
+    return get_rows('consumivel_estoque', order_by)
+
+
+def invalidate(table: Optional[str] = None):
+    """Descarta uma tabela (ou todas); a próxima leitura recarrega."""
+    with _lock:
+        for carregando in ([table] if table is not None else list(_deltas)):
+            if carregando in _deltas:
+                _deltas[carregando].append(('invalidate', None))
+        if table is None:
+            _tabelas.clear()
+        else:
+            _tabelas.pop(table, None)
+
+
+def stats() -> Dict[str, Any]:
+    """Contadores de hit/miss e tamanho de cada tabela em cache."""
+    with _lock:
+        return dict(_stats, linhas={t: len(tab.rows) for t, tab in _tabelas.items()})
+
+
+# ============================================================
+# DELTAS (chamados pelas escritas da aplicação)
+# ============================================================
+
+def apply_row(table: str, row: Optional[Dict[str, Any]]):
+    """Linha criada/atualizada (aceita linha parcial; só campos do catálogo importam)."""
+    if not row or row.get('id') is None:
+        return
+    with _lock:
+        tabela = _tabelas.get(table)
+        if tabela is not None:
+            tabela.upsert(row)
+        if table in _deltas:
+            _deltas[table].append(('upsert', dict(row)))
+
+
+def remove_row(table: str, row_id: Any):
+    """Linha excluída."""
+    with _lock:
+        tabela = _tabelas.get(table)
+        if tabela is not None:
+            tabela.remove(row_id)
+        if table in _deltas:
+            _deltas[table].append(('remove', row_id))
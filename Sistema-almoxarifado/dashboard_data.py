@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Dashboard Data - Carregamento paralelo dos dados do /dashboard
+Dispara as consultas independentes ao Supabase em um pool de threads limitado,
+de modo que a latência da página fique próxima à da consulta mais lenta
+(e não à soma de todas).
+"""
+
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from supabase_client import capture_failures, SupabaseQueryError
+from database_helpers import (
+    get_items_dashboard, get_lotes_alerta,
+    get_recent_movimentacoes, get_all_consumiveis, get_movimentacoes_consumivel
+)
+import movimentacao_diaria
+
+# Pool compartilhado por todas as requisições do processo
+DASHBOARD_MAX_WORKERS: int = int(os.getenv('DASHBOARD_MAX_WORKERS', '8'))
+# Tempo máximo (segundos) que cada consulta pode levar antes de ser descartada
+DASHBOARD_QUERY_TIMEOUT: float = float(os.getenv('DASHBOARD_QUERY_TIMEOUT', '5'))
+
+# Janela do gráfico de movimentações e dos alertas de validade (dias)
+CHART_DAYS = 15
+ALERT_DAYS = 40
+# Quantas movimentações recentes guardamos (sobra para absorver exclusões)
+RECENT_KEEP = 20
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_MAX_WORKERS, thread_name_prefix='dashboard')
+
+
+class DashboardQuery:
+    """Uma consulta independente do dashboard: função, valor padrão e timeout."""
+
+    def __init__(self, name: str, func: Callable[[], Any], default: Any,
+                 timeout: Optional[float] = None):
+        self.name = name
+        self.func = func
+        self.default = default
+        self.timeout = timeout if timeout is not None else DASHBOARD_QUERY_TIMEOUT
+
+
+class DashboardData:
+    """Resultado combinado das consultas do dashboard."""
+
+    def __init__(self, hoje: date, results: Dict[str, Any],
+                 failures: List[str], timings: Dict[str, float]):
+        self.hoje = hoje
+        self.results = results
+        self.failures = failures      # consultas que falharam ou estouraram o timeout
+        self.timings = timings        # duração (ms) de cada consulta concluída
+
+    def __getitem__(self, name: str) -> Any:
+        return self.results[name]
+
+    @property
+    def incomplete(self) -> bool:
+        return bool(self.failures)
+
+
+def bucket_movimentacoes_por_dia(movimentacoes: List[Dict]) -> Dict[str, Dict[str, float]]:
+    """Agrega entradas/saídas por dia ('YYYY-MM-DD') a partir das movimentações brutas."""
+    por_dia: Dict[str, Dict[str, float]] = {}
+
+    for mov in movimentacoes:
+        dia = datetime.fromisoformat(mov['data_movimentacao']).strftime('%Y-%m-%d')
+        qtd = mov.get('quantidade', 0)
+        tipo = mov.get('tipo', '')
+
+        bucket = por_dia.setdefault(dia, {'entradas': 0, 'saidas': 0})
+        if 'ENTRADA' in tipo:
+            bucket['entradas'] += qtd
+        elif 'SAIDA' in tipo:
+            bucket['saidas'] += qtd
+
+    return por_dia
+
+
+def build_movimentacoes_chart(por_dia: Dict[str, Dict[str, float]], hoje: date) -> Dict[str, List]:
+    """Monta os dados do gráfico dos últimos 15 dias a partir dos totais diários."""
+    dias = [hoje - timedelta(days=i) for i in range(CHART_DAYS - 1, -1, -1)]
+    chaves = [d.strftime('%Y-%m-%d') for d in dias]
+
+    return {
+        'labels': [d.strftime('%d/%m') for d in dias],
+        'entradas': [por_dia.get(k, {}).get('entradas', 0) for k in chaves],
+        'saidas': [por_dia.get(k, {}).get('saidas', 0) for k in chaves]
+    }
+
+
+def dashboard_queries(hoje: date) -> List[DashboardQuery]:
+    """Lista das consultas independentes que compõem o dashboard."""
+    data_inicio_grafico = (hoje - timedelta(days=CHART_DAYS)).strftime('%Y-%m-%d')
+    return [
+        DashboardQuery('items', get_items_dashboard, []),
+        DashboardQuery('lotes_alerta', lambda: get_lotes_alerta(days=ALERT_DAYS), []),
+        # Totais diários já agrupados no banco (itens × dias × tipos linhas), não o livro
+        DashboardQuery('movimentos_grafico', lambda: movimentacao_diaria.carregar(inicio=data_inicio_grafico), []),
+        DashboardQuery('recent_movimentacoes', lambda: get_recent_movimentacoes(limit=RECENT_KEEP), []),
+        DashboardQuery('consumiveis', get_all_consumiveis, []),
+        DashboardQuery('recent_consumivel_moves', lambda: get_movimentacoes_consumivel(limit=RECENT_KEEP), []),
+    ]
+
+
+def run_parallel(queries: List[DashboardQuery]) -> tuple:
+    """
+    Executa as consultas no pool e aguarda cada uma até o seu próprio timeout.
+
+    Returns:
+        (results, failures, timings) - consultas que falharem ou expirarem
+        recebem o valor padrão e entram em `failures`.
+    """
+    def timed(func):
+        start = time.perf_counter()
+        # Os helpers devolvem [] em caso de erro: sem isso o dashboard mostraria zeros como se fossem dados
+        with capture_failures() as falhas:
+            value = func()
+        if falhas:
+            raise SupabaseQueryError('; '.join(f"{f['operation']} ({f['error_kind']})" for f in falhas),
+                                     falhas[0]['error_kind'])
+        return value, (time.perf_counter() - start) * 1000
+
+    submitted_at = time.monotonic()
+    # Cada tarefa roda em uma cópia do contexto atual, preservando o contexto Flask (g, request)
+    futures = {
+        q.name: _executor.submit(contextvars.copy_context().run, timed, q.func)
+        for q in queries
+    }
+
+    results: Dict[str, Any] = {}
+    failures: List[str] = []
+    timings: Dict[str, float] = {}
+
+    for q in queries:
+        remaining = max(0.0, q.timeout - (time.monotonic() - submitted_at))
+        try:
+            results[q.name], timings[q.name] = futures[q.name].result(timeout=remaining)
+        except FuturesTimeoutError:
+            print(f"⚠️ Dashboard: consulta '{q.name}' excedeu {q.timeout}s")
+            futures[q.name].cancel()
+            results[q.name] = q.default
+            failures.append(q.name)
+        except Exception as e:
+            print(f"❌ Dashboard: erro na consulta '{q.name}': {e}")
+            results[q.name] = q.default
+            failures.append(q.name)
+
+    return results, failures, timings
+
+
+def load_dashboard_data(hoje: Optional[date] = None) -> DashboardData:
+    """Carrega todos os dados do dashboard em paralelo."""
+    hoje = hoje or date.today()
+    results, failures, timings = run_parallel(dashboard_queries(hoje))
+    return DashboardData(hoje, results, failures, timings)
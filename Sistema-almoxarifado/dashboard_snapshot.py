@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Dashboard Snapshot - Payload materializado do /dashboard e do /api/kpis
+Mantém em memória o estado bruto que alimenta o dashboard (catálogo estreito de
+itens, lotes em alerta, totais diários de movimentação, consumíveis e atividade
+recente). Cada rota de escrita aplica um delta no snapshot em vez de forçar um
+recálculo completo; o recálculo completo só acontece quando o snapshot expira.
+
+O recálculo roda fora do lock, uma thread por vez; as leituras seguem com a cópia
+atual e os deltas que chegam enquanto isso são reaplicados na cópia nova (ver
+_instalar para os totais do gráfico, que não podem ser somados duas vezes).
+
+Opcionalmente (DASHBOARD_SNAPSHOT_PERSIST=1) cada recálculo completo é gravado na
+tabela `dashboard_snapshot` (ver sql/dashboard_snapshot.sql) para que instâncias
+serverless recém-iniciadas não precisem recalcular tudo.
+"""
+
+import os
+import copy
+import time
+import threading
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from supabase_client import supabase
+from models import ItemEstoque, Movimentacao, EstoqueDetalhe, ConsumivelEstoque, MovimentacaoConsumivel
+from dashboard_data import (
+    load_dashboard_data, bucket_movimentacoes_por_dia, build_movimentacoes_chart,
+    CHART_DAYS, ALERT_DAYS, RECENT_KEEP
+)
+import movimentacao_diaria
+
+# Idade máxima (segundos) antes de um recálculo completo
+SNAPSHOT_TTL: int = int(os.getenv('DASHBOARD_SNAPSHOT_TTL', '300'))
+# Snapshot montado com consultas falhas expira bem antes
+SNAPSHOT_INCOMPLETE_TTL: int = 30
+SNAPSHOT_PERSIST: bool = os.getenv('DASHBOARD_SNAPSHOT_PERSIST', '').lower() in ('1', 'true', 'sim')
+SNAPSHOT_TABLE = 'dashboard_snapshot'
+
+CRITICAL_DAYS = 30
+
+ITEM_FIELDS = ('id', 'codigo', 'descricao', 'endereco', 'un', 'tipo', 'qtd_estoque', 'estoque_minimo')
+LOTE_FIELDS = ('id', 'item_estoque_id', 'lote', 'item_nf', 'nf', 'validade', 'estacao', 'quantidade')
+
+_lock = threading.RLock()
+_snapshot: Optional['DashboardSnapshot'] = None
+# Recálculo em andamento: {'pronto': Event, 'deltas': [(instante, metodo, args, kwargs)]}
+_construcao: Optional[Dict[str, Any]] = None
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _key(value: Any) -> str:
+    return str(value)
+
+
+def _descricao_valida(descricao: Optional[str]) -> bool:
+    return descricao is not None and descricao not in ('', '-', '=')
+
+
+class DashboardSnapshot:
+    """Estado bruto do dashboard + carimbo de versão."""
+
+    def __init__(self, payload: Dict[str, Any]):
+        self.payload = payload
+        self._context_cache: Optional[tuple] = None
+
+    # --- Metadados -------------------------------------------------------
+
+    @property
+    def version(self) -> int:
+        return self.payload['version']
+
+    @property
+    def updated_at(self) -> str:
+        return self.payload['updated_at']
+
+    @property
+    def incomplete(self) -> bool:
+        return self.payload.get('incomplete', False)
+
+    def is_expired(self, hoje: date) -> bool:
+        if self.payload.get('built_on') != hoje.isoformat():
+            return True  # virada do dia muda as janelas de validade e do gráfico
+        provisorio = self.incomplete or self.payload.get('provisorio', False)
+        ttl = SNAPSHOT_INCOMPLETE_TTL if provisorio else SNAPSHOT_TTL
+        built_at = datetime.fromisoformat(self.payload['built_at'])
+        return (datetime.now() - built_at).total_seconds() > ttl
+
+    def touch(self):
+        """Marca uma alteração incremental: nova versão, caches derivados descartados."""
+        self.payload['version'] += 1
+        self.payload['updated_at'] = _now_iso()
+        self._context_cache = None
+
+    # --- Deltas -----------------------------------------------------------
+
+    def apply_item(self, row: Dict[str, Any]):
+        items = self.payload['items']
+        atual = items.setdefault(_key(row['id']), {})
+        atual.update({k: row[k] for k in ITEM_FIELDS if k in row})
+
+    def remove_item(self, item_id: Any):
+        self.payload['items'].pop(_key(item_id), None)
+        lotes = self.payload['lotes_alerta']
+        for lote_id in [k for k, l in lotes.items() if _key(l['item_estoque_id']) == _key(item_id)]:
+            del lotes[lote_id]
+
+    def apply_lote(self, row: Dict[str, Any]):
+        lotes = self.payload['lotes_alerta']
+        chave = _key(row['id'])
+        lote = dict(lotes.get(chave, {}))
+        lote.update({k: row[k] for k in LOTE_FIELDS if k in row})
+
+        limite = (date.fromisoformat(self.payload['built_on']) + timedelta(days=ALERT_DAYS)).isoformat()
+        validade = lote.get('validade')
+        if validade and validade[:10] <= limite and float(lote.get('quantidade') or 0) > 0:
+            lotes[chave] = lote
+        else:
+            lotes.pop(chave, None)
+
+    def remove_lote(self, lote_id: Any):
+        self.payload['lotes_alerta'].pop(_key(lote_id), None)
+
+    def apply_movimentacao(self, row: Dict[str, Any], sinal: int = 1, grafico: bool = True):
+        """
+        Soma (sinal=1) ou estorna (sinal=-1) uma movimentação nos totais diários e na
+        atividade recente; grafico=False só atualiza a atividade recente.
+        """
+        row = dict(row)
+        row['data_movimentacao'] = row.get('data_movimentacao') or _now_iso()
+        row.pop('item_estoque', None)
+
+        inicio = (date.fromisoformat(self.payload['built_on']) - timedelta(days=CHART_DAYS)).isoformat()
+        por_dia = self.payload['movimentos_por_dia'] if grafico else {}
+        for dia, valores in bucket_movimentacoes_por_dia([row]).items():
+            if dia < inicio:
+                continue
+            bucket = por_dia.setdefault(dia, {'entradas': 0, 'saidas': 0})
+            bucket['entradas'] += sinal * valores['entradas']
+            bucket['saidas'] += sinal * valores['saidas']
+
+        self.payload['recent_movimentacoes'] = self._merge_recent(
+            self.payload['recent_movimentacoes'], row, remover=(sinal < 0))
+
+    def apply_consumivel(self, row: Dict[str, Any]):
+        consumiveis = self.payload['consumiveis']
+        atual = consumiveis.setdefault(_key(row['id']), {})
+        atual.update(row)
+
+    def remove_consumivel(self, consumivel_id: Any):
+        self.payload['consumiveis'].pop(_key(consumivel_id), None)
+        self.payload['recent_consumivel_moves'] = [
+            m for m in self.payload['recent_consumivel_moves']
+            if _key(m.get('consumivel_id')) != _key(consumivel_id)
+        ]
+
+    def apply_movimentacao_consumivel(self, row: Dict[str, Any]):
+        row = dict(row)
+        row['data_movimentacao'] = row.get('data_movimentacao') or _now_iso()
+        row.pop('consumivel_estoque', None)
+        self.payload['recent_consumivel_moves'] = self._merge_recent(
+            self.payload['recent_consumivel_moves'], row)
+
+    @staticmethod
+    def _merge_recent(recentes: List[Dict], row: Dict, remover: bool = False) -> List[Dict]:
+        restantes = [m for m in recentes if m.get('id') is None or m.get('id') != row.get('id')]
+        if not remover:
+            restantes.append(row)
+        restantes.sort(key=lambda m: m.get('data_movimentacao') or '', reverse=True)
+        return restantes[:RECENT_KEEP]
+
+    # --- Leitura ------------------------------------------------------------
+
+    def derived(self, hoje: date) -> Dict[str, Any]:
+        """Listas e totais derivados (dicts crus), memorizados por versão."""
+        if self._context_cache and self._context_cache[0] == (self.version, hoje):
+            return self._context_cache[1]
+
+        items = self.payload['items']
+        itens = list(items.values())
+
+        tipos_count: Dict[str, int] = {}
+        for item in itens:
+            tipo = item.get('tipo') or 'Não categorizado'
+            tipos_count[tipo] = tipos_count.get(tipo, 0) + 1
+
+        validos = [i for i in itens if _descricao_valida(i.get('descricao'))]
+        top = sorted(validos, key=lambda i: i.get('qtd_estoque') or 0, reverse=True)[:5]
+        candidatos_low = sorted(
+            (i for i in validos if (i.get('qtd_estoque') or 0) > 0),
+            key=lambda i: i.get('qtd_estoque') or 0
+        )[:100]
+        low = [
+            i for i in candidatos_low
+            if (i.get('qtd_estoque') or 0) <= (i['estoque_minimo'] if i.get('estoque_minimo') is not None else 5)
+        ][:5]
+
+        def com_item(lote: Dict) -> Dict:
+            item = items.get(_key(lote.get('item_estoque_id'))) or {}
+            return dict(lote, item_estoque={k: item.get(k) for k in ('id', 'codigo', 'descricao', 'endereco', 'un')})
+
+        lotes = sorted(self.payload['lotes_alerta'].values(), key=lambda l: (l.get('validade') or '', l['id']))
+        hoje_iso = hoje.isoformat()
+        limite_critico = (hoje + timedelta(days=CRITICAL_DAYS)).isoformat()
+        limite_alerta = (hoje + timedelta(days=ALERT_DAYS)).isoformat()
+
+        def mov_com_item(mov: Dict) -> Dict:
+            item = items.get(_key(mov.get('item_id'))) or {}
+            return dict(mov, item_estoque={'codigo': item.get('codigo'), 'descricao': item.get('descricao')})
+
+        consumiveis_map = self.payload['consumiveis']
+        consumiveis = list(consumiveis_map.values())
+
+        def mov_com_consumivel(mov: Dict) -> Dict:
+            return dict(mov, consumivel_estoque=consumiveis_map.get(_key(mov.get('consumivel_id'))))
+
+        derived = {
+            'total_items_distintos': len(itens),
+            'total_unidades': sum(i.get('qtd_estoque') or 0 for i in itens),
+            'itens_zerados': sum(1 for i in itens if (i.get('qtd_estoque') or 0) == 0),
+            'tipos_chart_data': {'labels': list(tipos_count.keys()), 'counts': list(tipos_count.values())},
+            'top_stocked_items': top,
+            'low_stocked_items': low,
+            'critical_lotes': [com_item(l) for l in lotes if l['validade'][:10] <= limite_critico],
+            'lotes_vencendo_hoje': [com_item(l) for l in lotes if l['validade'][:10] == hoje_iso],
+            'lotes_proximo_vencimento': [
+                com_item(l) for l in lotes if hoje_iso < l['validade'][:10] <= limite_alerta
+            ],
+            'movimentacoes_chart_data': build_movimentacoes_chart(self.payload['movimentos_por_dia'], hoje),
+            'recent_movimentacoes': [mov_com_item(m) for m in self.payload['recent_movimentacoes'][:5]],
+            'total_consumiveis': len(consumiveis),
+            'consumiveis_zerados': sum(1 for c in consumiveis if c.get('quantidade_atual', 0) == 0),
+            'consumiveis_baixo_estoque': sum(
+                1 for c in consumiveis
+                if c.get('quantidade_atual', 0) > 0 and c.get('quantidade_atual', 0) <= c.get('estoque_minimo', 0)
+            ),
+            'low_consumiveis': sorted(consumiveis, key=lambda c: c.get('quantidade_atual', 0))[:5],
+            'recent_consumivel_moves': [
+                mov_com_consumivel(m) for m in self.payload['recent_consumivel_moves'][:5]
+            ],
+        }
+        self._context_cache = ((self.version, hoje), derived)
+        return derived
+
+
+# ============================================================
+# CONSTRUÇÃO E PERSISTÊNCIA
+# ============================================================
+
+def build_snapshot(hoje: Optional[date] = None, version: int = 0) -> DashboardSnapshot:
+    """Recalcula o snapshot completo a partir do Supabase (consultas em paralelo)."""
+    hoje = hoje or date.today()
+    dados = load_dashboard_data(hoje)
+    agora = _now_iso()
+
+    payload = {
+        'version': version + 1,
+        'built_on': hoje.isoformat(),
+        'built_at': agora,
+        'updated_at': agora,
+        'incomplete': dados.incomplete,
+        'items': {_key(i['id']): {k: i.get(k) for k in ITEM_FIELDS} for i in dados['items']},
+        'lotes_alerta': {_key(l['id']): {k: l.get(k) for k in LOTE_FIELDS} for l in dados['lotes_alerta']},
+        'movimentos_por_dia': movimentacao_diaria.por_dia(dados['movimentos_grafico']),
+        'recent_movimentacoes': [
+            {k: v for k, v in m.items() if k != 'item_estoque'} for m in dados['recent_movimentacoes']
+        ],
+        'consumiveis': {_key(c['id']): c for c in dados['consumiveis']},
+        'recent_consumivel_moves': [
+            {k: v for k, v in m.items() if k != 'consumivel_estoque'} for m in dados['recent_consumivel_moves']
+        ],
+    }
+    return DashboardSnapshot(payload)
+
+
+def _load_persisted() -> Optional[DashboardSnapshot]:
+    if not (SNAPSHOT_PERSIST and supabase):
+        return None
+    try:
+        response = supabase.table(SNAPSHOT_TABLE).select('payload').eq('id', 1).limit(1).execute()
+        if response.data:
+            return DashboardSnapshot(response.data[0]['payload'])
+    except Exception as e:
+        print(f"⚠️ Snapshot: não foi possível ler a cópia persistida: {e}")
+    return None
+
+
+def _persist(snapshot: DashboardSnapshot):
+    """
+    Grava um recálculo completo (fora do lock). Só substitui a cópia persistida se
+    ela for de um recálculo anterior: uma instância mais lenta não sobrescreve outra.
+    """
+    if not (SNAPSHOT_PERSIST and supabase) or snapshot.incomplete:
+        return
+    with _lock:
+        payload = copy.deepcopy(snapshot.payload)
+    linha = {'id': 1, 'version': payload['version'], 'payload': payload, 'updated_at': payload['built_at']}
+    try:
+        response = supabase.table(SNAPSHOT_TABLE).update(linha) \
+            .eq('id', 1).lt('updated_at', payload['built_at']).execute()
+        if not response.data:
+            # Tabela vazia (primeira gravação) ou cópia mais nova já gravada: só insere se faltar
+            supabase.table(SNAPSHOT_TABLE).upsert(linha, ignore_duplicates=True).execute()
+    except Exception as e:
+        print(f"⚠️ Snapshot: falha ao persistir: {e}")
+
+
+def _instalar(novo: DashboardSnapshot, deltas: List[tuple], lido_em: float):
+    """
+    Troca o snapshot (chamar com _lock) reaplicando os deltas recebidos durante o recálculo.
+
+    Deltas de itens, lotes e consumíveis gravam valores absolutos e a atividade recente
+    é mesclada por id: reaplicar em ordem é seguro. Já a soma no gráfico só é refeita
+    para movimentações cujo delta chegou depois das leituras (`lido_em`); as que chegaram
+    durante as leituras podem já estar nos totais lidos, então não são somadas e o
+    snapshot fica provisório (expira em SNAPSHOT_INCOMPLETE_TTL e se corrige).
+    """
+    global _snapshot
+    for instante, metodo, args, kwargs in deltas:
+        if metodo == 'invalidate':
+            novo.payload['built_at'] = datetime.min.isoformat()
+            continue
+        if metodo == 'apply_movimentacao' and instante <= lido_em:
+            novo.payload['provisorio'] = True
+            kwargs = dict(kwargs, grafico=False)
+        try:
+            getattr(novo, metodo)(*args, **kwargs)
+        except Exception as e:
+            print(f"⚠️ Snapshot: delta '{metodo}' falhou ao reaplicar ({e}); forçando recálculo")
+            novo.payload['built_at'] = datetime.min.isoformat()
+    if deltas:
+        novo.touch()
+    _snapshot = novo
+
+
+def _reconstruir(hoje: date, anterior: Optional[DashboardSnapshot], deltas: List[tuple]) -> DashboardSnapshot:
+    """Cópia persistida (partida a frio) ou recálculo completo, fora do lock."""
+    if anterior is None:
+        persistido = _load_persisted()
+        if persistido is not None and not persistido.is_expired(hoje):
+            lido_em = time.monotonic()
+            with _lock:
+                _instalar(persistido, deltas, lido_em)
+                return _snapshot
+        anterior = persistido
+
+    novo = build_snapshot(hoje, version=anterior.version if anterior else 0)
+    lido_em = time.monotonic()
+    with _lock:
+        _instalar(novo, deltas, lido_em)
+        snapshot = _snapshot
+    _persist(snapshot)
+    return snapshot
+
+
+def get_snapshot(hoje: Optional[date] = None) -> DashboardSnapshot:
+    """
+    Retorna o snapshot atual, recalculando-o se estiver ausente ou expirado.
+
+    Só uma thread recalcula; as demais seguem com a cópia atual, ou esperam se
+    ainda não há nenhuma.
+    """
+    global _construcao
+    hoje = hoje or date.today()
+
+    while True:
+        with _lock:
+            if _snapshot is not None and not _snapshot.is_expired(hoje):
+                return _snapshot
+            construcao = _construcao
+            if construcao is None:
+                construcao = _construcao = {'pronto': threading.Event(), 'deltas': []}
+                anterior = _snapshot
+                break
+            if _snapshot is not None:
+                return _snapshot
+        construcao['pronto'].wait()
+
+    try:
+        return _reconstruir(hoje, anterior, construcao['deltas'])
+    finally:
+        with _lock:
+            _construcao = None
+        construcao['pronto'].set()
+
+
+def invalidate():
+    """Descarta o snapshot em memória (próxima leitura recalcula tudo)."""
+    with _lock:
+        if _construcao is not None:
+            _construcao['deltas'].append((time.monotonic(), 'invalidate', (), {}))
+        if _snapshot is not None:
+            # Mantém a contagem de versões, mas força expiração
+            _snapshot.payload['built_at'] = datetime.min.isoformat()
+            _snapshot.touch()
+
+
+def _apply(metodo: str, *args, **kwargs):
+    """Aplica um delta no snapshot em memória (se existir) e o guarda para um recálculo em andamento."""
+    with _lock:
+        if _construcao is not None:
+            _construcao['deltas'].append((time.monotonic(), metodo, args, kwargs))
+        if _snapshot is None:
+            return  # nada materializado ainda; a próxima leitura monta do zero
+        try:
+            getattr(_snapshot, metodo)(*args, **kwargs)
+            _snapshot.touch()
+        except Exception as e:
+            print(f"⚠️ Snapshot: delta '{metodo}' falhou ({e}); forçando recálculo")
+            invalidate()
+
+
+# ============================================================
+# DELTAS (chamados pelas rotas de escrita)
+# ============================================================
+
+def apply_item(row: Optional[Dict[str, Any]]):
+    """Item criado/atualizado (aceita linha parcial, ex.: {'id': 1, 'qtd_estoque': 10})."""
+    if row:
+        _apply('apply_item', row)
+
+
+def remove_item(item_id: Any):
+    _apply('remove_item', item_id)
+
+
+def apply_lote(row: Optional[Dict[str, Any]]):
+    """Lote criado/atualizado: entra, sai ou é atualizado na lista de alertas de validade."""
+    if row:
+        _apply('apply_lote', row)
+
+
+def remove_lote(lote_id: Any):
+    _apply('remove_lote', lote_id)
+
+
+def apply_movimentacao(row: Optional[Dict[str, Any]]):
+    if row:
+        _apply('apply_movimentacao', row)
+
+
+def revert_movimentacao(row: Optional[Dict[str, Any]]):
+    if row:
+        _apply('apply_movimentacao', row, sinal=-1)
+
+
+def apply_consumivel(row: Optional[Dict[str, Any]]):
+    if row:
+        _apply('apply_consumivel', row)
+
+
+def remove_consumivel(consumivel_id: Any):
+    _apply('remove_consumivel', consumivel_id)
+
+
+def apply_movimentacao_consumivel(row: Optional[Dict[str, Any]]):
+    if row:
+        _apply('apply_movimentacao_consumivel', row)
+
+
+# ============================================================
+# LEITURA (dashboard e KPIs)
+# ============================================================
+
+def template_context(hoje: Optional[date] = None) -> Dict[str, Any]:
+    """Variáveis de templates/dashboard.html, montadas a partir do snapshot."""
+    hoje = hoje or date.today()
+    snapshot = get_snapshot(hoje)
+    with _lock:
+        d = copy.deepcopy(snapshot.derived(hoje))
+        version, updated_at, incomplete = snapshot.version, snapshot.updated_at, snapshot.incomplete
+
+    return dict(
+        total_items_distintos=d['total_items_distintos'],
+        total_unidades=d['total_unidades'],
+        itens_zerados=d['itens_zerados'],
+        critical_lotes=[EstoqueDetalhe(l) for l in d['critical_lotes']],
+        movimentacoes_chart_data=d['movimentacoes_chart_data'],
+        tipos_chart_data=d['tipos_chart_data'],
+        top_stocked_items=[ItemEstoque(i) for i in d['top_stocked_items']],
+        low_stocked_items=[ItemEstoque(i) for i in d['low_stocked_items']],
+        recent_movimentacoes=[Movimentacao(m) for m in d['recent_movimentacoes']],
+        lotes_vencendo_hoje=[EstoqueDetalhe(l) for l in d['lotes_vencendo_hoje']],
+        lotes_proximo_vencimento=[EstoqueDetalhe(l) for l in d['lotes_proximo_vencimento']],
+        today_date=hoje,
+        total_consumiveis=d['total_consumiveis'],
+        consumiveis_zerados=d['consumiveis_zerados'],
+        consumiveis_baixo_estoque=d['consumiveis_baixo_estoque'],
+        low_consumiveis=[ConsumivelEstoque(c) for c in d['low_consumiveis']],
+        recent_consumivel_moves=[MovimentacaoConsumivel(m) for m in d['recent_consumivel_moves']],
+        snapshot_version=version,
+        snapshot_updated_at=updated_at,
+        snapshot_incomplete=incomplete
+    )
+
+
+def kpis(hoje: Optional[date] = None) -> Dict[str, Any]:
+    """Payload do /api/kpis a partir do snapshot."""
+    hoje = hoje or date.today()
+    snapshot = get_snapshot(hoje)
+    with _lock:
+        d = snapshot.derived(hoje)
+        return copy.deepcopy({
+            'total_items_distintos': d['total_items_distintos'],
+            'total_unidades': d['total_unidades'],
+            'itens_zerados': d['itens_zerados'],
+            'critical_lotes': d['critical_lotes'],
+            'snapshot_version': snapshot.version,
+            'snapshot_updated_at': snapshot.updated_at
+        })
@@ -5,9 +5,19 @@ Database Helpers - Funções auxiliares para operações de banco de dados via S
 Substitui as operações SQLAlchemy mantendo a mesma interface
 """
 
+import os
 from typing import Optional, Dict, List, Any
-from supabase_client import supabase, select_one, select_many, insert_one, update_one, delete_one
+from datetime import datetime, timedelta
+from supabase_client import (
+    supabase, select_one, select_many, insert_one, update_one, delete_one, select_all,
+    invalidate_request_cache, load_by_id, load_many_by_id, select_page, count_rows, paginate_rows,
+    safe_execute, SupabaseQueryError
+)
 from flask import abort
+import busca_itens
+import busca_lotes
+import catalogo
+import movimentacao_diaria
 
 
 # ============================================================
@@ -19,7 +29,12 @@ def get_user_by_id(user_id: int) -> Optional[Dict]:
     Busca usuário por ID.
     Equivalente a: User.query.get(user_id)
     """
-    return select_one('user', {'id': user_id})
+    return load_by_id('user', user_id)
+
+
+def get_users_by_ids(user_ids: List[int]) -> Dict[int, Optional[Dict]]:
+    """Busca vários usuários de uma vez: {id: usuário ou None}"""
+    return load_many_by_id('user', user_ids)
 
 
 def get_user_by_username(username: str) -> Optional[Dict]:
@@ -84,7 +99,12 @@ def get_user_by_id_or_404(user_id: int) -> Dict:
 
 def get_item_estoque_by_id(item_id: int) -> Optional[Dict]:
     """Busca item de estoque por ID"""
-    return select_one('item_estoque', {'id': item_id})
+    return load_by_id('item_estoque', item_id)
+
+
+def get_items_estoque_by_ids(item_ids: List[int]) -> Dict[int, Optional[Dict]]:
+    """Busca vários itens de estoque de uma vez: {id: item ou None}"""
+    return load_many_by_id('item_estoque', item_ids)
 
 
 def get_item_estoque_by_codigo(codigo: str) -> Optional[Dict]:
@@ -93,23 +113,40 @@ def get_item_estoque_by_codigo(codigo: str) -> Optional[Dict]:
 
 
 def get_all_items_estoque(filters: Optional[Dict] = None, order_by: str = 'descricao') -> List[Dict]:
-    """Lista todos os itens de estoque"""
-    return select_many('item_estoque', filters=filters, order_by=order_by)
+    """Lista todos os itens de estoque (projeção estreita do catálogo em memória)"""
+    items = catalogo.itens(order_by)
+    if filters:
+        items = [i for i in items if all(str(i.get(k)) == str(v) for k, v in filters.items())]
+    return items
 
 
 def create_item_estoque(data: Dict[str, Any]) -> Optional[Dict]:
     """Cria um novo item de estoque"""
-    return insert_one('item_estoque', data)
+    item = insert_one('item_estoque', data)
+    busca_itens.apply_item(item)
+    busca_lotes.apply_item(item)
+    catalogo.apply_row('item_estoque', item)
+    return item
 
 
 def update_item_estoque(item_id: int, data: Dict[str, Any]) -> Optional[Dict]:
     """Atualiza um item de estoque"""
-    return update_one('item_estoque', {'id': item_id}, data)
+    item = update_one('item_estoque', {'id': item_id}, data)
+    if item:
+        busca_itens.apply_item(item)
+        busca_lotes.apply_item(item)
+        catalogo.apply_row('item_estoque', item)
+    return item
 
 
 def delete_item_estoque(item_id: int) -> bool:
     """Deleta um item de estoque"""
-    return delete_one('item_estoque', {'id': item_id})
+    success = delete_one('item_estoque', {'id': item_id})
+    if success:
+        busca_itens.remove_item(item_id)
+        busca_lotes.remove_item(item_id)
+        catalogo.remove_row('item_estoque', item_id)
+    return success
 
 
 # ============================================================
@@ -121,14 +158,31 @@ def get_estoque_detalhes_by_item(item_id: int) -> List[Dict]:
     return select_many('estoque_detalhe', filters={'item_estoque_id': item_id})
 
 
+def get_estoque_detalhe_by_id(detalhe_id: int) -> Optional[Dict]:
+    """Busca um detalhe de estoque (lote) por ID"""
+    return select_one('estoque_detalhe', {'id': detalhe_id})
+
+
 def create_estoque_detalhe(data: Dict[str, Any]) -> Optional[Dict]:
     """Cria um novo detalhe de estoque"""
-    return insert_one('estoque_detalhe', data)
+    detalhe = insert_one('estoque_detalhe', data)
+    busca_lotes.apply_lote(detalhe)
+    return detalhe
 
 
 def update_estoque_detalhe(detalhe_id: int, data: Dict[str, Any]) -> Optional[Dict]:
     """Atualiza um detalhe de estoque"""
-    return update_one('estoque_detalhe', {'id': detalhe_id}, data)
+    detalhe = update_one('estoque_detalhe', {'id': detalhe_id}, data)
+    busca_lotes.apply_lote(detalhe)
+    return detalhe
+
+
+def delete_estoque_detalhe(detalhe_id: int) -> bool:
+    """Deleta um detalhe de estoque"""
+    success = delete_one('estoque_detalhe', {'id': detalhe_id})
+    if success:
+        busca_lotes.remove_lote(detalhe_id)
+    return success
 
 
 # ============================================================
@@ -148,18 +202,23 @@ def get_item_movements_in_period(item_id: int, days: int = 90, tipo: str = 'SAID
     """Busca movimentações de um tipo específico nos últimos X dias"""
     try:
         start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-        response = supabase.table('movimentacao') \
-            .select('*') \
-            .eq('item_id', item_id) \
-            .eq('tipo', tipo) \
-            .gte('data_movimentacao', start_date) \
-            .order('data_movimentacao', desc=False) \
-            .execute()
-        return response.data if response.data else []
+        return select_all('movimentacao',
+                          filters={'item_id': item_id, 'tipo': tipo},
+                          order_by='data_movimentacao',
+                          refine=lambda q: q.gte('data_movimentacao', start_date))
     except Exception as e:
         print(f"❌ Erro get_item_movements_in_period: {str(e)}")
         return []
 
+def get_item_movimentacao_diaria(item_id: int, days: int = 90, tipo: Optional[str] = None) -> List[Dict]:
+    """Totais diários (movimentacao_diaria) de um item nos últimos X dias, opcionalmente de um tipo"""
+    try:
+        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        return movimentacao_diaria.carregar(start_date, item_id=item_id, tipo=tipo)
+    except Exception as e:
+        print(f"❌ Erro get_item_movimentacao_diaria: {str(e)}")
+        return []
+
 def get_all_movimentacoes(order_by: str = '-data_movimentacao', limit: Optional[int] = None) -> List[Dict]:
     """Lista todas as movimentações"""
     return select_many('movimentacao', order_by=order_by, limit=limit)
@@ -171,22 +230,40 @@ def get_all_movimentacoes(order_by: str = '-data_movimentacao', limit: Optional[
 
 def get_consumivel_by_id(consumivel_id: int) -> Optional[Dict]:
     """Busca consumível por ID"""
-    return select_one('consumivel_estoque', {'id': consumivel_id})
+    return load_by_id('consumivel_estoque', consumivel_id)
+
+
+def get_consumiveis_by_ids(consumivel_ids: List[int]) -> Dict[int, Optional[Dict]]:
+    """Busca vários consumíveis de uma vez: {id: consumível ou None}"""
+    return load_many_by_id('consumivel_estoque', consumivel_ids)
 
 
-def get_all_consumiveis(order_by: str = 'nome') -> List[Dict]:
-    """Lista todos os consumíveis"""
-    return select_many('consumivel_estoque', order_by=order_by)
+def get_all_consumiveis(order_by: str = 'codigo_produto') -> List[Dict]:
+    """Lista todos os consumíveis (projeção estreita do catálogo em memória)"""
+    return catalogo.consumiveis(order_by)
 
 
 def create_consumivel(data: Dict[str, Any]) -> Optional[Dict]:
     """Cria um novo consumível"""
-    return insert_one('consumivel_estoque', data)
+    consumivel = insert_one('consumivel_estoque', data)
+    catalogo.apply_row('consumivel_estoque', consumivel)
+    return consumivel
 
 
 def update_consumivel(consumivel_id: int, data: Dict[str, Any]) -> Optional[Dict]:
     """Atualiza um consumível"""
-    return update_one('consumivel_estoque', {'id': consumivel_id}, data)
+    consumivel = update_one('consumivel_estoque', {'id': consumivel_id}, data)
+    catalogo.apply_row('consumivel_estoque', consumivel)
+    return consumivel
+
+
+def delete_consumivel(consumivel_id: int) -> bool:
+    """Deleta um consumível e as movimentações dele"""
+    supabase.table('movimentacao_consumivel').delete().eq('consumivel_id', consumivel_id).execute()
+    success = delete_one('consumivel_estoque', {'id': consumivel_id})
+    if success:
+        catalogo.remove_row('consumivel_estoque', consumivel_id)
+    return success
 
 
 # ============================================================
@@ -246,37 +323,62 @@ def count_items_estoque(filters: Optional[Dict] = None) -> int:
 # DASHBOARD & REPORTS (Complex Aggregations)
 # ============================================================
 
+def get_items_for_metrics() -> List[Dict]:
+    """Busca apenas qtd_estoque e tipo de todos os itens (base das métricas do dashboard)"""
+    try:
+        return [{'qtd_estoque': i['qtd_estoque'], 'tipo': i['tipo']} for i in catalogo.itens()]
+    except Exception as e:
+        print(f"❌ Erro em get_items_for_metrics: {str(e)}")
+        return []
+
+def get_items_dashboard() -> List[Dict]:
+    """Projeção estreita de item_estoque usada pelo snapshot do dashboard"""
+    try:
+        return catalogo.itens()
+    except Exception as e:
+        print(f"❌ Erro em get_items_dashboard: {str(e)}")
+        return []
+
+def get_lotes_alerta(days=40):
+    """Lotes com saldo que vencem até hoje + X dias (inclui vencidos); base dos alertas do dashboard"""
+    try:
+        target_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+        return select_all('estoque_detalhe',
+                          columns='id, item_estoque_id, lote, item_nf, nf, validade, estacao, quantidade',
+                          order_by='validade',
+                          refine=lambda q: q.lte('validade', target_date).gt('quantidade', 0))
+    except Exception as e:
+        print(f"❌ Erro em get_lotes_alerta: {str(e)}")
+        return []
+
+def build_dashboard_metrics(total_items: int, items: List[Dict]) -> Dict:
+    """Monta o dicionário de métricas a partir da contagem e das linhas de itens já buscadas"""
+    total_unidades = sum(item.get('qtd_estoque', 0) for item in items)
+    itens_zerados = sum(1 for item in items if item.get('qtd_estoque', 0) == 0)
+    
+    # Agrupamento por Tipo (Pizza)
+    tipos_count = {}
+    for item in items:
+        tipo = item.get('tipo') or 'Não categorizado'
+        tipos_count[tipo] = tipos_count.get(tipo, 0) + 1
+        
+    tipos_chart_data = {
+        'labels': list(tipos_count.keys()),
+        'counts': list(tipos_count.values())
+    }
+    
+    return {
+        'total_items_distintos': total_items,
+        'total_unidades': total_unidades,
+        'itens_zerados': itens_zerados,
+        'tipos_chart_data': tipos_chart_data
+    }
+
 def get_dashboard_metrics():
     """Calcula métricas do dashboard via Python (para evitar complexidade SQL na API)"""
     try:
-        # Total Itens
-        total_items = count_items_estoque()
-        
-        # Total Unidades e Itens Zerados
-        # Buscamos qtd_estoque apenas para economizar banda
-        items_resp = supabase.table('item_estoque').select('qtd_estoque, tipo').execute()
-        items = items_resp.data if items_resp.data else []
-        
-        total_unidades = sum(item.get('qtd_estoque', 0) for item in items)
-        itens_zerados = sum(1 for item in items if item.get('qtd_estoque', 0) == 0)
-        
-        # Agrupamento por Tipo (Pizza)
-        tipos_count = {}
-        for item in items:
-            tipo = item.get('tipo') or 'Não categorizado'
-            tipos_count[tipo] = tipos_count.get(tipo, 0) + 1
-            
-        tipos_chart_data = {
-            'labels': list(tipos_count.keys()),
-            'counts': list(tipos_count.values())
-        }
-        
-        return {
-            'total_items_distintos': total_items,
-            'total_unidades': total_unidades,
-            'itens_zerados': itens_zerados,
-            'tipos_chart_data': tipos_chart_data
-        }
+        items = get_items_for_metrics()
+        return build_dashboard_metrics(len(items), items)
     except Exception as e:
         print(f"❌ Erro em get_dashboard_metrics: {str(e)}")
         return {
@@ -288,12 +390,9 @@ def get_critical_lotes(days=30):
     """Busca lotes vencendo nos próximos X dias"""
     try:
         target_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
-        response = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(codigo, descricao)') \
-            .lte('validade', target_date) \
-            .gt('quantidade', 0) \
-            .execute()
-        return response.data if response.data else []
+        return select_all('estoque_detalhe',
+                          columns='*, item_estoque(codigo, descricao)',
+                          refine=lambda q: q.lte('validade', target_date).gt('quantidade', 0))
     except Exception as e:
         print(f"❌ Erro em get_critical_lotes: {str(e)}")
         return []
@@ -311,40 +410,155 @@ def get_recent_movimentacoes(limit=5):
         print(f"❌ Erro em get_recent_movimentacoes: {str(e)}")
         return []
 
-def get_movimentacoes_report(data_inicio=None, data_fim=None, search_term=None):
-    """Relatório de movimentações com filtros"""
-    try:
-        query = supabase.table('movimentacao').select('*, item_estoque(codigo, descricao)')
-        
+# A busca do relatório vai ao servidor pela coluna movimentacao.busca (texto
+# denormalizado e indexado, ver sql/movimentacao_busca.sql). Se a coluna não estiver
+# instalada no banco, o relatório volta a filtrar em Python (e avisa uma vez).
+_busca_movimentacao_ausente = False
+
+
+def _termos_busca(search_term):
+    """Termos normalizados (como movimentacao.busca) com % e _ digitados escapados."""
+    termos = busca_itens.normalize_text(search_term).split() if search_term else []
+    return [t.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for t in termos]
+
+
+def _filtro_movimentacoes(data_inicio=None, data_fim=None, search_term=None):
+    """refine() do relatório: período e termos da busca (todos precisam aparecer)."""
+    termos = _termos_busca(search_term)
+
+    def filtro(query):
         if data_inicio:
             query = query.gte('data_movimentacao', data_inicio)
         if data_fim:
-             # Adiciona o final do dia
+            # Adiciona o final do dia
             query = query.lte('data_movimentacao', f"{data_fim} 23:59:59")
-            
-        response = query.order('data_movimentacao', desc=True).execute()
-        data = response.data if response.data else []
-        
-        # Filtro de texto em Python (mais flexível para joins com OR)
-        if search_term:
-            term = search_term.lower()
-            filtered = []
-            for mov in data:
-                item = mov.get('item_estoque', {}) or {}
-                # Verifica se search_term está em algum campo relevante
-                if (term in str(item.get('codigo', '')).lower() or
-                    term in str(item.get('descricao', '')).lower() or
-                    term in str(mov.get('lote', '')).lower() or
-                    term in str(mov.get('usuario', '')).lower() or
-                    term in str(mov.get('observacao', '')).lower()):
-                    filtered.append(mov)
-            data = filtered
-            
+        for termo in termos:
+            query = query.ilike('busca', f'%{termo}%')
+        return query
+    return filtro
+
+
+def _filtrar_movimentacoes_texto(data, search_term):
+    """Filtro antigo, em Python (só sem a coluna movimentacao.busca no banco)."""
+    term = search_term.lower()
+    filtered = []
+    for mov in data:
+        item = mov.get('item_estoque', {}) or {}
+        # Verifica se search_term está em algum campo relevante
+        if (term in str(item.get('codigo', '')).lower() or
+            term in str(item.get('descricao', '')).lower() or
+            term in str(mov.get('lote', '')).lower() or
+            term in str(mov.get('usuario', '')).lower() or
+            term in str(mov.get('observacao', '')).lower()):
+            filtered.append(mov)
+    return filtered
+
+
+def get_movimentacoes_report(data_inicio=None, data_fim=None, search_term=None):
+    """Relatório de movimentações com filtros (período e busca aplicados no servidor)"""
+    global _busca_movimentacao_ausente
+    try:
+        no_servidor = bool(search_term) and not _busca_movimentacao_ausente
+        colunas = '*, item_estoque(codigo, descricao)'
+        try:
+            data = select_all('movimentacao', columns=colunas, order_by='-data_movimentacao',
+                              refine=_filtro_movimentacoes(data_inicio, data_fim,
+                                                           search_term if no_servidor else None))
+        except SupabaseQueryError as e:
+            if not (no_servidor and '42703' in str(e)):
+                raise
+            print("⚠️ Coluna movimentacao.busca não instalada (ver sql/movimentacao_busca.sql); filtrando em Python")
+            _busca_movimentacao_ausente = True
+            no_servidor = False
+            data = select_all('movimentacao', columns=colunas, order_by='-data_movimentacao',
+                              refine=_filtro_movimentacoes(data_inicio, data_fim))
+
+        if search_term and not no_servidor:
+            data = _filtrar_movimentacoes_texto(data, search_term)
         return data
     except Exception as e:
         print(f"❌ Erro report movimentacoes: {str(e)}")
         return []
 
+
+# Colunas da página do relatório (tabela de movimentações)
+RELATORIO_COLUNAS = '*, item_estoque(id, codigo, descricao)'
+
+
+def get_movimentacoes_report_page(data_inicio=None, data_fim=None, search_term=None,
+                                  per_page=100, after=None, before=None):
+    """
+    Uma página do relatório de movimentações, por cursor (mais recentes primeiro).
+    Mesmos filtros de get_movimentacoes_report; o custo não depende do tamanho do período.
+
+    Returns:
+        {'items', 'next_cursor', 'prev_cursor'}
+    """
+    global _busca_movimentacao_ausente
+    vazia = {'items': [], 'next_cursor': None, 'prev_cursor': None}
+    try:
+        if not (search_term and _busca_movimentacao_ausente):
+            try:
+                pagina = select_page('movimentacao', columns=RELATORIO_COLUNAS, order_by='-data_movimentacao',
+                                     size=per_page, after=after, before=before,
+                                     refine=_filtro_movimentacoes(data_inicio, data_fim, search_term))
+                return dict(vazia, items=pagina['rows'], next_cursor=pagina['next_cursor'],
+                            prev_cursor=pagina['prev_cursor'])
+            except SupabaseQueryError as e:
+                if not (search_term and '42703' in str(e)):
+                    raise
+                print("⚠️ Coluna movimentacao.busca não instalada (ver sql/movimentacao_busca.sql); filtrando em Python")
+                _busca_movimentacao_ausente = True
+
+        # Contingência sem a coluna de busca: filtra o período todo e pagina a lista
+        rows = get_movimentacoes_report(data_inicio, data_fim, search_term)
+        pagina = paginate_rows(rows, order_by='-data_movimentacao', size=per_page, after=after, before=before)
+        return dict(vazia, items=pagina['rows'], next_cursor=pagina['next_cursor'],
+                    prev_cursor=pagina['prev_cursor'])
+    except Exception as e:
+        print(f"❌ Erro get_movimentacoes_report_page: {str(e)}")
+        return vazia
+
+
+# Contagem por tipo numa única consulta agrupada (função SQL contar_movimentacoes_por_tipo,
+# ver sql/movimentacao_contagem_tipo.sql). Sem a função no banco, conta só a coluna tipo.
+_contagem_rpc_ausente = False
+
+
+def get_movimentacoes_contagem_por_tipo(data_inicio=None, data_fim=None, search_term=None) -> Dict[str, int]:
+    """{tipo: quantidade de movimentações} com os filtros do relatório"""
+    global _contagem_rpc_ausente
+    if not supabase:
+        return {}
+    if not _contagem_rpc_ausente and not (search_term and _busca_movimentacao_ausente):
+        result = safe_execute(supabase.rpc('contar_movimentacoes_por_tipo', {
+            'p_inicio': data_inicio or None,
+            'p_fim': f"{data_fim} 23:59:59" if data_fim else None,
+            'p_termos': _termos_busca(search_term),
+        }), operation="CONTAGEM POR TIPO em movimentacao")
+        if result['success']:
+            return {r['tipo']: int(r['total']) for r in result['data'] or []}
+        if 'PGRST202' not in (result['error'] or ''):
+            return {}
+        print("⚠️ Função contar_movimentacoes_por_tipo não instalada (ver sql/movimentacao_contagem_tipo.sql); "
+              "contando em Python")
+        _contagem_rpc_ausente = True
+
+    try:
+        if search_term and _busca_movimentacao_ausente:
+            rows = get_movimentacoes_report(data_inicio, data_fim, search_term)
+        else:
+            rows = select_all('movimentacao', columns='id, tipo',
+                              refine=_filtro_movimentacoes(data_inicio, data_fim, search_term))
+    except Exception as e:
+        print(f"❌ Erro get_movimentacoes_contagem_por_tipo: {str(e)}")
+        return {}
+    contagem: Dict[str, int] = {}
+    for row in rows:
+        contagem[row['tipo']] = contagem.get(row['tipo'], 0) + 1
+    return contagem
+
+
 def get_top_items(limit=5, order_by='qtd_estoque', desc=True):
     """Busca top items (mais ou menos estoque)"""
     try:
@@ -393,17 +607,16 @@ def get_expiring_lots(days=40, today_only=False):
         today = datetime.now().strftime('%Y-%m-%d')
         target_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
         
-        query = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(codigo, descricao, endereco)') \
-            .gt('quantidade', 0) \
-        
-        if today_only:
-            query = query.eq('validade', today)
-        else:
-            query = query.gt('validade', today).lte('validade', target_date)
+        def filtro_validade(query):
+            query = query.gt('quantidade', 0)
+            if today_only:
+                return query.eq('validade', today)
+            return query.gt('validade', today).lte('validade', target_date)
             
-        response = query.order('validade').execute()
-        return response.data if response.data else []
+        return select_all('estoque_detalhe',
+                          columns='*, item_estoque(codigo, descricao, endereco)',
+                          order_by='validade',
+                          refine=filtro_validade)
     except Exception as e:
         print(f"❌ Erro get_expiring_lots: {str(e)}")
         return []
@@ -417,15 +630,12 @@ def get_etiqueta_vermelha_items(days=40):
         # Mas status_etiqueta ser NULL ou 'PENDENTE'.
         # O filtro .or_('status_etiqueta.eq.PENDENTE,status_etiqueta.is.null') funciona na string query
         
-        response = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(codigo, descricao, endereco)') \
-            .lte('validade', target_date) \
-            .gt('quantidade', 0) \
-            .or_('status_etiqueta.eq.PENDENTE,status_etiqueta.is.null') \
-            .order('validade') \
-            .execute()
-            
-        return response.data if response.data else []
+        return select_all('estoque_detalhe',
+                          columns='*, item_estoque(codigo, descricao, endereco)',
+                          order_by='validade',
+                          refine=lambda q: q.lte('validade', target_date)
+                                            .gt('quantidade', 0)
+                                            .or_('status_etiqueta.eq.PENDENTE,status_etiqueta.is.null'))
     except Exception as e:
         print(f"❌ Erro get_etiqueta_vermelha_items: {str(e)}")
         return []
@@ -444,53 +654,53 @@ def get_historico_etiquetas(limit=500):
         print(f"❌ Erro get_historico_etiquetas: {str(e)}")
         return []
 
-def get_estoque_detalhado(page=1, per_page=25, search_term=None):
+# Contagem do total de lotes em /estoque: 'planned' (estimativa do Postgres, barata),
+# 'exact' ou 'none' (não mostra total). Cacheada por SUPABASE_COUNT_TTL segundos.
+ESTOQUE_COUNT_METHOD: str = os.getenv('ESTOQUE_COUNT_METHOD', 'planned')
+
+
+def get_estoque_detalhado(per_page=25, search_term=None, after=None, before=None):
     """
-    Busca detalhes de estoque (batches) com paginação e busca.
-    Sort by: validade ASC (nulls last would be ideal but hard in basic REST, default ASC puts nulls last usually or first depending on DB)
-    Supabase: .order('validade', nulls_first=False)
+    Página de lotes com saldo (estoque_detalhe + item_estoque), por cursor.
+    Ordem: validade ASC (sem validade por último), id como desempate.
+    after/before: cursores next_cursor/prev_cursor de uma página anterior.
+    Com search_term, a busca (lote, nf, item_nf e código/descrição/endereço do item)
+    vem do índice em memória de busca_lotes; a página sai numa única consulta por id.
+
+    Returns:
+        {'items', 'next_cursor', 'prev_cursor', 'total' (pode ser estimado ou None), 'total_estimado'}
     """
+    search_term = (search_term or '').strip()
     try:
-        query = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(codigo, descricao, endereco)', count='exact') \
-            .gt('quantidade', 0)
-            
         if search_term:
-            # Search is tricky on nested joined tables via single OR.
-            # Best effort: filter on details fields or fetch all and filter python (bad for pagination).
-            # Supabase DOES support filtering on joined tables for exact matches (item_estoque.codigo.eq...), but ILIKE with OR across tables is hard.
-            # For now, let's implement simple search on lote/nf/item_nf.
-            # For item code/desc search, ideally we use proper search text search or RPC.
-            term = f"%{search_term}%"
-            # Attempting complex filter if possible? No, it often breaks.
-            # Let's try searching local fields first.
-            query = query.or_(f"lote.ilike.{term},nf.ilike.{term},item_nf.ilike.{term}")
-            
-        # Pagination
-        start = (page - 1) * per_page
-        end = start + per_page - 1
-        
-        # Order by validade ASC
-        query = query.order('validade', desc=False).range(start, end)
-        
-        response = query.execute()
-        items = response.data if response.data else []
-        total = response.count if hasattr(response, 'count') else 0
-        
-        return items, total
+            pagina = busca_lotes.search_page(search_term, size=per_page, after=after, before=before)
+            total, estimado = pagina['total'], False
+        else:
+            pagina = select_page('estoque_detalhe', columns='*, item_estoque(id, codigo, descricao, endereco)',
+                                 order_by='validade', size=per_page, after=after, before=before,
+                                 refine=lambda query: query.gt('quantidade', 0))
+            total = count_rows('estoque_detalhe', refine=lambda query: query.gt('quantidade', 0),
+                               method=ESTOQUE_COUNT_METHOD)
+            estimado = ESTOQUE_COUNT_METHOD != 'exact'
     except Exception as e:
         print(f"❌ Erro get_estoque_detalhado: {str(e)}")
-        return [], 0
+        pagina, total, estimado = {'rows': [], 'next_cursor': None, 'prev_cursor': None}, None, False
+
+    return {
+        'items': pagina['rows'],
+        'next_cursor': pagina['next_cursor'],
+        'prev_cursor': pagina['prev_cursor'],
+        'total': total,
+        'total_estimado': estimado,
+    }
 
 def get_item_movements_by_item_id(item_id):
     """Busca todas as movimentações de um item"""
     try:
-        response = supabase.table('movimentacao') \
-            .select('*, item_estoque(codigo, descricao)') \
-            .eq('item_id', item_id) \
-            .order('data_movimentacao', desc=True) \
-            .execute()
-        return response.data if response.data else []
+        return select_all('movimentacao',
+                          filters={'item_id': item_id},
+                          columns='*, item_estoque(codigo, descricao)',
+                          order_by='-data_movimentacao')
     except Exception as e:
         print(f"❌ Erro get_item_movements_by_item_id: {str(e)}")
         return []
@@ -498,17 +708,18 @@ def get_item_movements_by_item_id(item_id):
 def get_detalhes_by_item(item_id, filtro_critico=False):
     """Busca detalhes (lotes) de um item"""
     try:
-        query = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(codigo, descricao)') \
-            .eq('item_estoque_id', item_id)
-            
-        if filtro_critico:
-            today = datetime.now()
-            target_date = (today + timedelta(days=30)).strftime('%Y-%m-%d')
-            query = query.gt('quantidade', 0).lte('validade', target_date).neq('validade', None)
+        def filtro(query):
+            if filtro_critico:
+                today = datetime.now()
+                target_date = (today + timedelta(days=30)).strftime('%Y-%m-%d')
+                query = query.gt('quantidade', 0).lte('validade', target_date).neq('validade', None)
+            return query
             
-        response = query.order('data_entrada', desc=True).execute()
-        return response.data if response.data else []
+        return select_all('estoque_detalhe',
+                          filters={'item_estoque_id': item_id},
+                          columns='*, item_estoque(codigo, descricao)',
+                          order_by='-data_entrada',
+                          refine=filtro)
     except Exception as e:
         print(f"❌ Erro get_detalhes_by_item: {str(e)}")
         return []
@@ -516,13 +727,16 @@ def get_detalhes_by_item(item_id, filtro_critico=False):
 def get_consumiveis(search_term=None):
     """Busca consumiveis com filtro opcional"""
     try:
-        query = supabase.table('consumivel_estoque').select('*')
+        consumiveis = catalogo.consumiveis('codigo_produto')
         if search_term:
-            term = f"%{search_term}%"
-            query = query.or_(f"codigo_produto.ilike.{term},descricao.ilike.{term},categoria.ilike.{term}")
-        
-        response = query.order('codigo_produto').execute()
-        return response.data if response.data else []
+            # Mesmo critério do ilike '%termo%' em código, descrição ou categoria
+            termo = search_term.casefold()
+            consumiveis = [
+                c for c in consumiveis
+                if any(termo in str(c.get(campo) or '').casefold()
+                       for campo in ('codigo_produto', 'descricao', 'categoria'))
+            ]
+        return consumiveis
     except Exception as e:
         print(f"❌ Erro get_consumiveis: {str(e)}")
         return []
@@ -530,15 +744,10 @@ def get_consumiveis(search_term=None):
 def get_movimentacoes_consumivel(limit=None):
     """Busca movimentos de consumíveis"""
     try:
-        query = supabase.table('movimentacao_consumivel') \
-            .select('*, consumivel_estoque(*)') \
-            .order('data_movimentacao', desc=True)
-            
-        if limit:
-            query = query.limit(limit)
-            
-        response = query.execute()
-        return response.data if response.data else []
+        return select_all('movimentacao_consumivel',
+                          columns='*, consumivel_estoque(*)',
+                          order_by='-data_movimentacao',
+                          limit=limit)
     except Exception as e:
         print(f"❌ Erro get_movimentacoes_consumivel: {str(e)}")
         return []
@@ -546,6 +755,7 @@ def get_movimentacoes_consumivel(limit=None):
 def delete_movimentacao(mov_id):
     """Deleta uma movimentacao pelo ID"""
     try:
+        invalidate_request_cache('movimentacao')
         response = supabase.table('movimentacao').delete().eq('id', mov_id).execute()
         return response
     except Exception as e:
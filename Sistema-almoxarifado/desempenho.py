@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Desempenho - Rastreamento das consultas ao Supabase por requisição
+Instrumenta a sessão HTTP do cliente PostgREST, de modo que TODA consulta
+(helpers, safe_execute e as chamadas diretas a supabase.table(...).execute())
+seja medida sem alterar os pontos de chamada. Para cada consulta feita dentro
+de uma requisição Flask guarda: tabela, operação, filtros, linhas, bytes e latência.
+
+Ao fim de cada requisição:
+- cabeçalho Server-Timing (db = tempo somado das consultas, app = tempo total),
+  visível na aba Network do navegador;
+- uma linha de log estruturada (JSON) com os totais e as consultas por tabela;
+- uma amostra por rota para a página /admin/perf (p50/p95 e número de consultas).
+
+PERF_LOG=0 desliga a linha de log; PERF_AMOSTRAS define quantas requisições
+recentes cada rota guarda.
+
+Orçamento de consultas (detector de N+1, para desenvolvimento/CI): rotas marcadas
+com @query_budget(n) não podem fazer mais de n consultas a uma mesma tabela por
+requisição. QUERY_BUDGET_MODE=warn (padrão fora de produção) loga o excesso com
+os pontos de chamada repetidos; QUERY_BUDGET_MODE=raise faz a requisição falhar
+(QueryBudgetExceeded), para pegar a regressão nos testes; off desliga.
+QUERY_BUDGET_PADRAO aplica um limite por tabela às rotas sem decorator.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter, deque
+from functools import wraps
+from typing import Any, Dict, List, Optional
+
+from flask import g, request, has_request_context, current_app
+
+from supabase_client import supabase
+
+PERF_LOG: bool = os.getenv('PERF_LOG', '1') != '0'
+PERF_AMOSTRAS: int = int(os.getenv('PERF_AMOSTRAS', '500'))
+# Consultas acima deste tempo (ms) aparecem individualmente no log
+PERF_CONSULTA_LENTA_MS: float = float(os.getenv('PERF_CONSULTA_LENTA_MS', '300'))
+
+# Parâmetros do PostgREST que não são filtros
+_PARAMS_NAO_FILTRO = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+_OPERACOES = {'GET': 'select', 'HEAD': 'count', 'POST': 'insert', 'PATCH': 'update', 'DELETE': 'delete'}
+
+_padrao = 'off' if os.getenv('FLASK_ENV') == 'production' else 'warn'
+QUERY_BUDGET_MODE: str = os.getenv('QUERY_BUDGET_MODE', _padrao).lower()
+QUERY_BUDGET_PADRAO: Optional[int] = int(os.getenv('QUERY_BUDGET_PADRAO')) if os.getenv('QUERY_BUDGET_PADRAO') else None
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Módulos de infraestrutura que nunca são "o ponto de chamada" de uma consulta
+_INFRA = {'supabase_client.py', 'desempenho.py'}
+
+_lock = threading.Lock()
+_rotas: Dict[str, deque] = {}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Rota fez mais consultas a uma tabela do que o orçamento declarado (QUERY_BUDGET_MODE=raise)."""
+    pass
+
+
+def query_budget(por_tabela: int, total: Optional[int] = None):
+    """
+    Declara o máximo de consultas por tabela (e, opcionalmente, no total) de uma rota:
+
+        @app.route('/dashboard')
+        @query_budget(5)
+        @login_required
+        def dashboard(): ...
+    """
+    def decorator(f):
+        f._query_budget = {'por_tabela': por_tabela, 'total': total}
+        return f
+    return decorator
+
+
+# ============================================================
+# INSTRUMENTAÇÃO DA SESSÃO HTTP
+# ============================================================
+
+def _descrever(method: str, url: Any, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    caminho = str(url).split('?')[0].strip('/')
+    if caminho.startswith('rpc/'):
+        tabela, operacao = caminho, 'rpc'
+    else:
+        tabela = caminho.rsplit('/', 1)[-1]
+        operacao = _OPERACOES.get(method.upper(), method.lower())
+        prefer = str((kwargs.get('headers') or {}).get('Prefer', ''))
+        if operacao == 'insert' and 'merge-duplicates' in prefer:
+            operacao = 'upsert'
+
+    params = kwargs.get('params') or {}
+    itens = params.multi_items() if hasattr(params, 'multi_items') else list(dict(params).items())
+    filtros = {k: str(v)[:80] for k, v in itens if k not in _PARAMS_NAO_FILTRO}
+    return {'tabela': tabela, 'operacao': operacao, 'filtros': filtros}
+
+
+def _linhas(response) -> Optional[int]:
+    """Número de linhas pelo Content-Range do PostgREST ('0-24/*'), sem reler o JSON."""
+    faixa = response.headers.get('content-range', '')
+    intervalo = faixa.split('/')[0]
+    if '-' in intervalo:
+        inicio, fim = intervalo.split('-', 1)
+        try:
+            return int(fim) - int(inicio) + 1
+        except ValueError:
+            return None
+    return 0 if intervalo == '*' else None
+
+
+def _origem() -> str:
+    """Pontos de chamada da consulta no código da aplicação (externo -> interno), ex.:
+    'main.py:340 api_stock_turnover_data -> database_helpers.py:95 get_item_estoque_by_id'."""
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None and len(frames) < 2:
+        arquivo = frame.f_code.co_filename
+        if arquivo.startswith(_APP_DIR) and os.path.basename(arquivo) not in _INFRA:
+            frames.append(f"{os.path.basename(arquivo)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return ' -> '.join(reversed(frames)) or '?'
+
+
+def _registrar(consulta: Dict[str, Any]):
+    if not has_request_context():
+        return
+    if 'supabase_trace' not in g:
+        g.supabase_trace = []
+    g.supabase_trace.append(consulta)
+
+
+def instrument_session(session):
+    """Envolve session.request (httpx.Client do PostgREST) para medir cada consulta. Idempotente."""
+    if session is None or getattr(session.request, '_instrumentado', False):
+        return
+    original = session.request
+
+    @wraps(original)
+    def request_instrumentado(method, url, *args, **kwargs):
+        inicio = time.perf_counter()
+        response, erro = None, None
+        try:
+            response = original(method, url, *args, **kwargs)
+            return response
+        except Exception as e:
+            erro = type(e).__name__
+            raise
+        finally:
+            if has_request_context():
+                consulta = _descrever(method, url, kwargs)
+                consulta['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+                if response is not None:
+                    consulta['status'] = response.status_code
+                    consulta['linhas'] = _linhas(response)
+                    consulta['bytes'] = len(response.content) + int(response.request.headers.get('content-length', 0))
+                else:
+                    consulta['erro'] = erro
+                if QUERY_BUDGET_MODE != 'off':
+                    consulta['origem'] = _origem()
+                _registrar(consulta)
+
+    request_instrumentado._instrumentado = True
+    session.request = request_instrumentado
+
+
+def _instrumentar_cliente():
+    # O cliente recria a sessão PostgREST em eventos de autenticação: confere a cada requisição
+    if supabase is not None:
+        instrument_session(supabase.postgrest.session)
+
+
+# ============================================================
+# CICLO DA REQUISIÇÃO
+# ============================================================
+
+def _rota() -> str:
+    regra = request.url_rule.rule if request.url_rule else request.path
+    return f"{request.method} {regra}"
+
+
+def resumo_requisicao(trace: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totais das consultas de uma requisição, com a quebra por tabela."""
+    por_tabela: Dict[str, Dict[str, Any]] = {}
+    for c in trace:
+        t = por_tabela.setdefault(c['tabela'], {'consultas': 0, 'ms': 0.0, 'linhas': 0})
+        t['consultas'] += 1
+        t['ms'] = round(t['ms'] + c['ms'], 1)
+        t['linhas'] += c.get('linhas') or 0
+    return {
+        'consultas': len(trace),
+        'db_ms': round(sum(c['ms'] for c in trace), 1),
+        'linhas': sum(c.get('linhas') or 0 for c in trace),
+        'bytes': sum(c.get('bytes') or 0 for c in trace),
+        'por_tabela': por_tabela,
+    }
+
+
+def _antes():
+    _instrumentar_cliente()
+    g.perf_inicio = time.perf_counter()
+
+
+def _depois(response):
+    if 'perf_inicio' not in g or request.endpoint == 'static':
+        return response
+    total_ms = round((time.perf_counter() - g.perf_inicio) * 1000, 1)
+    trace = g.get('supabase_trace', [])
+    resumo = resumo_requisicao(trace)
+
+    response.headers['Server-Timing'] = (
+        f'db;dur={resumo["db_ms"]};desc="{resumo["consultas"]} consultas", app;dur={total_ms}'
+    )
+
+    rota = _rota()
+    with _lock:
+        amostras = _rotas.setdefault(rota, deque(maxlen=PERF_AMOSTRAS))
+        amostras.append((total_ms, resumo['db_ms'], resumo['consultas']))
+
+    if PERF_LOG:
+        registro = dict(rota=rota, status=response.status_code, total_ms=total_ms, **resumo)
+        lentas = [c for c in trace if c['ms'] >= PERF_CONSULTA_LENTA_MS]
+        if lentas:
+            registro['lentas'] = lentas
+        print(f"📊 {json.dumps(registro, ensure_ascii=False, default=str)}")
+
+    _verificar_orcamento(rota, trace)
+    return response
+
+
+def _verificar_orcamento(rota: str, trace: List[Dict[str, Any]]):
+    if QUERY_BUDGET_MODE == 'off':
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    orcamento = getattr(view, '_query_budget', None)
+    if orcamento is None and QUERY_BUDGET_PADRAO is not None:
+        orcamento = {'por_tabela': QUERY_BUDGET_PADRAO, 'total': None}
+    if orcamento is None:
+        return
+
+    por_tabela = Counter(c['tabela'] for c in trace)
+    estouradas = {t for t, n in por_tabela.items() if n > orcamento['por_tabela']}
+    excessos = [f"{t}: {por_tabela[t]} consultas (limite {orcamento['por_tabela']})" for t in sorted(estouradas)]
+    if orcamento['total'] is not None and len(trace) > orcamento['total']:
+        excessos.append(f"total: {len(trace)} consultas (limite {orcamento['total']})")
+        estouradas = set(por_tabela)
+    if not excessos:
+        return
+
+    # Mesma consulta saindo do mesmo ponto várias vezes = laço (N+1)
+    repetidas = Counter(
+        (c['tabela'], c['operacao'], c.get('origem', '?')) for c in trace if c['tabela'] in estouradas
+    )
+    pontos = [f"  {n}x {operacao} em {tabela} a partir de {origem}"
+              for (tabela, operacao, origem), n in repetidas.most_common(5) if n > 1]
+    mensagem = '\n'.join([f"🚨 Orçamento de consultas excedido em {rota}: " + '; '.join(excessos)] + pontos)
+    if QUERY_BUDGET_MODE == 'raise':
+        raise QueryBudgetExceeded(mensagem)
+    print(mensagem)
+
+
+def init_app(app):
+    """Registra os ganchos de medição na aplicação."""
+    app.before_request(_antes)
+    app.after_request(_depois)
+
+
+# ============================================================
+# ESTATÍSTICAS POR ROTA (/admin/perf)
+# ============================================================
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def route_stats() -> List[Dict[str, Any]]:
+    """p50/p95 do tempo total e do tempo de banco e consultas por requisição, por rota (mais lentas primeiro)."""
+    with _lock:
+        copia = {rota: list(amostras) for rota, amostras in _rotas.items()}
+    linhas = []
+    for rota, amostras in copia.items():
+        totais = [a[0] for a in amostras]
+        db = [a[1] for a in amostras]
+        consultas = [a[2] for a in amostras]
+        linhas.append({
+            'rota': rota,
+            'requisicoes': len(amostras),
+            'p50_ms': _percentil(totais, 50),
+            'p95_ms': _percentil(totais, 95),
+            'db_p50_ms': _percentil(db, 50),
+            'db_p95_ms': _percentil(db, 95),
+            'consultas_media': round(sum(consultas) / len(consultas), 1),
+            'consultas_max': max(consultas),
+        })
+    return sorted(linhas, key=lambda l: l['p95_ms'], reverse=True)
+
+
+def reset_stats():
+    with _lock:
+        _rotas.clear()
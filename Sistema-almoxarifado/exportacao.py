@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Exportação - Geração em streaming do relatório de estoque em Excel (/exportar/excel)
+Percorre os itens em páginas, busca os lotes de cada página com um filtro IN
+e grava as linhas com o XlsxWriter em modo constant_memory, de modo que o uso
+de memória não cresce com o número de lotes. O arquivo é montado em disco e
+enviado ao cliente em blocos.
+"""
+
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Tuple
+
+import xlsxwriter
+
+from supabase_client import iter_chunks, select_in
+
+# Colunas do relatório: (cabeçalho, largura)
+COLUNAS_ESTOQUE: List[Tuple[str, int]] = [
+    ('CÓDIGO', 20), ('CÓDIGO OPCIONAL', 20), ('TIPO', 20), ('DESCRIÇÃO', 40),
+    ('LOCAL', 20), ('UN', 20), ('DIMENSÃO', 20), ('CLIENTE', 20),
+    ('LOTE', 20), ('ITEM NF', 20), ('NF', 20),
+    ('VALIDADE', 20), ('ESTAÇÃO', 20), ('QTD ESTOQUE', 20), ('DATA ENTRADA', 20)
+]
+
+# Itens por página (os lotes de cada página vêm em uma ou poucas consultas IN)
+EXPORT_CHUNK_SIZE: int = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+# Tamanho dos blocos enviados ao cliente
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def _texto(valor: Any, default: str = '') -> str:
+    return str(valor or default).strip()
+
+
+def _formatar_validade(validade: Any) -> str:
+    if not validade:
+        return ''
+    try:
+        return datetime.strptime(validade, '%Y-%m-%d').strftime('%d/%m/%Y')
+    except (TypeError, ValueError):
+        return validade
+
+
+def _formatar_data_entrada(data_entrada: Any) -> str:
+    if not data_entrada:
+        return ''
+    try:
+        return datetime.fromisoformat(data_entrada.replace('Z', '+00:00')).strftime('%d/%m/%Y %H:%M:%S')
+    except (AttributeError, ValueError):
+        return data_entrada
+
+
+def linha_estoque(item: Dict[str, Any], detalhe: Dict[str, Any]) -> List[Any]:
+    """Valores de uma linha do relatório (um lote), na ordem de COLUNAS_ESTOQUE."""
+    return [
+        str(item.get('codigo', '')).strip(),
+        _texto(item.get('codigo_opcional')),
+        _texto(item.get('tipo')),
+        _texto(item.get('descricao')),
+        _texto(item.get('endereco')),
+        _texto(item.get('un'), 'UN'),
+        _texto(item.get('dimensao')),
+        _texto(item.get('cliente')),
+        _texto(detalhe.get('lote')),
+        _texto(detalhe.get('item_nf')),
+        _texto(detalhe.get('nf')),
+        _formatar_validade(detalhe.get('validade')),
+        _texto(detalhe.get('estacao')),
+        round(float(detalhe.get('quantidade') or 0), 2),
+        _formatar_data_entrada(detalhe.get('data_entrada')),
+    ]
+
+
+def iter_linhas_estoque(chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Any]]:
+    """
+    Gera as linhas do relatório ordenadas por código do item e data de entrada do lote.
+    Apenas uma página de itens (e seus lotes) fica em memória por vez.
+    """
+    for itens in iter_chunks('item_estoque', order_by='codigo', chunk_size=chunk_size):
+        lotes_por_item: Dict[Any, List[Dict]] = {}
+        for detalhe in select_in('estoque_detalhe', 'item_estoque_id', [i['id'] for i in itens]):
+            lotes_por_item.setdefault(detalhe['item_estoque_id'], []).append(detalhe)
+
+        for item in itens:
+            lotes = lotes_por_item.get(item['id'], [])
+            lotes.sort(key=lambda d: d.get('data_entrada') or '')
+            for detalhe in lotes:
+                yield linha_estoque(item, detalhe)
+
+
+def gerar_planilha_estoque(path: str, linhas: Iterator[List[Any]]) -> int:
+    """
+    Grava o relatório em `path` (XlsxWriter, constant_memory: cada linha vai direto para o disco).
+    Formatos são definidos por coluna, não por célula.
+
+    Returns:
+        Número de linhas de dados gravadas
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        worksheet = workbook.add_worksheet('Estoque_Detalhado')
+
+        cabecalho = workbook.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'font_size': 11, 'bg_color': '#00D4FF',
+            'align': 'center', 'valign': 'vcenter', 'text_wrap': True
+        })
+        dados = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
+
+        for num_coluna, (_, largura) in enumerate(COLUNAS_ESTOQUE):
+            worksheet.set_column(num_coluna, num_coluna, largura, dados)
+        worksheet.write_row(0, 0, [nome for nome, _ in COLUNAS_ESTOQUE], cabecalho)
+
+        total = 0
+        for total, linha in enumerate(linhas, start=1):
+            worksheet.write_row(total, 0, linha)
+    finally:
+        workbook.close()
+    return total
+
+
+def stream_arquivo(path: str, block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """Lê o arquivo em blocos e o remove ao final (ou se o cliente desconectar)."""
+    try:
+        with open(path, 'rb') as arquivo:
+            while True:
+                bloco = arquivo.read(block_size)
+                if not bloco:
+                    break
+                yield bloco
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def exportar_estoque_xlsx() -> Tuple[str, int]:
+    """
+    Gera o relatório de estoque em um arquivo temporário.
+
+    Returns:
+        (caminho do arquivo, tamanho em bytes) - o chamador deve enviá-lo com stream_arquivo,
+        que apaga o arquivo ao terminar
+    """
+    fd, path = tempfile.mkstemp(prefix='relatorio_estoque_', suffix='.xlsx')
+    os.close(fd)
+    try:
+        gerar_planilha_estoque(path, iter_linhas_estoque())
+    except Exception:
+        os.remove(path)
+        raise
+    return path, os.path.getsize(path)
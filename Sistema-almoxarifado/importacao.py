@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Importação - Pipelines em lote para as planilhas de estoque (/importar)
+e de consumíveis (/consumivel/importar).
+Em vez de várias idas ao banco por linha, trabalha sobre conjuntos:
+pré-carrega registros com filtros IN, calcula as diferenças no pandas
+e grava tudo em requisições em bloco. As entradas de estoque vão em blocos
+para registrar_movimentacoes (ver movimentacoes.py).
+"""
+
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from supabase_client import select_in, insert_many, upsert_many
+from movimentacoes import registrar_movimentacoes
+import dashboard_snapshot
+import busca_itens
+import busca_lotes
+import catalogo
+from busca_itens import normalize_text
+
+# Colunas obrigatórias da planilha de estoque
+REQUIRED_COLUMNS = ['CÓDIGO', 'DESCRIÇÃO', 'LOTE', 'NF', 'QTD ESTOQUE']
+
+# Colunas da planilha de consumíveis: campo -> padrões aceitos no cabeçalho normalizado
+CONSUMIVEL_COLUMNS = {
+    'n_produto': ('N PRODUTO', 'NPRODUTO', 'NUM PRODUTO', 'NUMERO PRODUTO'),
+    'codigo_produto': ('CODIGO PRODUTO', 'CODIGOPRODUTO', 'CODIGO'),
+    'descricao': ('DESCRICAO DO PRODUTO', 'DESCRICAODOPRODUTO', 'DESCRICAO'),
+    'unidade_medida': ('UNIDADE MEDIDA', 'UNIDADE'),
+    'status_estoque': ('STATUS ESTOQUE', 'STATUSESTOQUE', 'STATUS'),
+    'status_consumo': ('STATUS CONSUMO', 'STATUSCONSUMO'),
+    'categoria': ('CATEGORIA',),
+    'fornecedor': ('FORNECEDOR', 'FORNECEDOR 2', 'FORNECEDOR2'),
+    'fornecedor2': ('FORNECEDOR 2', 'FORNECEDOR2'),
+    'valor_unitario': ('VALOR UNITARIO', 'VALORUNITARIO', 'VALOR'),
+    'lead_time': ('LEAD TIME', 'LEADTIME', 'TEMPO REPOSICAO', 'DIAS'),
+    'estoque_seguranca': ('ESTOQUE DE SEGURANCA', 'ESTOQUESEGURANCA', 'PERCENTUAL ESTOQUE'),
+    'estoque_minimo': ('ESTOQUE MINIMO', 'ESTOQUE MINIMO POR CAIXA', 'ESTOQUEMINIMO'),
+    'quantidade_atual': ('ESTOQUE ATUAL', 'ESTOQUEATUAL', 'QUANTIDADE ATUAL'),
+}
+CONSUMIVEL_REQUIRED = ['n_produto', 'codigo_produto', 'descricao', 'unidade_medida']
+
+
+def _text(df: pd.DataFrame, coluna: str, default: str = '') -> pd.Series:
+    """Coluna como texto (str do valor), com `default` para células vazias ou coluna ausente."""
+    if coluna not in df.columns:
+        return pd.Series(default, index=df.index, dtype=object)
+    serie = df[coluna]
+    return serie.map(str).where(serie.notna(), default)
+
+
+def _validade(df: pd.DataFrame) -> pd.Series:
+    """Coluna VALIDADE como 'YYYY-MM-DD' (None quando vazia ou inválida)."""
+    if 'VALIDADE' not in df.columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    datas = pd.to_datetime(df['VALIDADE'], errors='coerce')
+    return datas.dt.strftime('%Y-%m-%d').astype(object).where(datas.notna(), None)
+
+
+def _float(df: pd.DataFrame, coluna: Optional[str], default: float = 0.0) -> pd.Series:
+    """Coluna numérica; valores vazios ou não numéricos viram `default`."""
+    if coluna is None:
+        return pd.Series(default, index=df.index, dtype=float)
+    return pd.to_numeric(df[coluna], errors='coerce').fillna(default).astype(float)
+
+
+def _int(df: pd.DataFrame, coluna: Optional[str], default: int = 7) -> pd.Series:
+    """Coluna inteira (parte inteira, como int()); valores vazios ou inválidos viram `default`."""
+    if coluna is None:
+        return pd.Series(default, index=df.index, dtype=int)
+    return pd.to_numeric(df[coluna], errors='coerce').fillna(default).astype(int)
+
+
+def normalizar_planilha_estoque(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte a planilha para as colunas do banco (uma linha por linha da planilha)."""
+    quantidade = pd.to_numeric(df['QTD ESTOQUE'], errors='coerce').fillna(0).astype(float)
+    return pd.DataFrame({
+        'codigo': _text(df, 'CÓDIGO', None),
+        'descricao': _text(df, 'DESCRIÇÃO', 'Sem Descrição'),
+        'lote': _text(df, 'LOTE', 'N/A'),
+        'nf': _text(df, 'NF', 'N/A'),
+        'item_nf': _text(df, 'ITEM NF', 'N/A'),
+        'quantidade': quantidade.values,
+        'validade': _validade(df).values,
+        'estacao': _text(df, 'ESTAÇÃO'),
+        'endereco': _text(df, 'LOCAL'),
+        'codigo_opcional': _text(df, 'CÓDIGO OPCIONAL'),
+        'tipo': _text(df, 'TIPO'),
+        'un': _text(df, 'UN.'),
+        'dimensao': _text(df, 'DIMENSÃO'),
+        'cliente': _text(df, 'CLIENTE'),
+    }, index=df.index)
+
+
+def _primeiro_por(rows: List[Dict], chave) -> Dict[Any, Dict]:
+    """Indexa `rows` pela chave, mantendo o primeiro registro (ordem por id)."""
+    indice: Dict[Any, Dict] = {}
+    for row in rows:
+        indice.setdefault(chave(row), row)
+    return indice
+
+
+def _resolver_itens(linhas: pd.DataFrame) -> Dict[str, Dict]:
+    """Busca os itens já cadastrados e cria, em lote, os que faltam. Retorna {codigo: item}."""
+    codigos = linhas['codigo'].unique().tolist()
+    itens = _primeiro_por(select_in('item_estoque', 'codigo', codigos), lambda i: i['codigo'])
+
+    # Itens novos: atributos da primeira linha em que o código aparece
+    novos = linhas[~linhas['codigo'].isin(list(itens))].drop_duplicates('codigo')
+    if novos.empty:
+        return itens
+
+    payload = [
+        {
+            'codigo': r.codigo,
+            'descricao': r.descricao,
+            'endereco': r.endereco,
+            'codigo_opcional': r.codigo_opcional,
+            'tipo': r.tipo,
+            'un': r.un,
+            'dimensao': r.dimensao,
+            'cliente': r.cliente,
+            'qtd_estoque': 0
+        }
+        for r in novos.itertuples(index=False)
+    ]
+    resultado = insert_many('item_estoque', payload, retry_rows=True)
+    for erro in resultado['errors']:
+        print(f"⚠️ Importação: falha ao criar itens {erro['start']}-{erro['end'] - 1}: {erro['error']}")
+
+    for criado in resultado['data']:
+        if criado:
+            itens[criado['codigo']] = criado
+            dashboard_snapshot.apply_item(criado)
+            busca_itens.apply_item(criado)
+            busca_lotes.apply_item(criado)
+            catalogo.apply_row('item_estoque', criado)
+    return itens
+
+
+def _registrar_entradas(linhas: pd.DataFrame, usuario: str) -> pd.Series:
+    """
+    Uma ENTRADA por linha via registrar_movimentacoes: soma no lote (ou cria), soma
+    em qtd_estoque e lança a movimentação, com incrementos aplicados no banco.
+    Retorna, por linha da planilha, se a entrada foi gravada.
+    """
+    entradas = [
+        {
+            'item_id': int(r.item_estoque_id),
+            'quantidade': r.quantidade,
+            'lote': r.lote,
+            'item_nf': r.item_nf,
+            'nf': r.nf,
+            'validade': r.validade,
+            'estacao': r.estacao,
+            'usuario': usuario,
+            'etapa': 'IMPORTACAO',
+            'observacao': 'Importação via Excel'
+        }
+        for r in linhas.itertuples(index=False)
+    ]
+    resultados = registrar_movimentacoes(entradas)
+    for n, resultado in enumerate(resultados):
+        if 'erro' in resultado:
+            print(f"⚠️ Importação: entrada {n} recusada ({resultado['erro']}): {resultado['mensagem']}")
+    return pd.Series(['erro' not in r for r in resultados], index=linhas.index, dtype=bool)
+
+
+def importar_planilha_estoque(df: pd.DataFrame, usuario: str) -> Dict[str, int]:
+    """
+    Importa uma planilha de entrada de estoque.
+
+    Cada linha válida soma QTD ESTOQUE ao lote (item, LOTE, ITEM NF, NF), criando
+    item e lote quando não existirem, e gera uma movimentação de ENTRADA. Lote, saldo
+    e movimentação passam por registrar_movimentacoes (incrementos no banco, como
+    em qualquer outra entrada); só os itens novos são inseridos aqui.
+
+    Returns:
+        dict com 'sucesso' (linhas processadas) e 'erros' (linhas ignoradas)
+
+    Raises:
+        SupabaseQueryError se a leitura prévia de itens/lotes falhar
+    """
+    linhas = normalizar_planilha_estoque(df)
+    total = len(linhas)
+
+    # 1. Linhas sem código são ignoradas
+    linhas = linhas[linhas['codigo'].notna()]
+
+    # 2. Itens: busca em lote e cria os que faltam
+    itens = _resolver_itens(linhas)
+    linhas = linhas[linhas['codigo'].isin(list(itens))].copy()
+    if linhas.empty:
+        return {'sucesso': 0, 'erros': total}
+    linhas['item_estoque_id'] = linhas['codigo'].map(lambda c: itens[c]['id'])
+
+    # 3. Lotes, saldos e movimentações: uma ENTRADA por linha, em blocos (registrar_movimentacoes)
+    linhas = linhas[_registrar_entradas(linhas, usuario)]
+
+    sucesso = len(linhas)
+    return {'sucesso': sucesso, 'erros': total - sucesso}
+
+
+def resolver_colunas_consumivel(columns) -> Dict[str, Optional[str]]:
+    """
+    Resolve, uma única vez por arquivo, qual coluna da planilha corresponde a cada campo.
+    Para cada campo vale a primeira coluna (na ordem da planilha) que contém algum dos padrões.
+    """
+    norm_map = {normalize_text(c): str(c) for c in columns}
+
+    def find_col_by_patterns(patterns) -> Optional[str]:
+        for ncol, orig in norm_map.items():
+            if any(pat in ncol for pat in patterns):
+                return orig
+        return None
+
+    return {campo: find_col_by_patterns(padroes) for campo, padroes in CONSUMIVEL_COLUMNS.items()}
+
+
+def importar_planilha_consumiveis(df: pd.DataFrame, colunas: Dict[str, Optional[str]]) -> Dict[str, int]:
+    """
+    Importa a planilha mestre de consumíveis com um upsert em blocos por codigo_produto.
+
+    Linhas sem Nº produto, código ou descrição são ignoradas. Se o mesmo código
+    aparecer mais de uma vez, vale a última linha (como na gravação linha a linha).
+
+    Returns:
+        dict com 'sucesso' (linhas gravadas) e 'erros' (linhas ignoradas)
+    """
+    df = df.rename(columns=str)
+
+    def texto(campo: str, default: str = '') -> pd.Series:
+        coluna = colunas.get(campo)
+        if coluna is None:
+            return pd.Series(default, index=df.index, dtype=object)
+        valores = _text(df, coluna).str.strip()
+        return valores.where(valores != '', default)
+
+    dados = pd.DataFrame({
+        'n_produto': texto('n_produto'),
+        'codigo_produto': texto('codigo_produto'),
+        'descricao': texto('descricao'),
+        'unidade_medida': texto('unidade_medida', 'UN'),
+        'status_estoque': texto('status_estoque', 'Ativo'),
+        'status_consumo': texto('status_consumo', 'Consumível'),
+        'categoria': texto('categoria'),
+        'fornecedor': texto('fornecedor'),
+        'fornecedor2': texto('fornecedor2'),
+        'valor_unitario': _float(df, colunas.get('valor_unitario')),
+        'lead_time': _int(df, colunas.get('lead_time')),
+        'estoque_seguranca': _float(df, colunas.get('estoque_seguranca')),
+        'estoque_minimo': _float(df, colunas.get('estoque_minimo')),
+        'quantidade_atual': _float(df, colunas.get('quantidade_atual')),
+    }, index=df.index)
+
+    validas = (dados['n_produto'] != '') & (dados['codigo_produto'] != '') & (dados['descricao'] != '')
+    dados = dados[validas]
+    total = len(df)
+
+    # Um único registro por código (a restrição ON CONFLICT não aceita a mesma chave duas vezes no bloco)
+    registros = dados.drop_duplicates('codigo_produto', keep='last')
+    payload = [
+        {k: (v.item() if hasattr(v, 'item') else v) for k, v in row.items()}
+        for row in registros.to_dict('records')
+    ]
+    resultado = upsert_many('consumivel_estoque', payload, on_conflict='codigo_produto', retry_rows=True)
+    for erro in resultado['errors']:
+        print(f"⚠️ Importação de consumíveis: falha nas linhas {erro['start']}-{erro['end'] - 1}: {erro['error']}")
+
+    for row in resultado['data']:
+        catalogo.apply_row('consumivel_estoque', row)
+    gravados = {row['codigo_produto'] for row in resultado['data'] if row}
+    sucesso = int(dados['codigo_produto'].isin(gravados).sum())
+    return {'sucesso': sucesso, 'erros': total - sucesso}
@@ -2,11 +2,27 @@
 
 import os
 # from sqlalchemy import or_, func  <- REMOVIDO
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, session, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
-from models import User, ItemEstoque, Movimentacao, EstoqueDetalhe, ConsumivelEstoque, MovimentacaoConsumivel, ModelWrapper
+from models import User, ItemEstoque, Movimentacao, EstoqueDetalhe, ConsumivelEstoque, MovimentacaoConsumivel, ModelWrapper, Pagination
 from database_helpers import * # Importa todas as funções helper do Supabase
+import dashboard_snapshot
+import busca_itens
+import busca_lotes
+import catalogo
+import movimentacao_diaria
+import sessao_usuario
+import desempenho
+from desempenho import query_budget
+from importacao import (
+    importar_planilha_estoque, REQUIRED_COLUMNS,
+    importar_planilha_consumiveis, resolver_colunas_consumivel, CONSUMIVEL_REQUIRED
+)
+from exportacao import exportar_estoque_xlsx, stream_arquivo
+from analise_estoque import gerar_sugestoes_compra, calcular_giro_estoque
+from movimentacoes import registrar_movimentacao, registrar_movimentacao_consumivel, MovimentacaoError
+from supabase_client import request_cache_stats, circuit_breaker
 from functools import wraps
 from datetime import datetime, date, timedelta
 import pandas as pd
@@ -15,7 +31,6 @@ import numpy as np
 # from statsmodels.tsa.api import ExponentialSmoothing  # REMOVIDO POR LIMITE DE TAMANHO VERCEL
 import io
 # from flask_socketio import SocketIO # REMOVIDO PARA COMPATIBILIDADE VERCEL
-import unicodedata
 
 # --- INICIALIZAÇÃO E CONFIGURAÇÃO DA APLICAÇÃO ---
 app = Flask(__name__)
@@ -47,6 +62,7 @@ login_manager.login_message = "Por favor, faça login para acessar esta página.
 login_manager.login_message_category = 'info'
 
 configure_app(app)
+desempenho.init_app(app)  # Server-Timing, log por requisição e /admin/perf
 
 def check_admin_user():
     """Garante que o usuário admin exista se as variáveis de ambiente estiverem presentes."""
@@ -73,11 +89,23 @@ if os.getenv('FLASK_ENV') != 'production' and os.getenv('SUPABASE_URL'):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = get_user_by_id(int(user_id))
+    # Claims da sessão / cache em memória antes de ir ao banco (ver sessao_usuario)
+    user_data = sessao_usuario.get_user(int(user_id))
     if user_data:
         return User(user_data) # Retorna objeto User (ModelWrapper)
     return None
 
+@app.after_request
+def registrar_leituras_evitadas(response):
+    """Loga releituras evitadas pelo identity map e buscas por id agrupadas (ver supabase_client)."""
+    stats = request_cache_stats()
+    if stats['evitadas']:
+        print(f"♻️ {request.method} {request.path}: {stats['evitadas']} leitura(s) repetida(s) evitada(s)")
+    if stats['agrupadas'] > stats['consultas_em_lote']:
+        print(f"📦 {request.method} {request.path}: {stats['agrupadas']} busca(s) por id em "
+              f"{stats['consultas_em_lote']} consulta(s) IN")
+    return response
+
 # --- FUNÇÕES AUXILIARES E CONTEXT PROCESSORS ---
 
 def calculate_validity_status(validade_date):
@@ -128,6 +156,7 @@ def admin_only(f):
 # --- ROTAS DA APLICAÇÃO ---
 
 @app.route('/relatorio/movimentacoes')
+@query_budget(5)
 @admin_only
 @login_required
 def relatorio_movimentacoes():
@@ -135,172 +164,82 @@ def relatorio_movimentacoes():
     data_inicio_str = request.args.get('data_inicio')
     data_fim_str = request.args.get('data_fim')
     search_query = request.args.get('q', '')
+    per_page = 100
+    # Paginação por cursor, como em /estoque: só a página exibida sai do banco
+    after = request.args.get('apos')
+    before = request.args.get('antes')
+    page = request.args.get('page', 1, type=int) if (after or before) else 1
 
-    # Busca dados via helper (já faz os joins e filtros básicos)
-    movimentacoes_data = get_movimentacoes_report(
+    pagina = get_movimentacoes_report_page(
         data_inicio=data_inicio_str,
         data_fim=data_fim_str,
-        search_term=search_query
+        search_term=search_query,
+        per_page=per_page, after=after, before=before
     )
-    
+    if not pagina['prev_cursor']:
+        page = 1
+
     # Envolve em objetos para compatibilidade com template (acesso .item.codigo)
-    movimentacoes = [Movimentacao(m) for m in movimentacoes_data]
+    movimentacoes = [Movimentacao(m) for m in pagina['items']]
 
     # --- Lógica para o Gráfico de Pizza ---
-    # Conta o número de ocorrências de cada tipo de movimentação na lista filtrada
-    entradas_count = sum(1 for mov in movimentacoes if 'ENTRADA' in mov.tipo and 'AJUSTE' not in mov.tipo)
-    saidas_count = sum(1 for mov in movimentacoes if 'SAIDA' in mov.tipo and 'AJUSTE' not in mov.tipo)
-    ajustes_count = sum(1 for mov in movimentacoes if 'AJUSTE' in mov.tipo)
+    # Contagem por tipo de todo o período filtrado, agrupada no banco
+    contagem = get_movimentacoes_contagem_por_tipo(data_inicio_str, data_fim_str, search_query)
+    entradas_count = sum(n for tipo, n in contagem.items() if 'ENTRADA' in tipo and 'AJUSTE' not in tipo)
+    saidas_count = sum(n for tipo, n in contagem.items() if 'SAIDA' in tipo and 'AJUSTE' not in tipo)
+    ajustes_count = sum(n for tipo, n in contagem.items() if 'AJUSTE' in tipo)
 
     pie_chart_data = {
         'labels': ['Entradas', 'Saídas', 'Ajustes'],
         'counts': [entradas_count, saidas_count, ajustes_count]
     }
 
+    pagination = Pagination.from_cursor(movimentacoes, max(page, 1), per_page, sum(contagem.values()),
+                                        pagina['next_cursor'], pagina['prev_cursor'],
+                                        total_estimado=False)
+
     return render_template('relatorio_movimentacoes.html', 
                            movimentacoes=movimentacoes, 
                            title="Relatório de Movimentações", 
                            data_inicio=data_inicio_str, data_fim=data_fim_str, 
                            search_query=search_query,
-                           pie_chart_data=pie_chart_data)
+                           pie_chart_data=pie_chart_data,
+                           pagination=pagination)
 
 @app.route('/dashboard')
+@query_budget(5)
 @login_required
 def dashboard():
     """Renderiza o dashboard com dados reais do banco de dados (Supabase REST)."""
-    hoje = date.today()
+    # Renderiza a partir do snapshot materializado (ver dashboard_snapshot.py).
+    # O recálculo completo (consultas em paralelo) só ocorre quando o snapshot expira;
+    # as rotas de escrita mantêm o snapshot atualizado com deltas.
+    contexto = dashboard_snapshot.template_context()
 
-    # --- KPIs e Métricas Gerais (via helper otimizado) ---
-    metrics = get_dashboard_metrics()
-    
-    # Lotes críticos
-    critical_lotes_data = get_critical_lotes(days=30)
-    critical_lotes = [EstoqueDetalhe(l) for l in critical_lotes_data]
+    if contexto['snapshot_incomplete']:
+        flash('Alguns indicadores não puderam ser carregados a tempo e podem estar incompletos.', 'warning')
 
-    # --- Dados para o Gráfico de Movimentações (Últimos 15 dias) ---
-    # Como isso requer agregação diária complexa, simplificamos ou mantemos via Python
-    # Para manter "sem alterar regras", buscamos movimentos dos ultimos 15 dias e agregamos aqui
-    labels_mov = [(hoje - timedelta(days=i)).strftime('%d/%m') for i in range(14, -1, -1)]
-    
-    # Busca movimentações dos últimos 15 dias para agregar
-    data_inicio_grafico = (hoje - timedelta(days=15)).strftime('%Y-%m-%d')
-    recent_moves_raw = get_movimentacoes_report(data_inicio=data_inicio_grafico)
-    
-    entradas_map = {}
-    saidas_map = {}
-    
-    for mov in recent_moves_raw:
-        dt = datetime.fromisoformat(mov['data_movimentacao']).strftime('%d/%m')
-        qtd = mov.get('quantidade', 0)
-        tipo = mov.get('tipo', '')
-        
-        if 'ENTRADA' in tipo:
-            entradas_map[dt] = entradas_map.get(dt, 0) + qtd
-        elif 'SAIDA' in tipo:
-            saidas_map[dt] = saidas_map.get(dt, 0) + qtd
-            
-    entradas = [entradas_map.get(lbl, 0) for lbl in labels_mov]
-    saidas = [saidas_map.get(lbl, 0) for lbl in labels_mov]
-
-    movimentacoes_chart_data = {
-        'labels': labels_mov, 'entradas': entradas, 'saidas': saidas
-    }
-
-    # --- Listas Top 5 ---
-    # Top stocked
-    top_items_data = get_top_items(limit=5, order_by='qtd_estoque', desc=True)
-    top_stocked_items = [ItemEstoque(i) for i in top_items_data]
-    
-    # Low stocked (precisa de lógica especial pois API não filtra col <= col)
-    low_items_data = get_low_stock_items(limit=5)
-    low_stocked_items = [ItemEstoque(i) for i in low_items_data]
-
-    # --- Atividade Recente ---
-    recent_mov_data = get_recent_movimentacoes(limit=5)
-    recent_movimentacoes = [Movimentacao(m) for m in recent_mov_data]
-
-    # --- Dados para Alertas de Validade ---
-    # Lotes vencendo hoje / proximos
-    lotes_hoje_data = get_expiring_lots(days=0, today_only=True)
-    lotes_vencendo_hoje = [EstoqueDetalhe(l) for l in lotes_hoje_data]
-    
-    lotes_prox_data = get_expiring_lots(days=40, today_only=False)
-    lotes_proximo_vencimento = [EstoqueDetalhe(l) for l in lotes_prox_data]
-
-    # --- DADOS DE CONSUMÍVEIS ---
-    # Simplificação: Buscamos todos consumíveis (se forem poucos) ou criamos helpers
-    # Assumindo quantity moderate, fetch all simples
-    todos_consumiveis = get_all_consumiveis()
-    total_consumiveis = len(todos_consumiveis)
-    consumiveis_zerados = sum(1 for c in todos_consumiveis if c.get('quantidade_atual', 0) == 0)
-    consumiveis_baixo_estoque = sum(1 for c in todos_consumiveis if c.get('quantidade_atual', 0) > 0 and c.get('quantidade_atual', 0) <= c.get('estoque_minimo', 0))
-    
-    # Ordenar para pegar top 5 low
-    low_consumiveis_data = sorted(todos_consumiveis, key=lambda x: x.get('quantidade_atual', 0))[:5]
-    low_consumiveis = [ConsumivelEstoque(c) for c in low_consumiveis_data]
-    
-    # Recent moves consumiveis
-    recent_cons_moves_data = get_movimentacoes_consumivel(limit=5)
-    recent_consumivel_moves = [MovimentacaoConsumivel(m) for m in recent_cons_moves_data]
-
-    return render_template('dashboard.html', 
-                           total_items_distintos=metrics['total_items_distintos'],
-                           total_unidades=metrics['total_unidades'],
-                           itens_zerados=metrics['itens_zerados'],
-                           critical_lotes=critical_lotes,
-                           movimentacoes_chart_data=movimentacoes_chart_data,
-                           tipos_chart_data=metrics['tipos_chart_data'],
-                           top_stocked_items=top_stocked_items,
-                           low_stocked_items=low_stocked_items,
-                           recent_movimentacoes=recent_movimentacoes,
-                           lotes_vencendo_hoje=lotes_vencendo_hoje,
-                           lotes_proximo_vencimento=lotes_proximo_vencimento,
-                           today_date=hoje,
-                           total_consumiveis=total_consumiveis,
-                           consumiveis_zerados=consumiveis_zerados,
-                           consumiveis_baixo_estoque=consumiveis_baixo_estoque,
-                           low_consumiveis=low_consumiveis,
-                           recent_consumivel_moves=recent_consumivel_moves)
+    return render_template('dashboard.html', **contexto)
 
 @app.route('/api/kpis')
+@query_budget(5)
 @login_required
 def api_kpis():
     """Retorna os dados dos KPIs principais em formato JSON."""
-    metrics = get_dashboard_metrics()
-    
-    # Busca lotes críticos via helper
-    critical_lotes_data = get_critical_lotes(days=30)
-    
-    kpis = {
-        'total_items_distintos': metrics['total_items_distintos'],
-        'total_unidades': metrics['total_unidades'],
-        'itens_zerados': metrics['itens_zerados'],
-        'critical_lotes': critical_lotes_data # Retorna lista de dicts
-    }
-    return jsonify(kpis)
+    # Mesmo snapshot do dashboard: o polling não dispara consultas ao Supabase
+    return jsonify(dashboard_snapshot.kpis())
 
 @app.route('/api/items/search')
 @login_required
 def api_items_search():
     """API para buscar itens por código ou descrição para autocompletar."""
-    search_query = request.args.get('q', '').lower()
-    
-    # Busca todos os itens (cache simplificado ou busca direta)
-    items_data = get_all_items_estoque()
+    search_query = request.args.get('q', '')
     
-    results = []
-    for item in items_data:
-        codigo = item.get('codigo', '').lower()
-        descricao = item.get('descricao', '').lower()
-        
-        if search_query in codigo or search_query in descricao:
-            results.append({
-                'id': item.get('id'), 
-                'text': f"{item.get('codigo')} - {item.get('descricao')}"
-            })
-            if len(results) >= 15: # Limite de resultados para performance
-                break
-                
+    # Índice em memória (atualizado pelas escritas de item; ver busca_itens.py)
+    results = [
+        {'id': item.get('id'), 'text': f"{item.get('codigo')} - {item.get('descricao')}"}
+        for item in busca_itens.search(search_query, limit=15)
+    ]
     return jsonify(results)
 
 @app.route('/api/item/<int:item_id>/historico-chart')
@@ -309,26 +248,13 @@ def api_item_historico_chart(item_id):
     """Retorna o histórico de movimentações de um item para o gráfico."""
     hoje = date.today()
     labels_mov = [(hoje - timedelta(days=i)).strftime('%d/%m') for i in range(14, -1, -1)]
+    dias_mov = [(hoje - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(14, -1, -1)]
     
-    # Busca movimentações dos últimos 15 dias via Supabase Helper
-    data_inicio = (hoje - timedelta(days=15)).strftime('%Y-%m-%d')
-    movimentacoes_raw = get_item_movements_in_period(item_id, days=15)
+    # Totais diários dos últimos 15 dias (todos os tipos), já agrupados no banco
+    por_dia = movimentacao_diaria.por_dia(get_item_movimentacao_diaria(item_id, days=15, tipo=None))
     
-    entradas_map = {}
-    saidas_map = {}
-    
-    for mov in movimentacoes_raw:
-        dt = datetime.fromisoformat(mov['data_movimentacao']).strftime('%d/%m')
-        qtd = mov.get('quantidade', 0)
-        tipo = mov.get('tipo', '')
-        
-        if 'ENTRADA' in tipo:
-            entradas_map[dt] = entradas_map.get(dt, 0) + qtd
-        elif 'SAIDA' in tipo:
-            saidas_map[dt] = saidas_map.get(dt, 0) + qtd
-            
-    entradas = [entradas_map.get(lbl, 0) for lbl in labels_mov]
-    saidas = [saidas_map.get(lbl, 0) for lbl in labels_mov]
+    entradas = [por_dia.get(dia, {}).get('entradas', 0) for dia in dias_mov]
+    saidas = [por_dia.get(dia, {}).get('saidas', 0) for dia in dias_mov]
     
     historico_data = {
         'labels': labels_mov,
@@ -349,28 +275,18 @@ def api_item_previsao(item_id):
         abort(404)
     item = ItemEstoque(item_data)
     
-    # 1. Coletar dados históricos de SAÍDA para o item (Via Supabase Helper)
-    historico_saidas_data = get_item_movements_in_period(item_id, days=90, tipo='SAIDA')
+    # 1. Coletar os totais diários de SAÍDA do item (tabela movimentacao_diaria)
+    historico_saidas_data = get_item_movimentacao_diaria(item_id, days=90, tipo='SAIDA')
     
     if not historico_saidas_data:
         return jsonify({'error': 'Dados históricos de saída insuficientes para previsão.', 'previsao': []}), 404
 
-    # 2. Preparar os dados para o modelo (série temporal diária)
-    data_saidas = []
-    for mov_dict in historico_saidas_data:
-        # Supabase retorna datas como strings ISO
-        dt_mov = datetime.fromisoformat(mov_dict.get('data_movimentacao'))
-        data_saidas.append({
-            'data': dt_mov.date(),
-            'quantidade': mov_dict.get('quantidade')
-        })
-    
-    df_saidas = pd.DataFrame(data_saidas)
-    df_saidas['data'] = pd.to_datetime(df_saidas['data'])
-    
-    # Agrupar por dia e somar as quantidades
-    df_diario = df_saidas.groupby('data')['quantidade'].sum().reset_index()
-    df_diario = df_diario.set_index('data')
+    # 2. Preparar os dados para o modelo (série temporal diária, já uma linha por dia)
+    df_diario = pd.DataFrame({
+        'data': pd.to_datetime([d['dia'] for d in historico_saidas_data]),
+        'quantidade': pd.to_numeric([d['quantidade'] for d in historico_saidas_data], errors='coerce'),
+    })
+    df_diario = df_diario.set_index('data').sort_index()
     
     # Preencher datas ausentes com 0 para ter uma série temporal contínua
     idx = pd.date_range(df_diario.index.min(), df_diario.index.max())
@@ -407,138 +323,28 @@ def api_item_previsao(item_id):
         print(f"Erro na previsão linear: {e}")
         return jsonify({'error': f'Erro ao gerar previsão: {e}', 'previsao': []}), 500
 
-def _gerar_previsao_para_item(item_id, dias_para_prever):
-    """
-    Função auxiliar interna para gerar previsão. Não é uma rota.
-    Retorna um dicionário com a previsão ou um erro.
-    """
-    item_data = get_item_estoque_by_id(item_id)
-    if not item_data:
-        return {'error': 'Item não encontrado.'}
-
-    historico_saidas_data = get_item_movements_in_period(item_id, days=90, tipo='SAIDA')
-
-    if not historico_saidas_data:
-        return {'error': 'Dados históricos insuficientes.', 'previsao': []}
-
-    data_saidas = []
-    for mov_dict in historico_saidas_data:
-        dt_mov = datetime.fromisoformat(mov_dict.get('data_movimentacao'))
-        data_saidas.append({'data': dt_mov.date(), 'quantidade': mov_dict.get('quantidade')})
-
-    df_saidas = pd.DataFrame(data_saidas)
-    df_saidas['data'] = pd.to_datetime(df_saidas['data'])
-    
-    df_diario = df_saidas.groupby('data')['quantidade'].sum().reset_index().set_index('data')
-    
-    idx = pd.date_range(df_diario.index.min(), df_diario.index.max())
-    df_diario = df_diario.reindex(idx, fill_value=0)
-    
-    try:
-        n = len(df_diario)
-        if n < 2:
-            return {'previsao': []}
-
-        x = np.arange(n)
-        y = df_diario['quantidade'].values
-        m, b = np.polyfit(x, y, 1)
-        
-        ultimo_dia = df_diario.index.max()
-        previsao_data = []
-        for i in range(1, dias_para_prever + 1):
-            valor_previsto = m * (n + i - 1) + b
-            forecast_date = ultimo_dia + timedelta(days=i)
-            previsao_data.append({
-                'data': forecast_date.strftime('%Y-%m-%d'),
-                'quantidade_prevista': max(0, round(float(valor_previsto), 2))
-            })
-        
-        return {'previsao': previsao_data}
-    except Exception as e:
-        print(f"Erro no modelo de previsão linear interna: {e}")
-        return {'error': f'Erro no modelo de previsão: {e}', 'previsao': []}
-
 @app.route('/api/sugestoes-compra')
+@query_budget(10)  # select_all pagina de SUPABASE_MAX_ROWS em SUPABASE_MAX_ROWS linhas
 @login_required
 def api_sugestoes_compra():
-    """Gera sugestões de compra inteligentes."""
+    """Gera sugestões de compra inteligentes (previsão em lote para todos os itens com estoque)."""
     try:
-        sugestoes = []
-        # Analisa apenas itens com estoque > 0 para evitar queries em itens abandonados
-        # Supabase filter gt
-        items_data = select_many('item_estoque', limit=100) # Simplificado, ideal filtrar gt qtd_estoque > 0 no server se fosse muitos
-        # Filtro python pq select_many basico nao expoe gt facilmente (podemos usar supabase direto se precisar)
-        itens = [ItemEstoque(i) for i in items_data if i.get('qtd_estoque', 0) > 0]
-
-        for item in itens:
-            try:
-                dias_para_prever = item.tempo_reposicao or 7
-                resultado_previsao = _gerar_previsao_para_item(int(item.id), dias_para_prever)
-                
-                if 'error' in resultado_previsao:
-                    continue
-
-                previsao_data = resultado_previsao
-                consumo_previsto_total = sum(p['quantidade_prevista'] for p in previsao_data.get('previsao', []))
-
-                estoque_projetado = (item.qtd_estoque or 0) - consumo_previsto_total
-
-                if estoque_projetado < (item.estoque_minimo or 0):
-                    if item.estoque_ideal_compra and item.estoque_ideal_compra > 0:
-                        quantidade_sugerida = item.estoque_ideal_compra
-                    else:
-                        quantidade_sugerida = (item.estoque_minimo * 2) - estoque_projetado
-                    
-                    dias_ate_critico = (item.qtd_estoque - item.estoque_minimo) / (consumo_previsto_total / dias_para_prever) if consumo_previsto_total > 0 else float('inf')
-                    data_limite_pedido = date.today() + timedelta(days=max(0, dias_ate_critico))
-
-                    sugestoes.append({
-                        'item_id': item.id,
-                        'item_descricao': item.descricao,
-                        'item_codigo': item.codigo,
-                        'quantidade_sugerida': round(quantidade_sugerida, 2),
-                        'data_limite_pedido': data_limite_pedido.strftime('%d/%m/%Y')
-                    })
-            except Exception as e:
-                print(f"Erro ao processar item {item.id}: {str(e)}")
-                continue
-
-        sugestoes_ordenadas = sorted(sugestoes, key=lambda x: datetime.strptime(x['data_limite_pedido'], '%d/%m/%Y'))
-        return jsonify(sugestoes_ordenadas)
-    
+        return jsonify(gerar_sugestoes_compra())
     except Exception as e:
         print(f"Erro geral em api_sugestoes_compra: {str(e)}")
         return jsonify([])
 
 @app.route('/api/stock-turnover-data')
+@query_budget(10)  # select_all pagina de SUPABASE_MAX_ROWS em SUPABASE_MAX_ROWS linhas
 @login_required
 def api_stock_turnover_data():
-    """Giro de estoque."""
-    items_data = select_many('item_estoque', limit=200) # Limite aumentado
-    itens = [ItemEstoque(i) for i in items_data if i.get('qtd_estoque', 0) > 0]
-    
-    itens_com_giro = []
-    
-    for item in itens:
-        # Busca saídas nos últimos 90 dias
-        moves = get_item_movements_in_period(int(item.id), days=90, tipo='SAIDA')
-        total_saidas_periodo = sum(m.get('quantidade', 0) for m in moves)
-
-        giro_estoque = 0
-        if item.qtd_estoque > 0: # Evita divisão por zero
-            giro_estoque = total_saidas_periodo / item.qtd_estoque
-        
-        itens_com_giro.append({
-            'id': item.id,
-            'descricao': item.descricao,
-            'codigo': item.codigo,
-            'giro_estoque': round(giro_estoque, 2),
-            'qtd_estoque': item.qtd_estoque,
-            'total_saidas': total_saidas_periodo
-        })
-    
-    itens_com_giro_ordenado = sorted(itens_com_giro, key=lambda x: x['giro_estoque'])
-    return jsonify(itens_com_giro_ordenado[:10])
+    """
+    Giro de estoque: itens de menor giro no período.
+    Parâmetros opcionais: ?dias=90 (janela) e ?top=10 (quantidade de itens).
+    """
+    dias = min(max(request.args.get('dias', 90, type=int), 1), 365)
+    top = min(max(request.args.get('top', 10, type=int), 1), 100)
+    return jsonify(calcular_giro_estoque(dias=dias, top=top))
 
 @app.route('/')
 @login_required
@@ -586,11 +392,10 @@ def cadastro():
 
         validade = validade_str if validade_str else None
 
-        # --- INÍCIO TRANSAÇÃO MANUAL ---
         created_item = None
         
         try:
-            # 1. Cria ItemEstoque
+            # 1. Cria ItemEstoque (zerado; o saldo vem da entrada inicial)
             item_data = {
                 'codigo': codigo,
                 'endereco': request.form.get('endereco'),
@@ -602,50 +407,38 @@ def cadastro():
                 'estoque_minimo': float(request.form.get('estoque_minimo', 5)),
                 'estoque_ideal_compra': float(request.form.get('estoque_ideal_compra', 0)) if request.form.get('estoque_ideal_compra') else None,
                 'cliente': request.form.get('cliente'),
-                'qtd_estoque': qtd_entrada, # Já inicializa com a qtd
+                'qtd_estoque': 0,
                 'tempo_reposicao': int(request.form.get('tempo_reposicao', 7))
             }
             
             created_item = create_item_estoque(item_data)
             if not created_item:
                  raise Exception("Falha ao criar ItemEstoque")
-                 
-            item_id = created_item['id']
-
-            # 2. Cria EstoqueDetalhe
-            detalhe_data = {
-                'item_estoque_id': item_id,
-                'lote': lote,
-                'item_nf': item_nf,
-                'nf': nf,
-                'validade': validade,
-                'estacao': 'Almoxarifado',
-                'quantidade': qtd_entrada
-            }
-            if not create_estoque_detalhe(detalhe_data):
-                raise Exception("Falha ao criar EstoqueDetalhe")
-
-            # 3. Cria Movimentacao
-            mov_data = {
-                'item_id': item_id,
-                'tipo': 'ENTRADA',
-                'quantidade': qtd_entrada,
-                'lote': lote,
-                'item_nf': item_nf,
-                'nf': nf,
-                'usuario': current_user.username if hasattr(current_user, 'username') else 'admin',
-                'etapa': 'CADASTRO',
-                'observacao': 'Entrada inicial via cadastro de novo item.'
-            }
-            create_movimentacao(mov_data)
+            dashboard_snapshot.apply_item(created_item)
+
+            # 2. Lote + saldo + movimentação em uma única operação atômica
+            registrar_movimentacao(
+                'ENTRADA',
+                item_id=created_item['id'],
+                quantidade=qtd_entrada,
+                lote=lote,
+                item_nf=item_nf,
+                nf=nf,
+                validade=validade,
+                estacao='Almoxarifado',
+                usuario=current_user.username if hasattr(current_user, 'username') else 'admin',
+                etapa='CADASTRO',
+                observacao='Entrada inicial via cadastro de novo item.'
+            )
 
             flash('Item e seu primeiro lote cadastrados com sucesso!', 'success')
             
         except Exception as e:
-            # Rollback Manual (compensating transaction)
+            # A entrada não gravou nada; só o item recém-criado precisa ser desfeito
             if created_item:
                 print(f"⚠️ Rolling back item {created_item['id']} due to error: {e}")
                 delete_item_estoque(created_item['id'])
+                dashboard_snapshot.remove_item(created_item['id'])
                 
             flash(f'Erro ao cadastrar o item e lote: {e}', 'danger')
         
@@ -801,22 +594,24 @@ def estoque():
     Página para listar todos os lotes detalhados do estoque.
     """
     search_query = request.args.get('q', '')
-    page = request.args.get('page', 1, type=int)
     per_page = 25
-    
-    items, total = get_estoque_detalhado(page=page, per_page=per_page, search_term=search_query)
-    
+    # Paginação por cursor: 'apos'/'antes' são os cursores das páginas vizinhas;
+    # 'page' só numera a página exibida
+    after = request.args.get('apos')
+    before = request.args.get('antes')
+    page = request.args.get('page', 1, type=int) if (after or before) else 1
+
+    pagina = get_estoque_detalhado(per_page=per_page, search_term=search_query, after=after, before=before)
+    if not pagina['prev_cursor']:
+        page = 1
+
     # Envolve em objetos EstoqueDetalhe
-    lotes_detalhados = [EstoqueDetalhe(i) for i in items]
-    
-    # Cria objeto de paginação compatível com a template (classe Pagination definida em models.py)
-    pagination = Pagination(lotes_detalhados, page, per_page, total)
-    
-    # Como a classe Pagination popula .items, podemos passar pagination.items ou a lista direta
-    # O template 'estoque.html' provavelmente itera sobre `lotes_detalhados` ou `pagination.items`?
-    # No código original: lotes_detalhados = pagination.items -> template recebe lotes_detalhados
-    # E pagination recebe pagination.
-    
+    lotes_detalhados = [EstoqueDetalhe(i) for i in pagina['items']]
+
+    pagination = Pagination.from_cursor(lotes_detalhados, max(page, 1), per_page, pagina['total'],
+                                        pagina['next_cursor'], pagina['prev_cursor'],
+                                        total_estimado=pagina['total_estimado'])
+
     return render_template('estoque.html',
                            lotes_detalhados=lotes_detalhados,
                            search_query=search_query,
@@ -864,7 +659,7 @@ def editar_item(item_id):
         }
 
         try:
-            update_item_estoque(item_id, update_data)
+            dashboard_snapshot.apply_item(update_item_estoque(item_id, update_data))
             flash('Item atualizado com sucesso!', 'success')
             return redirect(url_for('estoque'))
         except Exception as e:
@@ -893,6 +688,7 @@ def excluir_item(item_id):
         success = delete_item_estoque(item_id)
         if hasattr(success, 'error') and success.error:
              raise Exception(success.error.message)
+        dashboard_snapshot.remove_item(item_id)
              
         flash(f'Item "{item_data.get("descricao")}" excluído com sucesso.', 'success')
     except Exception as e:
@@ -915,11 +711,6 @@ def movimentacao():
             flash('Item ou tipo de movimentação inválido.', 'danger')
             return redirect(url_for('movimentacao'))
 
-        item_data = get_item_estoque_by_id(item_id)
-        if not item_data:
-            abort(404)
-        item = ItemEstoque(item_data)
-
         if not etapa:
             flash('O campo Etapa de Destino é obrigatório.', 'danger')
             return redirect(url_for('movimentacao'))
@@ -934,6 +725,7 @@ def movimentacao():
             return redirect(url_for('movimentacao'))
 
         try:
+            # Lote, saldo do item e histórico em uma única operação atômica (ver movimentacoes.py)
             # --- LÓGICA DE ENTRADA ---
             if tipo == 'ENTRADA':
                 lote = request.form.get('lote')
@@ -943,56 +735,20 @@ def movimentacao():
                     flash('Lote e Item NF são obrigatórios para entrada.', 'danger')
                     return redirect(url_for('movimentacao'))
 
-                # Verifica se já existe um detalhe com a mesma combinação de lote, item_nf e nf
-                # Usando select_many com filtros
-                filters = {'item_estoque_id': item.id, 'lote': lote, 'item_nf': item_nf, 'nf': nf}
-                existing_details = select_many('estoque_detalhe', filters=filters)
-                detalhe_existente = existing_details[0] if existing_details else None
-                
-                if detalhe_existente:
-                    # Se existe, apenas soma a quantidade
-                    nova_qtd = float(detalhe_existente['quantidade']) + quantidade
-                    update_estoque_detalhe(detalhe_existente['id'], {'quantidade': nova_qtd})
-                else:
-                    # Se não existe, cria um novo
-                    validade_str = request.form.get('validade')
-
-                    # Lógica para determinar a estação automaticamente
-                    # Busca último detalhe do item order by entrada desc
-                    last_details = select_many('estoque_detalhe', filters={'item_estoque_id': item.id}, order_by='-data_entrada', limit=1)
-                    
-                    ultimo_detalhe = last_details[0] if last_details else None
-                    estacao_automatica = ultimo_detalhe.get('estacao') if ultimo_detalhe and ultimo_detalhe.get('estacao') else 'Almoxarifado'
-
-                    novo_detalhe = {
-                        'item_estoque_id': item.id,
-                        'lote': lote,
-                        'item_nf': item_nf,
-                        'nf': nf,
-                        'validade': validade_str if validade_str else None,
-                        'estacao': estacao_automatica,
-                        'quantidade': quantidade
-                    }
-                    create_estoque_detalhe(novo_detalhe)
-
-                # Atualiza o total
-                nova_qtd_total = float(item.qtd_estoque or 0) + quantidade
-                update_item_estoque(item.id, {'qtd_estoque': nova_qtd_total})
-
-                mov_data = {
-                    'item_id': item.id, 
-                    'tipo': 'ENTRADA', 
-                    'quantidade': quantidade, 
-                    'lote': lote, 
-                    'item_nf': item_nf,
-                    'nf': nf,
-                    'usuario': current_user.username,
-                    'etapa': etapa,
-                    'observacao': observacao
-                }
-                create_movimentacao(mov_data)
-                
-                socketio.emit('dashboard_update', {'message': 'Nova entrada registrada!'})
+                # Soma no lote com a mesma combinação lote/item_nf/nf ou cria um novo
+                # (estação herdada do último lote do item)
+                registrar_movimentacao(
+                    'ENTRADA',
+                    item_id=item_id,
+                    quantidade=quantidade,
+                    lote=lote,
+                    item_nf=item_nf,
+                    nf=nf,
+                    validade=request.form.get('validade') or None,
+                    usuario=current_user.username,
+                    etapa=etapa,
+                    observacao=observacao
+                )
                 flash('Entrada registrada com sucesso!', 'success')
 
             # --- LÓGICA DE SAÍDA ---
@@ -1002,38 +758,22 @@ def movimentacao():
                     flash('É necessário selecionar um Lote/Item NF para a saída.', 'danger')
                     return redirect(url_for('movimentacao'))
 
-                detalhe_estoque = get_estoque_detalhe_by_id(detalhe_id)
-
-                if not detalhe_estoque or detalhe_estoque.get('item_estoque_id') != item.id:
-                    flash('Lote/Item NF inválido para este item.', 'danger')
-                    return redirect(url_for('movimentacao'))
-                
-                qtd_disponivel = float(detalhe_estoque['quantidade'])
-                if qtd_disponivel < quantidade:
-                    flash(f'Quantidade insuficiente no lote selecionado. Disponível: {qtd_disponivel}', 'danger')
-                    return redirect(url_for('movimentacao'))
-
-                # Subtrai a quantidade
-                update_estoque_detalhe(detalhe_id, {'quantidade': qtd_disponivel - quantidade})
-                new_total = float(item.qtd_estoque or 0) - quantidade
-                update_item_estoque(item.id, {'qtd_estoque': new_total})
-
-                mov_data = {
-                    'item_id': item.id, 
-                    'tipo': 'SAIDA', 
-                    'quantidade': quantidade, 
-                    'lote': detalhe_estoque.get('lote'), 
-                    'item_nf': detalhe_estoque.get('item_nf'),
-                    'nf': detalhe_estoque.get('nf'),
-                    'usuario': current_user.username,
-                    'etapa': etapa,
-                    'observacao': observacao
-                }
-                create_movimentacao(mov_data)
-                
-                socketio.emit('dashboard_update', {'message': 'Nova saída registrada!'})
+                # O saldo do lote é conferido (e travado) dentro da transação
+                registrar_movimentacao(
+                    'SAIDA',
+                    item_id=item_id,
+                    detalhe_id=detalhe_id,
+                    quantidade=quantidade,
+                    usuario=current_user.username,
+                    etapa=etapa,
+                    observacao=observacao
+                )
                 flash('Saída registrada com sucesso!', 'success')
-                
+
+        except MovimentacaoError as e:
+            if e.codigo == 'NAO_ENCONTRADO':
+                abort(404)
+            flash(e.mensagem, 'danger')
         except Exception as e:
              flash(f'Erro ao registrar movimentação: {e}', 'danger')
 
@@ -1088,10 +828,6 @@ def editar_lote(detalhe_id):
     if not detalhe_data:
         abort(404)
     detalhe = EstoqueDetalhe(detalhe_data)
-    
-    # Fetch item associated
-    item_data = get_item_estoque_by_id(detalhe.item_estoque_id)
-    item = ItemEstoque(item_data) if item_data else None
 
     if request.method == 'POST':
         try:
@@ -1114,53 +850,26 @@ def editar_lote(detalhe_id):
                 flash('A quantidade não pode ser negativa.', 'danger')
                 return render_template('editar_lote.html', detalhe=detalhe)
 
-            # --- Cálculo do Ajuste ---
-            quantidade_antiga = float(detalhe.quantidade or 0)
-            diferenca_qtd = nova_quantidade - quantidade_antiga
-
-            # --- Prepare updates ---
+            # --- Ajuste atômico: lote, endereço/total do item e movimentação de ajuste ---
+            # (a diferença é calculada sobre a quantidade do lote no momento da gravação)
             validade_str = request.form.get('validade')
-            update_detalhe_data = {
-                'lote': request.form.get('lote'),
-                'nf': request.form.get('nf'),
-                'item_nf': request.form.get('item_nf'),
-                'validade': validade_str if validade_str else None,
-                'estacao': request.form.get('estacao'),
-                'quantidade': nova_quantidade
-            }
-            
-            # Atualiza o detalhe
-            update_estoque_detalhe(detalhe_id, update_detalhe_data)
-            
-            # Atualiza o item: endereço e total
-            # Total += diferenca
-            novo_total_item = float(item.qtd_estoque or 0) + diferenca_qtd
-            update_item_data = {
-                'endereco': novo_endereco,
-                'qtd_estoque': novo_total_item
-            }
-            update_item_estoque(item.id, update_item_data)
-
-            # --- Registro da Movimentação de Ajuste ---
-            tipo_ajuste = 'AJUSTE-ENTRADA' if diferenca_qtd > 0 else 'AJUSTE-SAIDA'
-            qtd_movimentacao = abs(diferenca_qtd)
-
-            if qtd_movimentacao > 0:
-                mov_data = {
-                    'item_id': item.id,
-                    'tipo': tipo_ajuste,
-                    'quantidade': qtd_movimentacao,
-                    'lote': request.form.get('lote'),
-                    'item_nf': request.form.get('item_nf'),
-                    'nf': request.form.get('nf'),
-                    'usuario': current_user.username,
-                    'etapa': 'AJUSTE',
-                    'observacao': f"Ajuste manual. Motivo: {observacao}. Qtd anterior: {quantidade_antiga}, Qtd nova: {nova_quantidade}."
-                }
-                create_movimentacao(mov_data)
+            registrar_movimentacao(
+                'AJUSTE',
+                item_id=detalhe.item_estoque_id,
+                detalhe_id=detalhe_id,
+                nova_quantidade=nova_quantidade,
+                lote=request.form.get('lote'),
+                nf=request.form.get('nf'),
+                item_nf=request.form.get('item_nf'),
+                validade=validade_str if validade_str else None,
+                estacao=request.form.get('estacao'),
+                endereco=novo_endereco,
+                motivo=observacao,
+                usuario=current_user.username
+            )
 
             flash('Lote editado com sucesso! O histórico de movimentação foi atualizado.', 'success')
-            return redirect(url_for('detalhes_lotes', item_id=item.id))
+            return redirect(url_for('detalhes_lotes', item_id=detalhe.item_estoque_id))
 
         except Exception as e:
             flash(f'Ocorreu um erro ao tentar editar o lote: {e}', 'danger')
@@ -1192,38 +901,16 @@ def _calcular_quantidade_recebida(detalhe_lote):
 @login_required
 def excluir_lote(detalhe_id):
     """
-    Exclui um lote e remove movimentações (Safe Delete Manual).
+    Exclui um lote, remove suas movimentações e desconta o saldo do item
+    (uma operação atômica, ver movimentacoes.py).
     """
     detalhe_data = get_estoque_detalhe_by_id(detalhe_id)
     if not detalhe_data:
         abort(404)
     item_id = detalhe_data['item_estoque_id']
-    item_data = get_item_estoque_by_id(item_id)
     
     try:
-        qtd_lote = float(detalhe_data['quantidade'] or 0)
-        
-        # 1. Remove movimentações (se possível filtrar pelo lote/nf/item_nf/item_id)
-        # Filtro: item_id, lote, item_nf, nf
-        supabase.table('movimentacao').delete().match({
-            'item_id': item_id,
-            'lote': detalhe_data['lote'],
-            'nf': detalhe_data['nf'], # Importante
-            # item_nf as vezes é vazio, supabase match pode falhar se vazio?
-        }).execute()
-        # Se item_nf for relevante:
-        # Mas vamos simplificar: o ideal é remover tudo que bate com o lote.
-        
-        # 2. Ajusta estoque do item
-        # Só se o item ainda existir
-        if item_data:
-            current_total = float(item_data.get('qtd_estoque') or 0)
-            new_total = max(0, current_total - qtd_lote)
-            update_item_estoque(item_id, {'qtd_estoque': new_total})
-            
-        # 3. Remove o detalhe
-        delete_estoque_detalhe(detalhe_id)
-        
+        registrar_movimentacao('EXCLUIR_LOTE', item_id=item_id, detalhe_id=detalhe_id)
         flash('Lote excluído com sucesso.', 'success')
         
     except Exception as e:
@@ -1236,51 +923,19 @@ def excluir_lote(detalhe_id):
 @login_required
 def excluir_movimentacao(mov_id):
     """
-    Exclui (reverte) uma movimentação de estoque.
+    Exclui (reverte) uma movimentação de estoque: devolve a quantidade ao item
+    e ao lote de origem e apaga o lançamento, atomicamente.
     """
     try:
-        mov_response = supabase.table('movimentacao').select('*, item_estoque(*)').eq('id', mov_id).execute()
-        mov = mov_response.data[0] if mov_response.data else None
-        
-        if not mov:
-            abort(404)
-            
-        item_id = mov['item_id'] # ou item_estoque.id
-        quantidade_mov = float(mov['quantidade'])
-        
-        # Encontra lote
-        filters = {'item_estoque_id': item_id, 'lote': mov['lote'], 'nf': mov['nf']}
-        detalhes = select_many('estoque_detalhe', filters=filters, limit=1)
-        detalhe_lote = detalhes[0] if detalhes else None
-        
-        # Item total
-        item_data = mov['item_estoque'] # joined data
-        current_item_qtd = float(item_data['qtd_estoque'] or 0)
-        
-        if 'ENTRADA' in mov['tipo']:
-            # Reverte ENTRADA -> Subtrai
-            novo_total = max(0, current_item_qtd - quantidade_mov)
-            update_item_estoque(item_id, {'qtd_estoque': novo_total})
-            
-            if detalhe_lote:
-                old_qtd = float(detalhe_lote['quantidade'])
-                update_estoque_detalhe(detalhe_lote['id'], {'quantidade': max(0, old_qtd - quantidade_mov)})
-                
-        elif 'SAIDA' in mov['tipo']:
-             # Reverte SAIDA -> Soma
-            novo_total = current_item_qtd + quantidade_mov
-            update_item_estoque(item_id, {'qtd_estoque': novo_total})
-            
-            if detalhe_lote:
-                old_qtd = float(detalhe_lote['quantidade'])
-                update_estoque_detalhe(detalhe_lote['id'], {'quantidade': old_qtd + quantidade_mov})
-            else:
-                flash('Aviso: O lote original não foi encontrado. O estoque total foi ajustado.', 'warning')
-        
-        # Delete mov
-        delete_movimentacao(mov_id)
+        resultado = registrar_movimentacao('ESTORNO', movimentacao_id=mov_id)
+        if 'SAIDA' in (resultado['movimentacao'].get('tipo') or '') and not resultado['lote_encontrado']:
+            flash('Aviso: O lote original não foi encontrado. O estoque total foi ajustado.', 'warning')
         flash(f'Movimentação ID {mov_id} revertida com sucesso!', 'success')
         
+    except MovimentacaoError as e:
+        if e.codigo == 'NAO_ENCONTRADO':
+            abort(404)
+        flash(f'Erro ao reverter movimentação: {e}', 'danger')
     except Exception as e:
         flash(f'Erro ao reverter movimentação: {e}', 'danger')
 
@@ -1296,6 +951,7 @@ def apagar_movimentacao(mov_id):
     """
     try:
         delete_movimentacao(mov_id)
+        dashboard_snapshot.invalidate()
         flash(f'Linha de movimentação ID {mov_id} apagada com sucesso!', 'success')
     except Exception as e:
         flash(f'Erro ao apagar a movimentação: {e}', 'danger')
@@ -1378,6 +1034,7 @@ def api_get_lotes(item_id):
     return jsonify(lotes)
 
 @app.route('/importar', methods=['GET', 'POST'])
+@query_budget(40)  # blocos IN / insert em lote crescem com a planilha, não com cada linha
 @admin_required
 @login_required
 def importar():
@@ -1396,102 +1053,13 @@ def importar():
             try:
                 df = pd.read_excel(file)
                 
-                required_columns = ['CÓDIGO', 'DESCRIÇÃO', 'LOTE', 'NF', 'QTD ESTOQUE']
-                if not all(col in df.columns for col in required_columns):
-                    flash(f'A planilha deve conter as colunas obrigatórias: {", ".join(required_columns)}', 'danger')
+                if not all(col in df.columns for col in REQUIRED_COLUMNS):
+                    flash(f'A planilha deve conter as colunas obrigatórias: {", ".join(REQUIRED_COLUMNS)}', 'danger')
                     return redirect(request.url)
 
-                sucesso_count = 0
-                erro_count = 0
-                
-                for index, row in df.iterrows():
-                    codigo = str(row['CÓDIGO']) if pd.notna(row['CÓDIGO']) else None
-                    if not codigo:
-                        erro_count += 1
-                        continue
-
-                    descricao = str(row['DESCRIÇÃO']) if pd.notna(row['DESCRIÇÃO']) else 'Sem Descrição'
-                    lote = str(row['LOTE']) if pd.notna(row['LOTE']) else 'N/A'
-                    nf = str(row.get('NF')) if pd.notna(row.get('NF')) else 'N/A'
-                    qtd_entrada = float(row['QTD ESTOQUE']) if pd.notna(row['QTD ESTOQUE']) else 0
-
-                    # 1. Busca ou Cria Item
-                    item = get_item_estoque_by_codigo(codigo)
-                    if not item:
-                        # Cria novo item
-                        new_item_data = {
-                            'codigo': codigo,
-                            'descricao': descricao,
-                            'endereco': str(row.get('LOCAL', '')) if pd.notna(row.get('LOCAL')) else '',
-                            'codigo_opcional': str(row.get('CÓDIGO OPCIONAL', '')) if pd.notna(row.get('CÓDIGO OPCIONAL')) else '',
-                            'tipo': str(row.get('TIPO', '')) if pd.notna(row.get('TIPO')) else '',
-                            'un': str(row.get('UN.', '')) if pd.notna(row.get('UN.')) else '',
-                            'dimensao': str(row.get('DIMENSÃO', '')) if pd.notna(row.get('DIMENSÃO')) else '',
-                            'cliente': str(row.get('CLIENTE', '')) if pd.notna(row.get('CLIENTE')) else '',
-                            'qtd_estoque': 0
-                        }
-                        # response.data[0]
-                        res = create_item_estoque(new_item_data)
-                        if res and hasattr(res, 'data') and res.data:
-                             item = res.data[0]
-                        else:
-                             # Fallback check if created
-                             item = get_item_estoque_by_codigo(codigo)
-
-                    if not item:
-                         erro_count += 1
-                         continue
-                         
-                    item_id = item['id']
-                    
-                    # 2. Busca ou Cria Detalhe (Lote)
-                    item_nf = str(row.get('ITEM NF')) if pd.notna(row.get('ITEM NF')) else 'N/A'
-                    
-                    filters = {'item_estoque_id': item_id, 'lote': lote, 'item_nf': item_nf, 'nf': nf}
-                    existing_details = select_many('estoque_detalhe', filters=filters, limit=1)
-                    detalhe_existente = existing_details[0] if existing_details else None
-                    
-                    if detalhe_existente:
-                        novo_qtd_lote = float(detalhe_existente['quantidade']) + qtd_entrada
-                        update_estoque_detalhe(detalhe_existente['id'], {'quantidade': novo_qtd_lote})
-                    else:
-                        validade_val = row.get('VALIDADE')
-                        validade_dt = None
-                        if pd.notna(validade_val):
-                             try:
-                                 validade_dt = pd.to_datetime(validade_val).strftime('%Y-%m-%d')
-                             except:
-                                 validade_dt = None
-                                 
-                        novo_detalhe = {
-                            'item_estoque_id': item_id,
-                            'lote': lote,
-                            'item_nf': item_nf,
-                            'nf': nf,
-                            'validade': validade_dt,
-                            'estacao': str(row.get('ESTAÇÃO', '')) if pd.notna(row.get('ESTAÇÃO')) else '',
-                            'quantidade': qtd_entrada
-                        }
-                        create_estoque_detalhe(novo_detalhe)
-                    
-                    # 3. Atualiza Item Total
-                    current_total = float(item.get('qtd_estoque') or 0)
-                    update_item_estoque(item_id, {'qtd_estoque': current_total + qtd_entrada})
-                    
-                    # 4. Cria Movimentacao
-                    mov_data = {
-                        'item_id': item_id, 
-                        'tipo': 'ENTRADA', 
-                        'quantidade': qtd_entrada, 
-                        'lote': lote, 
-                        'nf': nf,
-                        'item_nf': str(row.get('ITEM NF', 'N/A')), 
-                        'usuario': current_user.username,
-                        'etapa': 'IMPORTACAO',
-                        'observacao': 'Importação via Excel'
-                    }
-                    create_movimentacao(mov_data)
-                    sucesso_count += 1
+                resultado = importar_planilha_estoque(df, current_user.username)
+                sucesso_count = resultado['sucesso']
+                erro_count = resultado['erros']
 
                 flash(f'Importação concluída! {sucesso_count} registros processados com sucesso. {erro_count} linhas ignoradas.', 'success')
 
@@ -1512,107 +1080,20 @@ def importar():
 def exportar_excel():
     """
     Exporta um relatório detalhado do estoque para Excel.
+    A planilha é gerada em streaming (memória constante) e enviada em blocos.
     """
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import PatternFill, Font, Alignment
-        from openpyxl.utils import get_column_letter
-        
-        colunas_ordem = [
-            'CÓDIGO', 'CÓDIGO OPCIONAL', 'TIPO', 'DESCRIÇÃO',
-            'LOCAL', 'UN', 'DIMENSÃO', 'CLIENTE',
-            'LOTE', 'ITEM NF', 'NF',
-            'VALIDADE', 'ESTAÇÃO', 'QTD ESTOQUE', 'DATA ENTRADA'
-        ]
-        
-        # Busca dados do Supabase (join detalhe -> item)
-        # Atenção: Fetching all could be slow if huge.
-        response = supabase.table('estoque_detalhe') \
-            .select('*, item_estoque(*)') \
-            .order('data_entrada', desc=False) \
-            .execute()
-        
-        detalhes = response.data if response.data else []
-        
-        # Ordenação secundária no Python se necessário (CÓDIGO, DATA)
-        # Mas 'item_estoque.codigo' não é campo direto para orderby no supabase (requires relational sort syntax sometimes complex).
-        # Vamos ordenar em Python.
-        detalhes.sort(key=lambda x: (
-            (x.get('item_estoque') or {}).get('codigo', ''), 
-            x.get('data_entrada', '')
-        ))
-
-        workbook = Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Estoque_Detalhado'
-        
-        # Cabeçalho
-        for num_coluna, nome_coluna in enumerate(colunas_ordem, start=1):
-            célula = worksheet.cell(row=1, column=num_coluna)
-            célula.value = nome_coluna
-            célula.fill = PatternFill(start_color='00D4FF', end_color='00D4FF', fill_type='solid')
-            célula.font = Font(bold=True, color='FFFFFF', size=11)
-            célula.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-        
-        # Dados
-        for num_linha, detalhe in enumerate(detalhes, start=2):
-            item = detalhe.get('item_estoque') or {}
-            
-            validade_str = ''
-            if detalhe.get('validade'):
-                try:
-                    validade_str = datetime.strptime(detalhe['validade'], '%Y-%m-%d').strftime('%d/%m/%Y')
-                except:
-                    validade_str = detalhe['validade']
-            
-            data_entrada_str = ''
-            if detalhe.get('data_entrada'):
-                 try:
-                     # Supabase returns iso format usually
-                     dt_obj = datetime.fromisoformat(detalhe['data_entrada'].replace('Z', '+00:00'))
-                     data_entrada_str = dt_obj.strftime('%d/%m/%Y %H:%M:%S')
-                 except:
-                     data_entrada_str = detalhe['data_entrada']
-
-            dados_linha = {
-                'CÓDIGO': str(item.get('codigo', '')).strip(),
-                'CÓDIGO OPCIONAL': str(item.get('codigo_opcional', '') or '').strip(),
-                'TIPO': str(item.get('tipo', '') or '').strip(),
-                'DESCRIÇÃO': str(item.get('descricao', '') or '').strip(),
-                'LOCAL': str(item.get('endereco', '') or '').strip(),
-                'UN': str(item.get('un', '') or 'UN').strip(),
-                'DIMENSÃO': str(item.get('dimensao', '') or '').strip(),
-                'CLIENTE': str(item.get('cliente', '') or '').strip(),
-                'LOTE': str(detalhe.get('lote', '') or '').strip(),
-                'ITEM NF': str(detalhe.get('item_nf', '') or '').strip(),
-                'NF': str(detalhe.get('nf', '') or '').strip(),
-                'VALIDADE': validade_str,
-                'ESTAÇÃO': str(detalhe.get('estacao', '') or '').strip(),
-                'QTD ESTOQUE': round(float(detalhe.get('quantidade', 0)), 2),
-                'DATA ENTRADA': data_entrada_str
-            }
-            
-            for num_coluna, nome_coluna in enumerate(colunas_ordem, start=1):
-                worksheet.cell(row=num_linha, column=num_coluna, value=dados_linha.get(nome_coluna, '')).alignment = Alignment(horizontal='left', vertical='center')
-        
-        # Ajuste largura
-        for num_coluna, nome_coluna in enumerate(colunas_ordem, start=1):
-            letra = get_column_letter(num_coluna)
-            worksheet.column_dimensions[letra].width = 40 if nome_coluna == 'DESCRIÇÃO' else 20
-
-        output = io.BytesIO()
-        workbook.save(output)
-        output.seek(0)
-
-        response = make_response(output.read())
-        response.headers["Content-Disposition"] = f"attachment; filename=relatorio_estoque_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
-        response.headers["Content-Type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        return response
-
+        path, tamanho = exportar_estoque_xlsx()
     except Exception as e:
         flash(f'Erro ao gerar o relatório: {str(e)}', 'danger')
         return redirect(url_for('estoque'))
 
+    response = Response(stream_with_context(stream_arquivo(path)),
+                        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    response.headers["Content-Disposition"] = f"attachment; filename=relatorio_estoque_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
+    response.headers["Content-Length"] = str(tamanho)
+    return response
+
 @app.route('/estoque/apagar-tudo')
 @admin_required
 @login_required
@@ -1625,6 +1106,10 @@ def limpar_estoque_completo():
         supabase.table('estoque_detalhe').delete().neq('id', 0).execute()
         # Apaga itens
         supabase.table('item_estoque').delete().neq('id', 0).execute()
+        dashboard_snapshot.invalidate()
+        busca_itens.invalidate()
+        busca_lotes.invalidate()
+        catalogo.invalidate('item_estoque')
         
         flash('TODO O ESTOQUE FOI APAGADO COM SUCESSO!', 'success')
     except Exception as e:
@@ -1695,6 +1180,7 @@ def relatorio_movimentacoes_consumivel_page():
     return jsonify({'movimentacoes': result})
 
 @app.route('/consumivel/importar', methods=['GET', 'POST'])
+@query_budget(10)
 @admin_required
 @login_required
 def importar_consumivel():
@@ -1713,113 +1199,17 @@ def importar_consumivel():
             try:
                 df = pd.read_excel(file)
                 
-                # ...normalization logic same as before...
-                def normalize_text(s):
-                    if not isinstance(s, str):
-                         s = '' if pd.isna(s) else str(s)
-                    s = s.strip()
-                    s = s.replace('º', '').replace('°', '').replace('ª', '')
-                    s = unicodedata.normalize('NFKD', s)
-                    s = ''.join(ch for ch in s if not unicodedata.combining(ch))
-                    s = s.upper()
-                    s = ' '.join(s.split())
-                    return s
-
-                orig_cols = [str(c) for c in df.columns]
-                norm_map = {normalize_text(c): c for c in orig_cols}
-
-                def find_col_by_patterns(*patterns):
-                    for ncol, orig in norm_map.items():
-                        for pat in patterns:
-                            if pat in ncol:
-                                return orig
-                    return None
-
-                col_n_produto = find_col_by_patterns('N PRODUTO', 'NPRODUTO', 'NUM PRODUTO', 'NUMERO PRODUTO')
-                col_codigo = find_col_by_patterns('CODIGO PRODUTO', 'CODIGOPRODUTO', 'CODIGO')
-                col_descricao = find_col_by_patterns('DESCRICAO DO PRODUTO', 'DESCRICAODOPRODUTO', 'DESCRICAO')
-                col_unidade = find_col_by_patterns('UNIDADE MEDIDA', 'UNIDADE')
-
-                if not all([col_n_produto, col_codigo, col_descricao, col_unidade]):
+                colunas = resolver_colunas_consumivel(df.columns)
+                if not all(colunas[campo] for campo in CONSUMIVEL_REQUIRED):
+                    orig_cols = [str(c) for c in df.columns]
                     flash(f'❌ Colunas obrigatórias faltando!\nColunas originais encontradas: {", ".join(orig_cols)}', 'danger')
                     return redirect(request.url)
                 
-                sucesso = 0
-                erro = 0
-                
-                for idx, row in df.iterrows():
-                    try:
-                        n_produto = str(row.get(col_n_produto, '')).strip()
-                        codigo = str(row.get(col_codigo, '')).strip()
-                        desc = str(row.get(col_descricao, '')).strip()
-                        unidade = str(row.get(col_unidade, '')).strip() or 'UN'
-                        
-                        if not n_produto or not codigo or not desc:
-                            erro += 1
-                            continue
-                        
-                        col_status_estoque = find_col_by_patterns('STATUS ESTOQUE', 'STATUSESTOQUE', 'STATUS')
-                        col_status_consumo = find_col_by_patterns('STATUS CONSUMO', 'STATUSCONSUMO')
-                        col_categoria = find_col_by_patterns('CATEGORIA')
-                        col_fornecedor = find_col_by_patterns('FORNECEDOR', 'FORNECEDOR 2', 'FORNECEDOR2')
-                        col_fornecedor2 = find_col_by_patterns('FORNECEDOR 2', 'FORNECEDOR2')
-                        col_valor = find_col_by_patterns('VALOR UNITARIO', 'VALORUNITARIO', 'VALOR')
-                        col_lead = find_col_by_patterns('LEAD TIME', 'LEADTIME', 'TEMPO REPOSICAO', 'DIAS')
-                        col_seg = find_col_by_patterns('ESTOQUE DE SEGURANCA', 'ESTOQUESEGURANCA', 'PERCENTUAL ESTOQUE')
-                        col_minimo = find_col_by_patterns('ESTOQUE MINIMO', 'ESTOQUE MINIMO POR CAIXA', 'ESTOQUEMINIMO')
-                        col_atual = find_col_by_patterns('ESTOQUE ATUAL', 'ESTOQUEATUAL', 'QUANTIDADE ATUAL')
-
-                        status_estoque = str(row.get(col_status_estoque, 'Ativo')).strip() or 'Ativo'
-                        status_consumo = str(row.get(col_status_consumo, 'Consumível')).strip() or 'Consumível'
-                        categoria = str(row.get(col_categoria, '')).strip()
-                        fornecedor = str(row.get(col_fornecedor, '')).strip()
-                        fornecedor2 = str(row.get(col_fornecedor2, '')).strip()
-                        
-                        # Helper for safe float/int conversion
-                        def safe_float(v, default=0.0):
-                            try: return float(v) if pd.notna(v) else default
-                            except: return default
-                        def safe_int(v, default=7):
-                            try: return int(v) if pd.notna(v) else default
-                            except: return default
-
-                        valor = safe_float(row.get(col_valor))
-                        lead = safe_int(row.get(col_lead))
-                        seg = safe_float(row.get(col_seg))
-                        minimo = safe_float(row.get(col_minimo))
-                        atual = safe_float(row.get(col_atual))
-                        
-                        # Check exist
-                        exist = supabase.table('consumivel_estoque').select('id').eq('codigo_produto', codigo).execute()
-                        
-                        data_payload = {
-                            'n_produto': n_produto,
-                            'codigo_produto': codigo,
-                            'descricao': desc,
-                            'unidade_medida': unidade,
-                            'status_estoque': status_estoque,
-                            'status_consumo': status_consumo,
-                            'categoria': categoria,
-                            'fornecedor': fornecedor,
-                            'fornecedor2': fornecedor2,
-                            'valor_unitario': valor,
-                            'lead_time': lead,
-                            'estoque_seguranca': seg,
-                            'estoque_minimo': minimo,
-                            'quantidade_atual': atual
-                        }
-                        
-                        if exist.data:
-                             supabase.table('consumivel_estoque').update(data_payload).eq('id', exist.data[0]['id']).execute()
-                        else:
-                             supabase.table('consumivel_estoque').insert(data_payload).execute()
-
-                        sucesso += 1
-                    
-                    except Exception as e:
-                        erro += 1
-                        print(f"Erro linha {idx + 2}: {e}")
+                resultado = importar_planilha_consumiveis(df, colunas)
+                sucesso = resultado['sucesso']
+                erro = resultado['erros']
                 
+                dashboard_snapshot.invalidate()
                 flash(f'✅ {sucesso} consumível(is) importado(s)!', 'success')
                 if erro > 0:
                     flash(f'⚠️ {erro} linha(s) ignorada(s).', 'warning')
@@ -1850,13 +1240,6 @@ def movimentacao_consumivel():
             flash('Consumível, tipo e quantidade são obrigatórios.', 'danger')
             return redirect(url_for('movimentacao_consumivel'))
 
-        # Fetch cons
-        res = supabase.table('consumivel_estoque').select('*').eq('id', consumivel_id).execute()
-        consumivel = res.data[0] if res.data else None
-        
-        if not consumivel:
-             abort(404)
-
         try:
             quantidade = float(quantidade)
             if quantidade <= 0:
@@ -1865,43 +1248,29 @@ def movimentacao_consumivel():
         except (ValueError, TypeError):
             flash('A quantidade deve ser um número válido.', 'danger')
             return redirect(url_for('movimentacao_consumivel'))
-            
-        current_qtd = float(consumivel['quantidade_atual'] or 0)
 
-        # --- LÓGICA DE ENTRADA ---
-        if tipo == 'ENTRADA':
-            new_qtd = current_qtd + quantidade
-            supabase.table('consumivel_estoque').update({'quantidade_atual': new_qtd}).eq('id', consumivel_id).execute()
-            
-            mov_data = {
-                'consumivel_id': consumivel_id,
-                'tipo': 'ENTRADA',
-                'quantidade': quantidade,
-                'usuario': current_user.username,
-                'setor_destino': setor_destino or 'Almoxarifado',
-                'observacao': observacao
-            }
-            supabase.table('movimentacao_consumivel').insert(mov_data).execute()
-            flash('Entrada de consumível registrada com sucesso!', 'success')
+        if tipo not in ('ENTRADA', 'SAIDA'):
+            return redirect(url_for('movimentacao_consumivel'))
 
-        # --- LÓGICA DE SAÍDA ---
-        elif tipo == 'SAIDA':
-            if current_qtd < quantidade:
-                flash(f'Quantidade insuficiente. Disponível: {current_qtd}', 'danger')
-                return redirect(url_for('movimentacao_consumivel'))
+        # Saldo conferido/atualizado e lançamento gravado em uma única operação atômica
+        try:
+            registrar_movimentacao_consumivel(
+                consumivel_id,
+                tipo,
+                quantidade,
+                usuario=current_user.username,
+                setor_destino=(setor_destino or 'Almoxarifado') if tipo == 'ENTRADA' else setor_destino,
+                observacao=observacao
+            )
+        except MovimentacaoError as e:
+            if e.codigo == 'NAO_ENCONTRADO':
+                abort(404)
+            flash(e.mensagem, 'danger')
+            return redirect(url_for('movimentacao_consumivel'))
 
-            new_qtd = current_qtd - quantidade
-            supabase.table('consumivel_estoque').update({'quantidade_atual': new_qtd}).eq('id', consumivel_id).execute()
-            
-            mov_data = {
-                'consumivel_id': consumivel_id,
-                'tipo': 'SAIDA',
-                'quantidade': quantidade,
-                'usuario': current_user.username,
-                'setor_destino': setor_destino,
-                'observacao': observacao
-            }
-            supabase.table('movimentacao_consumivel').insert(mov_data).execute()
+        if tipo == 'ENTRADA':
+            flash('Entrada de consumível registrada com sucesso!', 'success')
+        else:
             flash('Saída de consumível registrada com sucesso!', 'success')
 
         return redirect(url_for('movimentacao_consumivel'))
@@ -1943,6 +1312,8 @@ def editar_consumivel(consumivel_id):
             }
 
             supabase.table('consumivel_estoque').update(update_data).eq('id', consumivel_id).execute()
+            dashboard_snapshot.apply_consumivel(dict(update_data, id=consumivel_id))
+            catalogo.apply_row('consumivel_estoque', dict(update_data, id=consumivel_id))
             flash('Consumível atualizado com sucesso!', 'success')
             return redirect(url_for('consumivel'))
 
@@ -1958,8 +1329,8 @@ def excluir_consumivel(consumivel_id):
     """Exclui um consumível do estoque."""
     try:
         # Remove também as movimentações relacionadas
-        supabase.table('movimentacao_consumivel').delete().eq('consumivel_id', consumivel_id).execute()
-        supabase.table('consumivel_estoque').delete().eq('id', consumivel_id).execute()
+        delete_consumivel(consumivel_id)
+        dashboard_snapshot.remove_consumivel(consumivel_id)
         flash('Consumível excluído com sucesso!', 'success')
 
     except Exception as e:
@@ -1977,8 +1348,8 @@ def historico_consumivel(consumivel_id):
         abort(404)
     consumivel = ModelWrapper(res_cons.data[0])
     
-    res_movs = supabase.table('movimentacao_consumivel').select('*').eq('consumivel_id', consumivel_id).order('data_movimentacao', desc=True).execute()
-    movimentacoes = [ModelWrapper(m) for m in (res_movs.data or [])]
+    movs_data = select_all('movimentacao_consumivel', filters={'consumivel_id': consumivel_id}, order_by='-data_movimentacao')
+    movimentacoes = [ModelWrapper(m) for m in movs_data]
     
     return render_template('historico_consumivel.html', consumivel=consumivel, movimentacoes=movimentacoes)
 
@@ -2033,8 +1404,7 @@ def api_relatorio_movimentacoes_consumivel():
 @login_required
 def exportar_consumivel():
     """Exporta todos os consumíveis para Excel."""
-    res = supabase.table('consumivel_estoque').select('*').order('codigo_produto').execute()
-    consumiveis = res.data if res.data else []
+    consumiveis = select_all('consumivel_estoque', order_by='codigo_produto')
     
     dados = []
     for consumivel in consumiveis:
@@ -2150,6 +1520,7 @@ def editar_usuario(user_id):
             flash('Senha atualizada com sucesso.', 'info')
 
         update_user(user_id, update_data)
+        sessao_usuario.invalidate(user_id)
         
         # Helper returns void or data? Helpers usually don't return updated obj directly unless configured.
         # But we can assume success if no exception.
@@ -2174,9 +1545,24 @@ def excluir_usuario(user_id):
         abort(404)
         
     delete_user(user_id)
+    sessao_usuario.invalidate(user_id)
     flash(f'Usuário "{user_data.get("username")}" excluído com sucesso.', 'success')
     return redirect(url_for('gerenciar_usuarios'))
 
+@app.route('/admin/perf')
+@login_required
+@admin_required
+def admin_perf():
+    """Latência (p50/p95) e consultas ao Supabase por rota, desde o início do processo."""
+    if request.args.get('limpar'):
+        desempenho.reset_stats()
+        return redirect(url_for('admin_perf'))
+    return render_template('admin_perf.html',
+                           rotas=desempenho.route_stats(),
+                           circuito=circuit_breaker.status(),
+                           catalogo=catalogo.stats(),
+                           usuarios=sessao_usuario.stats())
+
 # --- ROTAS DE AUTENTICAÇÃO ---
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -2190,6 +1576,7 @@ def login():
         if user_data and bcrypt.check_password_hash(user_data.get('password_hash'), request.form.get('password')):
             user_obj = User(user_data)
             login_user(user_obj)
+            sessao_usuario.remember(user_data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
         else:
@@ -2200,6 +1587,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    sessao_usuario.forget()
     flash('Você saiu do sistema com sucesso.', 'info')
     return redirect(url_for('login'))
 
@@ -2236,9 +1624,11 @@ def promote_to_admin():
     """
     if current_user.role != 'admin':
         update_user(int(current_user.id), {'role': 'admin'})
+        sessao_usuario.invalidate(current_user.id)
         # current_user é proxy local, não atualiza automaticamente, mas o DB atualizou
         flash('Parabéns! Sua conta foi promovida para Administrador (necessário relogar).', 'success')
         logout_user() # Força relogin para atualizar role na sessão
+        sessao_usuario.forget()
         return redirect(url_for('login'))
     else:
         flash('Sua conta já é de um Administrador.', 'info')
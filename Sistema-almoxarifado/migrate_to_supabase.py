@@ -9,6 +9,7 @@ import sqlite3
 import os
 from datetime import datetime
 from supabase import create_client, Client
+from supabase_client import insert_many
 
 # Configurações do Supabase
 SUPABASE_URL = "https://twydlslxhtoqsqnixcmz.supabase.co"
@@ -26,30 +27,35 @@ def get_supabase_client():
     
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
+def insert_rows(supabase: Client, table: str, rows, label: str, describe):
+    """
+    Insere `rows` em blocos; blocos com erro são reenviados linha a linha,
+    de modo que apenas os registros inválidos fiquem de fora.
+    """
+    result = insert_many(table, rows, retry_rows=True, client=supabase)
+    for erro in result['errors']:
+        for pos in range(erro['start'], erro['end']):
+            print(f"   ⚠️  Erro ao migrar {describe(rows[pos])}: {erro['error']}")
+    print(f"✅ {result['count']}/{len(rows)} {label} migrados")
+    return result['count']
+
 def migrate_users(sqlite_conn, supabase: Client):
     """Migra tabela user."""
     print("\n📤 Migrando usuários...")
     cursor = sqlite_conn.cursor()
     cursor.execute("SELECT id, username, password_hash, role FROM user")
-    users = cursor.fetchall()
-    
-    migrated = 0
-    for user_id, username, password_hash, role in users:
-        try:
-            data = {
-                "id": user_id,
-                "username": username,
-                "password_hash": password_hash,
-                "role": role
-            }
-            supabase.table("user").insert(data).execute()
-            migrated += 1
-            print(f"   ✅ {username} ({role})")
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar {username}: {e}")
+    users = [
+        {
+            "id": user_id,
+            "username": username,
+            "password_hash": password_hash,
+            "role": role
+        }
+        for user_id, username, password_hash, role in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(users)} usuários migrados")
-    return migrated
+    return insert_rows(supabase, "user", users, "usuários",
+                       lambda u: u["username"])
 
 def migrate_items_estoque(sqlite_conn, supabase: Client):
     """Migra tabela item_estoque."""
@@ -61,36 +67,28 @@ def migrate_items_estoque(sqlite_conn, supabase: Client):
                tempo_reposicao, data_cadastro
         FROM item_estoque
     """)
-    items = cursor.fetchall()
-    
-    migrated = 0
-    for row in items:
-        try:
-            data = {
-                "id": row[0],
-                "codigo": row[1],
-                "endereco": row[2],
-                "codigo_opcional": row[3],
-                "tipo": row[4],
-                "descricao": row[5],
-                "un": row[6],
-                "dimensao": row[7],
-                "cliente": row[8],
-                "qtd_estoque": row[9] or 0,
-                "estoque_minimo": row[10] or 5,
-                "estoque_ideal_compra": row[11],
-                "tempo_reposicao": row[12] or 7,
-                "data_cadastro": row[13]
-            }
-            supabase.table("item_estoque").insert(data).execute()
-            migrated += 1
-            if migrated % 50 == 0:
-                print(f"   ✅ {migrated}/{len(items)} itens migrados...")
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar item {row[1]}: {e}")
+    items = [
+        {
+            "id": row[0],
+            "codigo": row[1],
+            "endereco": row[2],
+            "codigo_opcional": row[3],
+            "tipo": row[4],
+            "descricao": row[5],
+            "un": row[6],
+            "dimensao": row[7],
+            "cliente": row[8],
+            "qtd_estoque": row[9] or 0,
+            "estoque_minimo": row[10] or 5,
+            "estoque_ideal_compra": row[11],
+            "tempo_reposicao": row[12] or 7,
+            "data_cadastro": row[13]
+        }
+        for row in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(items)} itens migrados")
-    return migrated
+    return insert_rows(supabase, "item_estoque", items, "itens",
+                       lambda i: f"item {i['codigo']}")
 
 def migrate_estoque_detalhe(sqlite_conn, supabase: Client):
     """Migra tabela estoque_detalhe."""
@@ -102,35 +100,27 @@ def migrate_estoque_detalhe(sqlite_conn, supabase: Client):
                data_etiqueta, usuario_etiqueta
         FROM estoque_detalhe
     """)
-    detalhes = cursor.fetchall()
-    
-    migrated = 0
-    for row in detalhes:
-        try:
-            data = {
-                "id": row[0],
-                "item_estoque_id": row[1],
-                "lote": row[2],
-                "item_nf": row[3],
-                "nf": row[4],
-                "validade": row[5],
-                "estacao": row[6],
-                "status_validade": row[7],
-                "quantidade": row[8] or 0,
-                "data_entrada": row[9],
-                "status_etiqueta": row[10] or 'PENDENTE',
-                "data_etiqueta": row[11],
-                "usuario_etiqueta": row[12]
-            }
-            supabase.table("estoque_detalhe").insert(data).execute()
-            migrated += 1
-            if migrated % 100 == 0:
-                print(f"   ✅ {migrated}/{len(detalhes)} lotes migrados...")
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar lote {row[2]}: {e}")
+    detalhes = [
+        {
+            "id": row[0],
+            "item_estoque_id": row[1],
+            "lote": row[2],
+            "item_nf": row[3],
+            "nf": row[4],
+            "validade": row[5],
+            "estacao": row[6],
+            "status_validade": row[7],
+            "quantidade": row[8] or 0,
+            "data_entrada": row[9],
+            "status_etiqueta": row[10] or 'PENDENTE',
+            "data_etiqueta": row[11],
+            "usuario_etiqueta": row[12]
+        }
+        for row in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(detalhes)} lotes migrados")
-    return migrated
+    return insert_rows(supabase, "estoque_detalhe", detalhes, "lotes",
+                       lambda d: f"lote {d['lote']}")
 
 def migrate_movimentacoes(sqlite_conn, supabase: Client):
     """Migra tabela movimentacao."""
@@ -141,48 +131,25 @@ def migrate_movimentacoes(sqlite_conn, supabase: Client):
                usuario, etapa, lote, item_nf, nf
         FROM movimentacao
     """)
-    movs = cursor.fetchall()
-    
-    migrated = 0
-    batch = []
-    batch_size = 100
-    
-    for row in movs:
-        try:
-            data = {
-                "id": row[0],
-                "item_id": row[1],
-                "tipo": row[2],
-                "quantidade": row[3],
-                "data_movimentacao": row[4],
-                "observacao": row[5],
-                "usuario": row[6],
-                "etapa": row[7],
-                "lote": row[8],
-                "item_nf": row[9],
-                "nf": row[10]
-            }
-            batch.append(data)
-            
-            # Inserir em lotes para performance
-            if len(batch) >= batch_size:
-                supabase.table("movimentacao").insert(batch).execute()
-                migrated += len(batch)
-                print(f"   ✅ {migrated}/{len(movs)} movimentações migradas...")
-                batch = []
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar movimentação: {e}")
-    
-    # Inserir lote final
-    if batch:
-        try:
-            supabase.table("movimentacao").insert(batch).execute()
-            migrated += len(batch)
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar lote final: {e}")
+    movs = [
+        {
+            "id": row[0],
+            "item_id": row[1],
+            "tipo": row[2],
+            "quantidade": row[3],
+            "data_movimentacao": row[4],
+            "observacao": row[5],
+            "usuario": row[6],
+            "etapa": row[7],
+            "lote": row[8],
+            "item_nf": row[9],
+            "nf": row[10]
+        }
+        for row in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(movs)} movimentações migradas")
-    return migrated
+    return insert_rows(supabase, "movimentacao", movs, "movimentações",
+                       lambda m: f"movimentação {m['id']}")
 
 def migrate_consumiveis(sqlite_conn, supabase: Client):
     """Migra tabela consumivel_estoque."""
@@ -195,39 +162,31 @@ def migrate_consumiveis(sqlite_conn, supabase: Client):
                quantidade_atual, data_cadastro, data_atualizacao
         FROM consumivel_estoque
     """)
-    consumiveis = cursor.fetchall()
-    
-    migrated = 0
-    for row in consumiveis:
-        try:
-            data = {
-                "id": row[0],
-                "n_produto": row[1],
-                "status_estoque": row[2],
-                "status_consumo": row[3],
-                "codigo_produto": row[4],
-                "descricao": row[5],
-                "unidade_medida": row[6],
-                "categoria": row[7],
-                "fornecedor": row[8],
-                "fornecedor2": row[9],
-                "valor_unitario": row[10] or 0,
-                "lead_time": row[11],
-                "estoque_seguranca": row[12] or 0,
-                "estoque_minimo": row[13] or 0,
-                "quantidade_atual": row[14] or 0,
-                "data_cadastro": row[15],
-                "data_atualizacao": row[16]
-            }
-            supabase.table("consumivel_estoque").insert(data).execute()
-            migrated += 1
-            if migrated % 50 == 0:
-                print(f"   ✅ {migrated}/{len(consumiveis)} consumíveis migrados...")
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar consumível {row[4]}: {e}")
+    consumiveis = [
+        {
+            "id": row[0],
+            "n_produto": row[1],
+            "status_estoque": row[2],
+            "status_consumo": row[3],
+            "codigo_produto": row[4],
+            "descricao": row[5],
+            "unidade_medida": row[6],
+            "categoria": row[7],
+            "fornecedor": row[8],
+            "fornecedor2": row[9],
+            "valor_unitario": row[10] or 0,
+            "lead_time": row[11],
+            "estoque_seguranca": row[12] or 0,
+            "estoque_minimo": row[13] or 0,
+            "quantidade_atual": row[14] or 0,
+            "data_cadastro": row[15],
+            "data_atualizacao": row[16]
+        }
+        for row in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(consumiveis)} consumíveis migrados")
-    return migrated
+    return insert_rows(supabase, "consumivel_estoque", consumiveis, "consumíveis",
+                       lambda c: f"consumível {c['codigo_produto']}")
 
 def migrate_movimentacoes_consumivel(sqlite_conn, supabase: Client):
     """Migra tabela movimentacao_consumivel."""
@@ -238,43 +197,22 @@ def migrate_movimentacoes_consumivel(sqlite_conn, supabase: Client):
                observacao, usuario, setor_destino
         FROM movimentacao_consumivel
     """)
-    movs = cursor.fetchall()
-    
-    migrated = 0
-    batch = []
-    batch_size = 100
-    
-    for row in movs:
-        try:
-            data = {
-                "id": row[0],
-                "consumivel_id": row[1],
-                "tipo": row[2],
-                "quantidade": row[3],
-                "data_movimentacao": row[4],
-                "observacao": row[5],
-                "usuario": row[6],
-                "setor_destino": row[7]
-            }
-            batch.append(data)
-            
-            if len(batch) >= batch_size:
-                supabase.table("movimentacao_consumivel").insert(batch).execute()
-                migrated += len(batch)
-                print(f"   ✅ {migrated}/{len(movs)} movimentações migradas...")
-                batch = []
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar movimentação: {e}")
-    
-    if batch:
-        try:
-            supabase.table("movimentacao_consumivel").insert(batch).execute()
-            migrated += len(batch)
-        except Exception as e:
-            print(f"   ⚠️  Erro ao migrar lote final: {e}")
+    movs = [
+        {
+            "id": row[0],
+            "consumivel_id": row[1],
+            "tipo": row[2],
+            "quantidade": row[3],
+            "data_movimentacao": row[4],
+            "observacao": row[5],
+            "usuario": row[6],
+            "setor_destino": row[7]
+        }
+        for row in cursor.fetchall()
+    ]
     
-    print(f"✅ {migrated}/{len(movs)} movimentações de consumíveis migradas")
-    return migrated
+    return insert_rows(supabase, "movimentacao_consumivel", movs, "movimentações de consumíveis",
+                       lambda m: f"movimentação {m['id']}")
 
 def verify_migration(sqlite_conn, supabase: Client):
     """Verifica se a migração foi bem-sucedida."""
@@ -2,6 +2,7 @@
 
 from flask_login import UserMixin
 from datetime import datetime
+from supabase_client import batch_loader
 
 # db = SQLAlchemy() - Removido
 
@@ -16,6 +17,9 @@ class ModelWrapper:
         
         # Define atributos dinamicamente
         for key, value in self._data.items():
+            # Relações aninhadas (ex.: 'item_estoque') são expostas por properties da subclasse
+            if isinstance(getattr(type(self), key, None), property):
+                continue
             if key in date_fields and isinstance(value, str):
                 try:
                     # Supabase ISO format usually: '2025-01-30T10:00:00+00:00' or '2025-01-30'
@@ -38,6 +42,25 @@ class ModelWrapper:
     def get(self, key, default=None):
         return self._data.get(key, default)
 
+    def _relacao(self, chave, tabela, fk):
+        """
+        Relação aninhada vinda do Supabase (ex.: select('*, item_estoque(*)')); se a consulta
+        não trouxe o embed, carrega pela chave estrangeira com o BatchLoader da requisição.
+        Todos os objetos de uma listagem anunciam sua FK na construção (_anunciar_relacao),
+        então o primeiro acesso no template resolve a página inteira com uma consulta IN.
+        """
+        if chave in self._data:
+            return self._data[chave]
+        loader = batch_loader(tabela)
+        self._data[chave] = loader.load(self.get(fk)) if loader else None
+        return self._data[chave]
+
+    def _anunciar_relacao(self, chave, tabela, fk):
+        if chave not in self._data and self.get(fk) is not None:
+            loader = batch_loader(tabela)
+            if loader:
+                loader.enqueue(self.get(fk))
+
 class User(UserMixin, ModelWrapper):
     """Modelo para os usuários do sistema."""
     
@@ -62,18 +85,26 @@ class ItemEstoque(ModelWrapper):
 
 class EstoqueDetalhe(ModelWrapper):
     """Modelo que representa um detalhe de estoque."""
+    def __init__(self, data=None, **kwargs):
+        super().__init__(data, **kwargs)
+        self._anunciar_relacao('item_estoque', 'item_estoque', 'item_estoque_id')
+
     @property
     def item_estoque(self):
         # Supabase retorna 'item_estoque' como dict aninhado
-        data = self.get('item_estoque')
+        data = self._relacao('item_estoque', 'item_estoque', 'item_estoque_id')
         return ItemEstoque(data) if data else None
 
 class Movimentacao(ModelWrapper):
     """Modelo que representa uma movimentação de estoque."""
+    def __init__(self, data=None, **kwargs):
+        super().__init__(data, **kwargs)
+        self._anunciar_relacao('item_estoque', 'item_estoque', 'item_id')
+
     @property
     def item(self):
         # Mapeia 'item' para 'item_estoque' vindo do Supabase
-        data = self.get('item_estoque')
+        data = self._relacao('item_estoque', 'item_estoque', 'item_id')
         return ItemEstoque(data) if data else None
 
 class ConsumivelEstoque(ModelWrapper):
@@ -82,11 +113,15 @@ class ConsumivelEstoque(ModelWrapper):
 
 class MovimentacaoConsumivel(ModelWrapper):
     """Modelo que representa uma movimentação de consumível."""
+    def __init__(self, data=None, **kwargs):
+        super().__init__(data, **kwargs)
+        self._anunciar_relacao('consumivel_estoque', 'consumivel_estoque', 'consumivel_id')
+
     @property
     def consumivel(self):
         # Mapeia 'consumivel' para 'consumivel_estoque' (suposição, validar se necessário)
         # Se a query for select('*, consumivel_estoque(*)')
-        data = self.get('consumivel_estoque') # ou 'consumivel' dependendo do nome da tabela
+        data = self._relacao('consumivel_estoque', 'consumivel_estoque', 'consumivel_id')
         return ConsumivelEstoque(data) if data else None
 
 class Pagination:
@@ -101,8 +136,33 @@ class Pagination:
         self.has_next = page < self.pages
         self.prev_num = page - 1
         self.next_num = page + 1
+        self.cursor_mode = False
+        self.next_cursor = self.prev_cursor = None
+        self.total_estimado = False
+
+    @classmethod
+    def from_cursor(cls, items, page, per_page, total, next_cursor, prev_cursor, total_estimado=True):
+        """
+        Modo cursor (keyset): só há anterior/próxima (next_cursor/prev_cursor); `page` é
+        apenas o número exibido e `total`/`pages` podem ser estimativas ou None.
+        """
+        pagination = cls(items, page, per_page, total or 0)
+        pagination.cursor_mode = True
+        pagination.next_cursor = next_cursor
+        pagination.prev_cursor = prev_cursor
+        pagination.has_next = next_cursor is not None
+        pagination.has_prev = prev_cursor is not None
+        pagination.total = total
+        pagination.total_estimado = total_estimado
+        # A estimativa nunca contradiz o que já se sabe pela navegação
+        pagination.pages = max(pagination.pages, page + (1 if pagination.has_next else 0))
+        return pagination
     
     def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
+        if self.cursor_mode:
+            # Sem offset não dá para saltar para uma página qualquer
+            yield self.page
+            return
         last = 0
         for num in range(1, self.pages + 1):
             if num <= left_edge or \
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Movimentação Diária - Totais por (item, dia, tipo) para gráficos e previsões
+O gráfico de 15 dias do dashboard, o histórico do item e as previsões de consumo
+leem a tabela movimentacao_diaria (soma das quantidades e número de movimentações
+por item, dia e tipo) em vez do livro de movimentações: no máximo itens × dias × tipos
+linhas já agrupadas, sem converter data a data em Python.
+
+A tabela é mantida no banco por trigger em toda inclusão, exclusão ou alteração de
+movimentação (ver sql/movimentacao_diaria.sql); nada na aplicação precisa atualizá-la.
+Sem a tabela instalada, carregar() agrupa o próprio livro (uma consulta e um groupby
+do pandas) e avisa uma vez.
+
+Carga inicial / reconstrução (uma instrução agrupada no banco):
+    python movimentacao_diaria.py --reconstruir
+Conferência com o livro:
+    python movimentacao_diaria.py --verificar --dias 90
+"""
+
+import argparse
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from supabase_client import (
+    supabase, select_all, safe_execute, capture_failures, record_failure, SupabaseQueryError
+)
+
+TABELA = 'movimentacao_diaria'
+COLUNAS = 'item_id, dia, tipo, quantidade, movimentacoes'
+# A tabela não tem 'id': a paginação usa a chave inteira como ordem estável
+ORDEM = 'dia,item_id,tipo'
+LIVRO_COLUNAS = 'id, item_id, tipo, quantidade, data_movimentacao'
+# Tempo máximo (segundos) da reconstrução, que percorre o livro inteiro
+RECONSTRUIR_TIMEOUT = 120
+
+# Tabela não instalada no banco (42P01 / PGRST205): dali em diante agrupa-se o livro
+_rollup_ausente = False
+
+
+def agregar(movimentacoes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Totais diários (mesmas colunas da tabela) a partir de movimentações brutas."""
+    df = pd.DataFrame(movimentacoes, columns=['item_id', 'tipo', 'quantidade', 'data_movimentacao'])
+    df = df.dropna(subset=['item_id', 'data_movimentacao'])
+    if df.empty:
+        return []
+    df = pd.DataFrame({
+        'item_id': df['item_id'].astype('int64'),
+        'dia': df['data_movimentacao'].astype(str).str[:10],
+        'tipo': df['tipo'].fillna(''),
+        'quantidade': pd.to_numeric(df['quantidade'], errors='coerce').fillna(0.0),
+    })
+    totais = df.groupby(['dia', 'item_id', 'tipo'])['quantidade'].agg(quantidade='sum', movimentacoes='size')
+    return totais.reset_index()[['item_id', 'dia', 'tipo', 'quantidade', 'movimentacoes']].to_dict('records')
+
+
+def carregar(inicio: Optional[str] = None, item_id: Optional[int] = None,
+             tipo: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Totais diários desde `inicio` ('YYYY-MM-DD'), opcionalmente de um item e/ou tipo.
+
+    Returns:
+        Lista de {'item_id', 'dia', 'tipo', 'quantidade', 'movimentacoes'}, por dia
+
+    Raises:
+        SupabaseQueryError se a consulta falhar
+    """
+    global _rollup_ausente
+    filtros = {k: v for k, v in (('item_id', item_id), ('tipo', tipo)) if v is not None}
+
+    if not _rollup_ausente:
+        # Falhas capturadas à parte: tabela ausente não é falha para o dashboard
+        with capture_failures() as falhas:
+            try:
+                return select_all(TABELA, filters=filtros, columns=COLUNAS, order_by=ORDEM,
+                                  refine=(lambda q: q.gte('dia', inicio)) if inicio else None)
+            except SupabaseQueryError as e:
+                erro = e
+        if not any(codigo in str(erro) for codigo in ('42P01', 'PGRST205')):
+            for falha in falhas:
+                record_failure(falha['operation'], falha['error'], falha['error_kind'])
+            raise erro
+        print("⚠️ Tabela movimentacao_diaria não instalada (ver sql/movimentacao_diaria.sql); agrupando o livro em Python")
+        _rollup_ausente = True
+
+    return agregar(select_all('movimentacao', filters=filtros, columns=LIVRO_COLUNAS,
+                              refine=(lambda q: q.gte('data_movimentacao', inicio)) if inicio else None))
+
+
+def por_dia(linhas: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Entradas/saídas por dia ('YYYY-MM-DD') somando os itens (formato do gráfico)."""
+    dias: Dict[str, Dict[str, float]] = {}
+    for linha in linhas:
+        tipo = linha.get('tipo') or ''
+        bucket = dias.setdefault(str(linha['dia'])[:10], {'entradas': 0, 'saidas': 0})
+        if 'ENTRADA' in tipo:
+            bucket['entradas'] += linha.get('quantidade') or 0
+        elif 'SAIDA' in tipo:
+            bucket['saidas'] += linha.get('quantidade') or 0
+    return dias
+
+
+def reconstruir() -> Dict[str, Any]:
+    """Recalcula a tabela a partir do livro (função reconstruir_movimentacao_diaria)."""
+    global _rollup_ausente
+    if not supabase:
+        return {'success': False, 'linhas': None, 'error': 'Supabase não configurado'}
+    result = safe_execute(supabase.rpc('reconstruir_movimentacao_diaria', {}),
+                          operation="RECONSTRUIR movimentacao_diaria", timeout=RECONSTRUIR_TIMEOUT)
+    if result['success']:
+        _rollup_ausente = False
+    return {'success': result['success'], 'linhas': result['data'], 'error': result['error']}
+
+
+def verificar(dias: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Compara a tabela com o livro agrupado (últimos `dias` dias ou tudo).
+
+    Returns:
+        Chaves (item_id, dia, tipo) divergentes, com os valores dos dois lados
+    """
+    inicio = (date.today() - timedelta(days=dias)).isoformat() if dias else None
+    refine = (lambda q: q.gte('dia', inicio)) if inicio else None
+    tabela = {(l['item_id'], str(l['dia'])[:10], l['tipo']): l
+              for l in select_all(TABELA, columns=COLUNAS, order_by=ORDEM, refine=refine)}
+    refine = (lambda q: q.gte('data_movimentacao', inicio)) if inicio else None
+    livro = {(l['item_id'], l['dia'], l['tipo']): l
+             for l in agregar(select_all('movimentacao', columns=LIVRO_COLUNAS, refine=refine))}
+
+    divergentes = []
+    for chave in sorted(set(tabela) | set(livro), key=str):
+        a, b = tabela.get(chave, {}), livro.get(chave, {})
+        if (a.get('movimentacoes') != b.get('movimentacoes') or
+                abs(float(a.get('quantidade') or 0) - float(b.get('quantidade') or 0)) > 1e-6):
+            divergentes.append({'chave': chave, 'tabela': a or None, 'livro': b or None})
+    return divergentes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reconstruir', action='store_true', help='recalcula a tabela a partir do livro')
+    parser.add_argument('--verificar', action='store_true', help='compara a tabela com o livro')
+    parser.add_argument('--dias', type=int, default=None, help='período da verificação (padrão: tudo)')
+    args = parser.parse_args()
+    if not (args.reconstruir or args.verificar):
+        parser.error('informe --reconstruir e/ou --verificar')
+
+    if args.reconstruir:
+        resultado = reconstruir()
+        if not resultado['success']:
+            print(f"❌ Reconstrução falhou: {resultado['error']}")
+            raise SystemExit(1)
+        print(f"✅ movimentacao_diaria reconstruída: {resultado['linhas']} linhas")
+
+    if args.verificar:
+        divergentes = verificar(args.dias)
+        for d in divergentes[:20]:
+            print(f"   {d['chave']}: tabela={d['tabela']} livro={d['livro']}")
+        if divergentes:
+            print(f"❌ {len(divergentes)} totais diários divergem do livro")
+            raise SystemExit(1)
+        print("✅ movimentacao_diaria confere com o livro")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Movimentações - Operações de estoque atômicas (uma transação, uma ida ao banco)
+Cada operação (entrada, saída, ajuste de lote, estorno, exclusão de lote e
+movimentação de consumível) ajusta o lote, o total do item e grava o lançamento
+no histórico de uma só vez:
+- Supabase: funções registrar_movimentacao / registrar_movimentacao_consumivel
+  (ver sql/registrar_movimentacao.sql), chamadas via supabase.rpc; no Supabase
+  local (SUPABASE_LOCAL_DB, supabase_local.py) as mesmas funções são as _sqlite_*
+  deste módulo, em uma transação BEGIN IMMEDIATE;
+- Supabase sem as funções instaladas (ou MOVIMENTACAO_CAS=1): passos separados,
+  com as quantidades gravadas por compare-and-swap (supabase_client.update_cas),
+  de modo que operações simultâneas não sobrescrevem saldos umas das outras; se um
+  passo falha, os anteriores são desfeitos com o delta inverso (_Desfazer).
+ENTRADAs em quantidade (importação de planilha) usam registrar_movimentacoes: a mesma
+operação para um bloco inteiro, em uma chamada por bloco.
+Depois de confirmada a operação, os deltas do dashboard são aplicados aqui.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+import dashboard_snapshot
+import busca_lotes
+import catalogo
+from supabase_client import (
+    supabase, select_one, insert_one, delete_one, update_cas, ConcurrencyError,
+    invalidate_request_cache
+)
+
+# Força o caminho compare-and-swap mesmo com as funções SQL instaladas
+FORCAR_CAS: bool = os.getenv('MOVIMENTACAO_CAS', '').lower() in ('1', 'true', 'sim')
+# Conflitos tolerados ao desfazer um passo do caminho CAS (o delta inverso precisa entrar)
+DESFAZER_TENTATIVAS: int = int(os.getenv('MOVIMENTACAO_DESFAZER_TENTATIVAS', '50'))
+# ENTRADAs por chamada de registrar_movimentacoes (importação de planilha)
+LOTE_ENTRADAS: int = int(os.getenv('MOVIMENTACAO_LOTE_ENTRADAS', '500'))
+
+# Funções SQL ausentes no banco (PGRST202): dali em diante usa-se o caminho CAS
+_rpc_ausente = set()
+
+OPERACOES = ('ENTRADA', 'SAIDA', 'AJUSTE', 'ESTORNO', 'EXCLUIR_LOTE')
+CODIGOS_ERRO = ('NAO_ENCONTRADO', 'LOTE_INVALIDO', 'ESTOQUE_INSUFICIENTE', 'OPERACAO_INVALIDA')
+
+
+class MovimentacaoError(Exception):
+    """
+    Operação recusada. `codigo` é um de CODIGOS_ERRO, CONFLITO (estoque alterado por
+    outras operações durante todas as tentativas) ou ERRO_BANCO. Em todos os casos nada
+    fica gravado; a exceção é ERRO_BANCO com "não foi possível desfazer" (caminho CAS).
+    """
+
+    def __init__(self, codigo: str, mensagem: str):
+        super().__init__(mensagem)
+        self.codigo = codigo
+        self.mensagem = mensagem
+
+
+# ============================================================
+# API
+# ============================================================
+
+def registrar_movimentacao(operacao: str, **params) -> Dict[str, Any]:
+    """
+    Executa uma operação de estoque atomicamente.
+
+    Args:
+        operacao: ENTRADA | SAIDA | AJUSTE | ESTORNO | EXCLUIR_LOTE
+        **params: ver o cabeçalho de sql/registrar_movimentacao.sql
+
+    Returns:
+        dict com 'item', 'detalhe', 'movimentacao' (linhas após a operação),
+        'lote_encontrado' (ESTORNO) e 'movimentacoes_removidas' (EXCLUIR_LOTE)
+
+    Raises:
+        MovimentacaoError: item/lote inexistente, estoque insuficiente ou falha no banco
+    """
+    params = dict(params, operacao=operacao.upper())
+    resultado = _executar_rpc('registrar_movimentacao', params, _cas_movimentacao)
+    invalidate_request_cache('item_estoque', 'estoque_detalhe', 'movimentacao')
+    _aplicar_deltas(resultado)
+    return resultado
+
+
+def registrar_movimentacoes(entradas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Várias ENTRADAs com os mesmos incrementos de registrar_movimentacao, em uma
+    chamada por bloco de LOTE_ENTRADAS. Cada ENTRADA é atômica por si: uma recusada
+    não impede as demais.
+
+    Args:
+        entradas: parâmetros de ENTRADA (ver registrar_movimentacao)
+
+    Returns:
+        Lista alinhada com `entradas`: o resultado de cada uma (como em
+        registrar_movimentacao) ou {'erro': codigo, 'mensagem'} quando recusada
+    """
+    params = [dict(p, operacao='ENTRADA') for p in entradas]
+    resultados: List[Dict[str, Any]] = []
+    for inicio in range(0, len(params), LOTE_ENTRADAS):
+        bloco = params[inicio:inicio + LOTE_ENTRADAS]
+        try:
+            resultados += _executar_rpc('registrar_movimentacoes', bloco, _cas_movimentacoes)
+        except MovimentacaoError as e:
+            resultados += [{'erro': e.codigo, 'mensagem': e.mensagem}] * len(bloco)
+    invalidate_request_cache('item_estoque', 'estoque_detalhe', 'movimentacao')
+
+    aceitas = []
+    for i, resultado in enumerate(resultados):
+        if 'erro' in resultado:
+            if resultado['erro'] not in CODIGOS_ERRO:
+                resultados[i] = {'erro': 'ERRO_BANCO', 'mensagem': resultado.get('mensagem')}
+        else:
+            aceitas.append(resultado)
+    # Ordem de gravação (o banco processa por item e lote): o último saldo de cada item prevalece
+    for resultado in sorted(aceitas, key=lambda r: r['movimentacao']['id']):
+        _aplicar_deltas(resultado)
+    return resultados
+
+
+def registrar_movimentacao_consumivel(consumivel_id: Any, tipo: str, quantidade: float,
+                                      usuario: Optional[str] = None, setor_destino: Optional[str] = None,
+                                      observacao: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Entrada/saída de consumível atomicamente.
+
+    Returns:
+        dict com 'consumivel' e 'movimentacao' (linhas após a operação)
+
+    Raises:
+        MovimentacaoError
+    """
+    params = {
+        'consumivel_id': consumivel_id, 'tipo': tipo.upper(), 'quantidade': quantidade,
+        'usuario': usuario, 'setor_destino': setor_destino, 'observacao': observacao
+    }
+    resultado = _executar_rpc('registrar_movimentacao_consumivel', params, _cas_movimentacao_consumivel)
+    invalidate_request_cache('consumivel_estoque', 'movimentacao_consumivel')
+
+    dashboard_snapshot.apply_consumivel(resultado.get('consumivel'))
+    catalogo.apply_row('consumivel_estoque', resultado.get('consumivel'))
+    dashboard_snapshot.apply_movimentacao_consumivel(resultado.get('movimentacao'))
+    return resultado
+
+
+def _aplicar_deltas(resultado: Dict[str, Any]):
+    operacao = resultado['operacao']
+    dashboard_snapshot.apply_item(resultado.get('item'))
+    catalogo.apply_row('item_estoque', resultado.get('item'))
+
+    detalhe = resultado.get('detalhe')
+    if operacao == 'EXCLUIR_LOTE':
+        if detalhe:
+            dashboard_snapshot.remove_lote(detalhe['id'])
+            busca_lotes.remove_lote(detalhe['id'])
+        # As movimentações do lote saíram do histórico: totais diários precisam ser recalculados
+        dashboard_snapshot.invalidate()
+        return
+
+    dashboard_snapshot.apply_lote(detalhe)
+    busca_lotes.apply_lote(detalhe)
+    if operacao == 'ESTORNO':
+        dashboard_snapshot.revert_movimentacao(resultado.get('movimentacao'))
+    else:
+        dashboard_snapshot.apply_movimentacao(resultado.get('movimentacao'))
+
+
+# ============================================================
+# SUPABASE (RPC)
+# ============================================================
+
+def _executar_rpc(funcao: str, params: Dict[str, Any], alternativa) -> Dict[str, Any]:
+    """Chama a função SQL; se ela não estiver instalada no banco, usa `alternativa(params)` (caminho CAS)."""
+    if not supabase:
+        raise MovimentacaoError('ERRO_BANCO', 'Cliente Supabase não inicializado.')
+    if FORCAR_CAS or funcao in _rpc_ausente:
+        return _executar_cas(alternativa, params)
+    try:
+        response = supabase.rpc(funcao, {'p': params}).execute()
+    except APIError as e:
+        if e.message in CODIGOS_ERRO:
+            raise MovimentacaoError(e.message, e.details or e.message)
+        if e.code == 'PGRST202':
+            print(f"⚠️ Função {funcao} não instalada (ver sql/registrar_movimentacao.sql); usando compare-and-swap")
+            _rpc_ausente.add(funcao)
+            return _executar_cas(alternativa, params)
+        print(f"❌ Erro em {funcao}: {e.message}")
+        raise MovimentacaoError('ERRO_BANCO', e.message or str(e))
+    except Exception as e:
+        print(f"❌ Erro em {funcao}: {str(e)}")
+        raise MovimentacaoError('ERRO_BANCO', str(e))
+    return response.data
+
+
+# ============================================================
+# SQLITE LOCAL (mesma lógica da função SQL; supabase_local.py as chama
+# dentro de uma transação BEGIN IMMEDIATE)
+# ============================================================
+
+def _agora() -> str:
+    return str(datetime.now())
+
+
+def _linha(conn, tabela: str, row_id: Any) -> Optional[Dict[str, Any]]:
+    row = conn.execute(f'SELECT * FROM {tabela} WHERE id = ?', (row_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _atualizar(conn, tabela: str, row_id: Any, valores: Dict[str, Any]) -> Dict[str, Any]:
+    colunas = ', '.join(f'{c} = ?' for c in valores)
+    conn.execute(f'UPDATE {tabela} SET {colunas} WHERE id = ?', (*valores.values(), row_id))
+    return _linha(conn, tabela, row_id)
+
+
+def _inserir(conn, tabela: str, valores: Dict[str, Any]) -> Dict[str, Any]:
+    colunas = ', '.join(valores)
+    marcadores = ', '.join('?' for _ in valores)
+    cursor = conn.execute(f'INSERT INTO {tabela} ({colunas}) VALUES ({marcadores})', tuple(valores.values()))
+    return _linha(conn, tabela, cursor.lastrowid)
+
+
+def _num(valor: Any) -> float:
+    return float(valor or 0)
+
+
+def _sqlite_movimentacao(conn, p: Dict[str, Any]) -> Dict[str, Any]:
+    operacao = p['operacao']
+    if operacao not in OPERACOES:
+        raise MovimentacaoError('OPERACAO_INVALIDA', f'Operação desconhecida: {operacao}')
+
+    quantidade = _num(p.get('quantidade'))
+    item_id = p.get('item_id')
+    detalhe = mov = None
+    encontrado = False
+    removidas = 0
+
+    if operacao == 'ESTORNO':
+        mov = _linha(conn, 'movimentacao', p.get('movimentacao_id'))
+        if not mov:
+            raise MovimentacaoError('NAO_ENCONTRADO', 'Movimentação não encontrada.')
+        item_id = mov['item_id']
+        quantidade = _num(mov['quantidade'])
+
+    item = _linha(conn, 'item_estoque', item_id)
+    if not item:
+        raise MovimentacaoError('NAO_ENCONTRADO', 'Item não encontrado.')
+    qtd_item = _num(item['qtd_estoque'])
+
+    if operacao in ('SAIDA', 'AJUSTE', 'EXCLUIR_LOTE'):
+        detalhe = _linha(conn, 'estoque_detalhe', p.get('detalhe_id'))
+        if not detalhe or detalhe['item_estoque_id'] != item['id']:
+            raise MovimentacaoError('LOTE_INVALIDO', 'Lote/Item NF inválido para este item.')
+
+    if operacao == 'ENTRADA':
+        row = conn.execute(
+            'SELECT * FROM estoque_detalhe WHERE item_estoque_id = ? AND lote IS ? AND item_nf IS ? AND nf IS ? '
+            'ORDER BY id LIMIT 1', (item['id'], p.get('lote'), p.get('item_nf'), p.get('nf'))
+        ).fetchone()
+        if row:
+            detalhe = _atualizar(conn, 'estoque_detalhe', row['id'], {'quantidade': _num(row['quantidade']) + quantidade})
+        else:
+            estacao = p.get('estacao') or None
+            if not estacao:
+                ultimo = conn.execute(
+                    'SELECT estacao FROM estoque_detalhe WHERE item_estoque_id = ? '
+                    'ORDER BY data_entrada IS NULL, data_entrada DESC, id DESC LIMIT 1', (item['id'],)
+                ).fetchone()
+                estacao = (ultimo['estacao'] if ultimo else None) or None
+            detalhe = _inserir(conn, 'estoque_detalhe', {
+                'item_estoque_id': item['id'], 'lote': p.get('lote'), 'item_nf': p.get('item_nf'),
+                'nf': p.get('nf'), 'validade': p.get('validade') or None,
+                'estacao': estacao or 'Almoxarifado', 'quantidade': quantidade, 'data_entrada': _agora()
+            })
+        item = _atualizar(conn, 'item_estoque', item['id'], {'qtd_estoque': qtd_item + quantidade})
+        mov = _inserir(conn, 'movimentacao', {
+            'item_id': item['id'], 'tipo': 'ENTRADA', 'quantidade': quantidade,
+            'lote': p.get('lote'), 'item_nf': p.get('item_nf'), 'nf': p.get('nf'),
+            'usuario': p.get('usuario'), 'etapa': p.get('etapa'), 'observacao': p.get('observacao'),
+            'data_movimentacao': _agora()
+        })
+
+    elif operacao == 'SAIDA':
+        disponivel = _num(detalhe['quantidade'])
+        if disponivel < quantidade:
+            raise MovimentacaoError('ESTOQUE_INSUFICIENTE',
+                                    f'Quantidade insuficiente no lote selecionado. Disponível: {disponivel}')
+        detalhe = _atualizar(conn, 'estoque_detalhe', detalhe['id'], {'quantidade': disponivel - quantidade})
+        item = _atualizar(conn, 'item_estoque', item['id'], {'qtd_estoque': qtd_item - quantidade})
+        mov = _inserir(conn, 'movimentacao', {
+            'item_id': item['id'], 'tipo': 'SAIDA', 'quantidade': quantidade,
+            'lote': detalhe['lote'], 'item_nf': detalhe['item_nf'], 'nf': detalhe['nf'],
+            'usuario': p.get('usuario'), 'etapa': p.get('etapa'), 'observacao': p.get('observacao'),
+            'data_movimentacao': _agora()
+        })
+
+    elif operacao == 'AJUSTE':
+        anterior = _num(detalhe['quantidade'])
+        nova = float(p['nova_quantidade'])
+        diferenca = nova - anterior
+        detalhe = _atualizar(conn, 'estoque_detalhe', detalhe['id'], {
+            'lote': p.get('lote'), 'nf': p.get('nf'), 'item_nf': p.get('item_nf'),
+            'validade': p.get('validade') or None, 'estacao': p.get('estacao'), 'quantidade': nova
+        })
+        item = _atualizar(conn, 'item_estoque', item['id'], {
+            'endereco': p.get('endereco'), 'qtd_estoque': qtd_item + diferenca
+        })
+        if diferenca != 0:
+            mov = _inserir(conn, 'movimentacao', {
+                'item_id': item['id'], 'tipo': 'AJUSTE-ENTRADA' if diferenca > 0 else 'AJUSTE-SAIDA',
+                'quantidade': abs(diferenca), 'lote': p.get('lote'), 'item_nf': p.get('item_nf'),
+                'nf': p.get('nf'), 'usuario': p.get('usuario'), 'etapa': 'AJUSTE',
+                'observacao': f"Ajuste manual. Motivo: {p.get('motivo')}. Qtd anterior: {anterior}, Qtd nova: {nova}.",
+                'data_movimentacao': _agora()
+            })
+
+    elif operacao == 'ESTORNO':
+        row = conn.execute(
+            'SELECT * FROM estoque_detalhe WHERE item_estoque_id = ? AND lote IS ? AND nf IS ? ORDER BY id LIMIT 1',
+            (item['id'], mov['lote'], mov['nf'])
+        ).fetchone()
+        encontrado = row is not None
+        detalhe = dict(row) if row else None
+
+        if 'ENTRADA' in (mov['tipo'] or ''):
+            item = _atualizar(conn, 'item_estoque', item['id'], {'qtd_estoque': max(0, qtd_item - quantidade)})
+            if detalhe:
+                detalhe = _atualizar(conn, 'estoque_detalhe', detalhe['id'],
+                                     {'quantidade': max(0, _num(detalhe['quantidade']) - quantidade)})
+        elif 'SAIDA' in (mov['tipo'] or ''):
+            item = _atualizar(conn, 'item_estoque', item['id'], {'qtd_estoque': qtd_item + quantidade})
+            if detalhe:
+                detalhe = _atualizar(conn, 'estoque_detalhe', detalhe['id'],
+                                     {'quantidade': _num(detalhe['quantidade']) + quantidade})
+        conn.execute('DELETE FROM movimentacao WHERE id = ?', (mov['id'],))
+
+    elif operacao == 'EXCLUIR_LOTE':
+        removidas = conn.execute(
+            'DELETE FROM movimentacao WHERE item_id = ? AND lote IS ? AND nf IS ?',
+            (item['id'], detalhe['lote'], detalhe['nf'])
+        ).rowcount
+        item = _atualizar(conn, 'item_estoque', item['id'],
+                          {'qtd_estoque': max(0, qtd_item - _num(detalhe['quantidade']))})
+        conn.execute('DELETE FROM estoque_detalhe WHERE id = ?', (detalhe['id'],))
+
+    return {
+        'operacao': operacao, 'item': item, 'detalhe': detalhe, 'movimentacao': mov,
+        'lote_encontrado': encontrado, 'movimentacoes_removidas': removidas
+    }
+
+
+def _sqlite_movimentacoes(conn, p: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """public.registrar_movimentacoes: cada ENTRADA em um savepoint próprio."""
+    resultados = []
+    for entrada in p:
+        conn.execute('SAVEPOINT entrada')
+        try:
+            if entrada.get('operacao') != 'ENTRADA':
+                raise MovimentacaoError('OPERACAO_INVALIDA', 'Só ENTRADA é aceita em lote.')
+            resultados.append(_sqlite_movimentacao(conn, entrada))
+        except MovimentacaoError as e:
+            conn.execute('ROLLBACK TO entrada')
+            resultados.append({'erro': e.codigo, 'mensagem': e.mensagem})
+        except sqlite3.Error as e:
+            conn.execute('ROLLBACK TO entrada')
+            resultados.append({'erro': 'ERRO_BANCO', 'mensagem': str(e)})
+        conn.execute('RELEASE entrada')
+    return resultados
+
+
+def _sqlite_movimentacao_consumivel(conn, p: Dict[str, Any]) -> Dict[str, Any]:
+    tipo = p['tipo']
+    if tipo not in ('ENTRADA', 'SAIDA'):
+        raise MovimentacaoError('OPERACAO_INVALIDA', f'Tipo de movimentação desconhecido: {tipo}')
+
+    consumivel = _linha(conn, 'consumivel_estoque', p.get('consumivel_id'))
+    if not consumivel:
+        raise MovimentacaoError('NAO_ENCONTRADO', 'Consumível não encontrado.')
+
+    atual = _num(consumivel['quantidade_atual'])
+    quantidade = _num(p.get('quantidade'))
+    if tipo == 'SAIDA' and atual < quantidade:
+        raise MovimentacaoError('ESTOQUE_INSUFICIENTE', f'Quantidade insuficiente. Disponível: {atual}')
+
+    nova = atual + quantidade if tipo == 'ENTRADA' else atual - quantidade
+    consumivel = _atualizar(conn, 'consumivel_estoque', consumivel['id'], {'quantidade_atual': nova})
+    mov = _inserir(conn, 'movimentacao_consumivel', {
+        'consumivel_id': consumivel['id'], 'tipo': tipo, 'quantidade': quantidade,
+        'usuario': p.get('usuario'), 'setor_destino': p.get('setor_destino'),
+        'observacao': p.get('observacao'), 'data_movimentacao': _agora()
+    })
+    return {'consumivel': consumivel, 'movimentacao': mov}
+
+
+# ============================================================
+# SUPABASE SEM FUNÇÕES SQL (compare-and-swap)
+# ============================================================
+
+class _Desfazer:
+    """
+    Passos já gravados pelo caminho CAS e como revertê-los. Se um passo seguinte falhar,
+    os anteriores são desfeitos do último ao primeiro (deltas relativos, também por CAS),
+    para que a operação não fique pela metade, como na transação da função SQL.
+    """
+
+    def __init__(self):
+        self.passos: List[Tuple[str, Callable[[], Any]]] = []
+
+    def registrar(self, descricao: str, reverter: Callable[[], Any]):
+        self.passos.append((descricao, reverter))
+
+    def executar(self) -> List[str]:
+        """Desfaz os passos registrados. Retorna os que não puderam ser desfeitos."""
+        pendentes = []
+        for descricao, reverter in reversed(self.passos):
+            try:
+                reverter()
+            except Exception as e:
+                print(f"❌ Falha ao desfazer {descricao}: {e}")
+                pendentes.append(descricao)
+        self.passos = []
+        return pendentes
+
+
+def _executar_cas(operacao, params: Dict[str, Any]) -> Dict[str, Any]:
+    desfazer = _Desfazer()
+    try:
+        return operacao(params, desfazer)
+    except ConcurrencyError as e:
+        print(f"⚠️ Movimentação abortada por conflito: {e}")
+        codigo, mensagem = 'CONFLITO', 'O estoque foi alterado por outras operações. Tente novamente.'
+    except MovimentacaoError as e:
+        codigo, mensagem = e.codigo, e.mensagem
+    except Exception as e:
+        codigo, mensagem = 'ERRO_BANCO', str(e)
+
+    pendentes = desfazer.executar()
+    if pendentes:
+        raise MovimentacaoError('ERRO_BANCO', f"{mensagem} A operação foi interrompida e não foi possível "
+                                              f"desfazer: {', '.join(pendentes)}. Confira os saldos antes de repetir.")
+    raise MovimentacaoError(codigo, mensagem)
+
+
+def _gravado(row: Optional[Dict[str, Any]], descricao: str) -> Dict[str, Any]:
+    if not row:
+        raise MovimentacaoError('ERRO_BANCO', f'Falha ao gravar {descricao}.')
+    return row
+
+
+def _lote_por_chave(item_id: Any, valores: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Primeiro lote do item com os valores dados (None casa com NULL, como IS NOT DISTINCT FROM)."""
+    query = supabase.table('estoque_detalhe').select('*').eq('item_estoque_id', item_id)
+    for coluna, valor in valores.items():
+        query = query.is_(coluna, 'null') if valor is None else query.eq(coluna, valor)
+    response = query.order('id').limit(1).execute()
+    return response.data[0] if response.data else None
+
+
+def _somar(coluna: str, delta: float, minimo: Optional[float] = None):
+    """compute para update_cas: coluna += delta (limitado a `minimo`, se dado)."""
+    def compute(row: Dict[str, Any]) -> Dict[str, Any]:
+        novo = _num(row.get(coluna)) + delta
+        return {coluna: novo if minimo is None else max(minimo, novo)}
+    return compute
+
+
+def _remover_lote_criado(detalhe: Dict[str, Any], quantidade: float):
+    """Desfaz a criação de um lote: retira a entrada e apaga o lote se ninguém mais entrou nele."""
+    revertido = update_cas('estoque_detalhe', detalhe['id'], _somar('quantidade', -quantidade),
+                           max_retries=DESFAZER_TENTATIVAS)
+    if revertido and _num(revertido.get('quantidade')) == 0:
+        delete_one('estoque_detalhe', {'id': detalhe['id'], 'quantidade': 0})
+
+
+def _reverter(*colunas: str, restaurar: Tuple[str, ...] = ()):
+    """
+    inverso para _cas: devolve às `colunas` numéricas o delta aplicado (relativo ao valor
+    atual, preservando escritas concorrentes) e às colunas `restaurar` o valor anterior.
+    """
+    def inverso(antes: Dict[str, Any], depois: Dict[str, Any]):
+        def compute(row: Dict[str, Any]) -> Dict[str, Any]:
+            valores = {c: antes.get(c) for c in restaurar}
+            for c in colunas:
+                valores[c] = _num(row.get(c)) - (_num(depois.get(c)) - _num(antes.get(c)))
+            return valores
+        return compute
+    return inverso
+
+
+def _cas(desfazer: _Desfazer, tabela: str, row_id: Any, compute, inverso,
+         guard: Optional[List[str]] = None, current: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """update_cas que registra em `desfazer` como reverter a gravação (inverso(antes, depois) -> compute)."""
+    lido = {}
+
+    def calcular(atual: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        lido['antes'] = atual
+        return compute(atual)
+
+    depois = update_cas(tabela, row_id, calcular, guard=guard, current=current)
+    if depois is not None and depois is not lido.get('antes'):
+        reverter = inverso(lido['antes'], depois)
+        desfazer.registrar(f"{tabela} {row_id}",
+                           lambda: update_cas(tabela, row_id, reverter, max_retries=DESFAZER_TENTATIVAS))
+    return depois
+
+
+def _cas_movimentacao(p: Dict[str, Any], desfazer: _Desfazer) -> Dict[str, Any]:
+    operacao = p['operacao']
+    if operacao not in OPERACOES:
+        raise MovimentacaoError('OPERACAO_INVALIDA', f'Operação desconhecida: {operacao}')
+
+    quantidade = _num(p.get('quantidade'))
+    item_id = p.get('item_id')
+    detalhe = mov = None
+    encontrado = False
+    removidas = 0
+
+    if operacao == 'ESTORNO':
+        mov = select_one('movimentacao', {'id': p.get('movimentacao_id')})
+        if not mov:
+            raise MovimentacaoError('NAO_ENCONTRADO', 'Movimentação não encontrada.')
+        item_id = mov['item_id']
+        quantidade = _num(mov['quantidade'])
+
+    item = select_one('item_estoque', {'id': item_id})
+    if not item:
+        raise MovimentacaoError('NAO_ENCONTRADO', 'Item não encontrado.')
+
+    if operacao in ('SAIDA', 'AJUSTE', 'EXCLUIR_LOTE'):
+        detalhe = select_one('estoque_detalhe', {'id': p.get('detalhe_id')})
+        if not detalhe or detalhe['item_estoque_id'] != item['id']:
+            raise MovimentacaoError('LOTE_INVALIDO', 'Lote/Item NF inválido para este item.')
+
+    if operacao == 'ENTRADA':
+        chave = {'lote': p.get('lote'), 'item_nf': p.get('item_nf'), 'nf': p.get('nf')}
+        existente = _lote_por_chave(item['id'], chave)
+        if existente:
+            detalhe = _cas(desfazer, 'estoque_detalhe', existente['id'], _somar('quantidade', quantidade),
+                           _reverter('quantidade'), current=existente)
+        else:
+            estacao = p.get('estacao') or None
+            if not estacao:
+                ultimo = supabase.table('estoque_detalhe').select('estacao').eq('item_estoque_id', item['id']) \
+                    .order('data_entrada.desc.nullslast,id', desc=True).limit(1).execute()
+                estacao = (ultimo.data[0].get('estacao') if ultimo.data else None) or None
+            detalhe = insert_one('estoque_detalhe', dict(
+                chave, item_estoque_id=item['id'], validade=p.get('validade') or None,
+                estacao=estacao or 'Almoxarifado', quantidade=quantidade
+            ))
+            if detalhe:
+                desfazer.registrar(f"estoque_detalhe {detalhe['id']}", lambda: _remover_lote_criado(detalhe, quantidade))
+        _gravado(detalhe, 'o lote')
+        item = _cas(desfazer, 'item_estoque', item['id'], _somar('qtd_estoque', quantidade), _reverter('qtd_estoque'),
+                    current=item)
+        mov = _gravado(insert_one('movimentacao', dict(
+            chave, item_id=item['id'], tipo='ENTRADA', quantidade=quantidade,
+            usuario=p.get('usuario'), etapa=p.get('etapa'), observacao=p.get('observacao')
+        )), 'a movimentação')
+
+    elif operacao == 'SAIDA':
+        def baixar(row: Dict[str, Any]) -> Dict[str, Any]:
+            disponivel = _num(row.get('quantidade'))
+            if disponivel < quantidade:
+                raise MovimentacaoError('ESTOQUE_INSUFICIENTE',
+                                        f'Quantidade insuficiente no lote selecionado. Disponível: {disponivel}')
+            return {'quantidade': disponivel - quantidade}
+
+        detalhe = _gravado(_cas(desfazer, 'estoque_detalhe', detalhe['id'], baixar, _reverter('quantidade'),
+                                current=detalhe), 'o lote')
+        item = _cas(desfazer, 'item_estoque', item['id'], _somar('qtd_estoque', -quantidade), _reverter('qtd_estoque'),
+                    current=item)
+        mov = _gravado(insert_one('movimentacao', {
+            'item_id': item['id'], 'tipo': 'SAIDA', 'quantidade': quantidade,
+            'lote': detalhe.get('lote'), 'item_nf': detalhe.get('item_nf'), 'nf': detalhe.get('nf'),
+            'usuario': p.get('usuario'), 'etapa': p.get('etapa'), 'observacao': p.get('observacao')
+        }), 'a movimentação')
+
+    elif operacao == 'AJUSTE':
+        nova = float(p['nova_quantidade'])
+        lido = {}
+
+        def ajustar(row: Dict[str, Any]) -> Dict[str, Any]:
+            lido['anterior'] = _num(row.get('quantidade'))
+            return {
+                'lote': p.get('lote'), 'nf': p.get('nf'), 'item_nf': p.get('item_nf'),
+                'validade': p.get('validade') or None, 'estacao': p.get('estacao'), 'quantidade': nova
+            }
+
+        detalhe = _gravado(_cas(desfazer, 'estoque_detalhe', detalhe['id'], ajustar,
+                                _reverter('quantidade', restaurar=('lote', 'nf', 'item_nf', 'validade', 'estacao')),
+                                guard=['quantidade'], current=detalhe), 'o lote')
+        anterior = lido['anterior']
+        diferenca = nova - anterior
+
+        def ajustar_item(row: Dict[str, Any]) -> Dict[str, Any]:
+            return {'endereco': p.get('endereco'), 'qtd_estoque': _num(row.get('qtd_estoque')) + diferenca}
+
+        item = _cas(desfazer, 'item_estoque', item['id'], ajustar_item,
+                    _reverter('qtd_estoque', restaurar=('endereco',)), guard=['qtd_estoque'], current=item)
+        if diferenca != 0:
+            mov = _gravado(insert_one('movimentacao', {
+                'item_id': item['id'], 'tipo': 'AJUSTE-ENTRADA' if diferenca > 0 else 'AJUSTE-SAIDA',
+                'quantidade': abs(diferenca), 'lote': p.get('lote'), 'item_nf': p.get('item_nf'),
+                'nf': p.get('nf'), 'usuario': p.get('usuario'), 'etapa': 'AJUSTE',
+                'observacao': f"Ajuste manual. Motivo: {p.get('motivo')}. Qtd anterior: {anterior}, Qtd nova: {nova}."
+            }), 'a movimentação')
+
+    elif operacao == 'ESTORNO':
+        detalhe = _lote_por_chave(item['id'], {'lote': mov.get('lote'), 'nf': mov.get('nf')})
+        encontrado = detalhe is not None
+        sinal = -1 if 'ENTRADA' in (mov.get('tipo') or '') else 1 if 'SAIDA' in (mov.get('tipo') or '') else 0
+        if sinal:
+            minimo = 0 if sinal < 0 else None
+            item = _cas(desfazer, 'item_estoque', item['id'], _somar('qtd_estoque', sinal * quantidade, minimo),
+                        _reverter('qtd_estoque'), current=item)
+            if detalhe:
+                detalhe = _cas(desfazer, 'estoque_detalhe', detalhe['id'],
+                               _somar('quantidade', sinal * quantidade, minimo), _reverter('quantidade'), current=detalhe)
+        if not delete_one('movimentacao', {'id': mov['id']}):
+            raise MovimentacaoError('ERRO_BANCO', 'Falha ao apagar a movimentação.')
+
+    elif operacao == 'EXCLUIR_LOTE':
+        # Apagar o histórico não tem volta: fica por último, depois dos passos reversíveis
+        item = _cas(desfazer, 'item_estoque', item['id'], _somar('qtd_estoque', -_num(detalhe.get('quantidade')), 0),
+                    _reverter('qtd_estoque'), current=item)
+        if not delete_one('estoque_detalhe', {'id': detalhe['id']}):
+            raise MovimentacaoError('ERRO_BANCO', 'Falha ao apagar o lote.')
+        desfazer.registrar(f"estoque_detalhe {detalhe['id']}",
+                           lambda: _gravado(insert_one('estoque_detalhe', detalhe), 'o lote de volta'))
+        query = supabase.table('movimentacao').delete().eq('item_id', item['id'])
+        for coluna in ('lote', 'nf'):
+            query = query.is_(coluna, 'null') if detalhe.get(coluna) is None else query.eq(coluna, detalhe[coluna])
+        removidas = len(query.execute().data or [])
+
+    return {
+        'operacao': operacao, 'item': item, 'detalhe': detalhe, 'movimentacao': mov,
+        'lote_encontrado': encontrado, 'movimentacoes_removidas': removidas
+    }
+
+
+def _cas_movimentacoes(p: List[Dict[str, Any]], desfazer: _Desfazer) -> List[Dict[str, Any]]:
+    """Sem a função em lote: uma ENTRADA por vez, cada uma desfeita sozinha se falhar."""
+    resultados = []
+    for entrada in p:
+        try:
+            resultados.append(_executar_cas(_cas_movimentacao, entrada))
+        except MovimentacaoError as e:
+            resultados.append({'erro': e.codigo, 'mensagem': e.mensagem})
+    return resultados
+
+
+def _cas_movimentacao_consumivel(p: Dict[str, Any], desfazer: _Desfazer) -> Dict[str, Any]:
+    tipo = p['tipo']
+    if tipo not in ('ENTRADA', 'SAIDA'):
+        raise MovimentacaoError('OPERACAO_INVALIDA', f'Tipo de movimentação desconhecido: {tipo}')
+    quantidade = _num(p.get('quantidade'))
+
+    def movimentar(row: Dict[str, Any]) -> Dict[str, Any]:
+        atual = _num(row.get('quantidade_atual'))
+        if tipo == 'SAIDA' and atual < quantidade:
+            raise MovimentacaoError('ESTOQUE_INSUFICIENTE', f'Quantidade insuficiente. Disponível: {atual}')
+        return {'quantidade_atual': atual + quantidade if tipo == 'ENTRADA' else atual - quantidade}
+
+    consumivel = _cas(desfazer, 'consumivel_estoque', p.get('consumivel_id'), movimentar,
+                      _reverter('quantidade_atual'))
+    if not consumivel:
+        raise MovimentacaoError('NAO_ENCONTRADO', 'Consumível não encontrado.')
+    mov = _gravado(insert_one('movimentacao_consumivel', {
+        'consumivel_id': consumivel['id'], 'tipo': tipo, 'quantidade': quantidade,
+        'usuario': p.get('usuario'), 'setor_destino': p.get('setor_destino'), 'observacao': p.get('observacao')
+    }), 'a movimentação')
+    return {'consumivel': consumivel, 'movimentacao': mov}
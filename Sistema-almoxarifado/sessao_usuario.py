@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Sessão do Usuário - Cache do user_loader do flask_login
+O load_user roda em TODA requisição autenticada (inclusive os polls JSON do
+dashboard); sem cache, cada uma pagava uma ida ao Supabase só para ler o usuário.
+
+Dois níveis, ambos com validade USER_CACHE_TTL segundos:
+1. Claims na sessão assinada (id, username, role): a maioria das requisições não
+   consulta nada. Desligável com USER_SESSION_CLAIMS=0.
+2. Cache em memória do processo, por id de usuário.
+Expirados os dois, o usuário é relido do banco e as claims são renovadas.
+
+As rotas que alteram usuários (editar_usuario, excluir_usuario, promote_to_admin)
+chamam invalidate(user_id): o cache é descartado e claims emitidas antes disso
+deixam de valer neste processo. Em outros processos (ex.: várias instâncias na
+Vercel) a alteração aparece em no máximo USER_CACHE_TTL segundos.
+"""
+
+import os
+import time
+import threading
+from typing import Any, Dict, Optional
+
+from flask import session, has_request_context
+
+from database_helpers import get_user_by_id
+
+USER_CACHE_TTL: int = int(os.getenv('USER_CACHE_TTL', '60'))
+USER_SESSION_CLAIMS: bool = os.getenv('USER_SESSION_CLAIMS', '1') != '0'
+
+# Só o que as páginas usam de current_user (nunca o password_hash)
+CAMPOS = ('id', 'username', 'role')
+SESSION_KEY = '_usuario'
+
+_lock = threading.RLock()
+_cache: Dict[int, Dict[str, Any]] = {}      # id -> {'dados': {...}, 'em': timestamp}
+_invalidados: Dict[int, float] = {}         # id -> momento da última invalidação
+_stats = {'sessao': 0, 'memoria': 0, 'banco': 0}
+
+
+def _valido(user_id: int, emitido_em: float) -> bool:
+    """Dentro do TTL e emitido depois da última invalidação do usuário."""
+    return time.time() - emitido_em < USER_CACHE_TTL and emitido_em > _invalidados.get(user_id, 0)
+
+
+def _claims_da_sessao(user_id: int) -> Optional[Dict[str, Any]]:
+    if not USER_SESSION_CLAIMS or not has_request_context():
+        return None
+    claims = session.get(SESSION_KEY)
+    if not claims or claims.get('id') != user_id:
+        return None
+    with _lock:
+        if not _valido(user_id, claims.get('em', 0)):
+            return None
+    return {campo: claims.get(campo) for campo in CAMPOS}
+
+
+def _gravar_claims(dados: Dict[str, Any], em: float):
+    """Claims com o momento em que `dados` foram lidos do banco (não o de agora)."""
+    if USER_SESSION_CLAIMS and has_request_context():
+        session[SESSION_KEY] = dict(dados, em=em)
+
+
+def get_user(user_id: int) -> Optional[Dict[str, Any]]:
+    """Dados mínimos do usuário (id, username, role) para o user_loader, ou None se não existe."""
+    user_id = int(user_id)
+
+    dados = _claims_da_sessao(user_id)
+    if dados:
+        _stats['sessao'] += 1
+        return dados
+
+    with _lock:
+        entrada = _cache.get(user_id)
+        if entrada and _valido(user_id, entrada['em']):
+            _stats['memoria'] += 1
+            dados, lido_em = dict(entrada['dados']), entrada['em']
+    if dados:
+        # Mesma validade da entrada do cache: as claims não estendem o TTL
+        _gravar_claims(dados, lido_em)
+        return dados
+
+    user_data = get_user_by_id(user_id)
+    _stats['banco'] += 1
+    if not user_data:
+        invalidate(user_id)
+        return None
+
+    dados = {campo: user_data.get(campo) for campo in CAMPOS}
+    lido_em = time.time()
+    with _lock:
+        _cache[user_id] = {'dados': dict(dados), 'em': lido_em}
+    _gravar_claims(dados, lido_em)
+    return dados
+
+
+def remember(user_data: Dict[str, Any]):
+    """Chamado no login: já deixa claims e cache prontos para as próximas requisições."""
+    dados = {campo: user_data.get(campo) for campo in CAMPOS}
+    lido_em = time.time()
+    with _lock:
+        _cache[int(dados['id'])] = {'dados': dict(dados), 'em': lido_em}
+    _gravar_claims(dados, lido_em)
+
+
+def forget():
+    """Chamado no logout: remove as claims da sessão."""
+    if has_request_context():
+        session.pop(SESSION_KEY, None)
+
+
+def invalidate(user_id: int):
+    """Descarta o usuário do cache e invalida as claims já emitidas para ele."""
+    user_id = int(user_id)
+    with _lock:
+        _cache.pop(user_id, None)
+        _invalidados[user_id] = time.time()
+    if has_request_context():
+        claims = session.get(SESSION_KEY)
+        if claims and claims.get('id') == user_id:
+            session.pop(SESSION_KEY, None)
+
+
+def stats() -> Dict[str, int]:
+    """De onde vieram os usuários carregados: sessão, memória ou banco."""
+    with _lock:
+        return dict(_stats, em_cache=len(_cache))
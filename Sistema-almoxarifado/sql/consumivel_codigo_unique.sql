@@ -0,0 +1,6 @@
+-- Garante a chave única usada pelo upsert da importação de consumíveis
+-- (ON CONFLICT (codigo_produto), ver importacao.importar_planilha_consumiveis).
+-- Bancos criados pelo script original já têm a restrição UNIQUE; o índice é idempotente.
+
+create unique index if not exists consumivel_estoque_codigo_produto_key
+    on public.consumivel_estoque (codigo_produto);
@@ -0,0 +1,10 @@
+-- Cópia persistida do snapshot do dashboard (ver dashboard_snapshot.py).
+-- Usada apenas quando DASHBOARD_SNAPSHOT_PERSIST=1, para que instâncias
+-- serverless recém-iniciadas não recalculem o dashboard do zero.
+
+create table if not exists public.dashboard_snapshot (
+    id          integer primary key default 1 check (id = 1),
+    version     bigint       not null,
+    payload     jsonb        not null,
+    updated_at  timestamptz  not null default now()
+);
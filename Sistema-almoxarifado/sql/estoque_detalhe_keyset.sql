@@ -0,0 +1,10 @@
+-- Índice da paginação por cursor de /estoque (ver supabase_client.select_page):
+-- lotes com saldo na ordem (validade, id). Com ele, "depois do cursor" é uma
+-- busca no índice e a página 400 custa o mesmo que a página 1.
+
+create index if not exists estoque_detalhe_validade_id_idx
+    on public.estoque_detalhe (validade, id)
+    where quantidade > 0;
+
+-- A contagem 'planned' (ESTOQUE_COUNT_METHOD) usa as estatísticas do planner
+analyze public.estoque_detalhe;
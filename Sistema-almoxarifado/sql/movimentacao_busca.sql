@@ -0,0 +1,81 @@
+-- Busca de texto do relatório de movimentações no servidor (ver
+-- database_helpers.get_movimentacoes_report). Em vez de baixar o período inteiro
+-- e filtrar em Python, o relatório envia busca=ilike.*TERMO* e recebe só as linhas
+-- que casam.
+--
+-- movimentacao.busca guarda o texto denormalizado (código e descrição do item,
+-- lote, usuário, observação) sem acentos e em maiúsculas, o mesmo formato de
+-- busca_itens.normalize_text no Python. É mantida por triggers na própria
+-- movimentação e na renomeação do item, e indexada com pg_trgm (ILIKE '%x%' usa o índice).
+-- O substituto local (supabase_local.py) calcula a mesma coluna na consulta.
+
+create extension if not exists unaccent with schema extensions;
+create extension if not exists pg_trgm with schema extensions;
+
+-- unaccent() não é IMMUTABLE; a forma com dicionário explícito pode ser embrulhada
+create or replace function public.normalizar_busca(texto text)
+returns text
+language sql
+immutable
+parallel safe
+as $$
+    select upper(regexp_replace(
+        extensions.unaccent('extensions.unaccent'::regdictionary, coalesce(texto, '')),
+        '\s+', ' ', 'g'))
+$$;
+
+create or replace function public.movimentacao_texto_busca(
+    p_item_id bigint, p_lote text, p_usuario text, p_observacao text)
+returns text
+language sql
+stable
+as $$
+    select public.normalizar_busca(concat_ws(' | ', i.codigo, i.descricao, p_lote, p_usuario, p_observacao))
+    from public.item_estoque i
+    where i.id = p_item_id
+$$;
+
+alter table public.movimentacao add column if not exists busca text;
+
+create or replace function public.movimentacao_busca_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.busca := public.movimentacao_texto_busca(new.item_id, new.lote, new.usuario, new.observacao);
+    return new;
+end;
+$$;
+
+drop trigger if exists movimentacao_busca on public.movimentacao;
+create trigger movimentacao_busca
+    before insert or update of item_id, lote, usuario, observacao on public.movimentacao
+    for each row execute function public.movimentacao_busca_trg();
+
+-- Item renomeado: recalcula o texto das movimentações dele
+create or replace function public.item_estoque_busca_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+    update public.movimentacao m
+       set busca = public.movimentacao_texto_busca(m.item_id, m.lote, m.usuario, m.observacao)
+     where m.item_id = new.id;
+    return null;
+end;
+$$;
+
+drop trigger if exists item_estoque_busca on public.item_estoque;
+create trigger item_estoque_busca
+    after update of codigo, descricao on public.item_estoque
+    for each row
+    when (old.codigo is distinct from new.codigo or old.descricao is distinct from new.descricao)
+    execute function public.item_estoque_busca_trg();
+
+-- Preenche as movimentações existentes
+update public.movimentacao m
+   set busca = public.movimentacao_texto_busca(m.item_id, m.lote, m.usuario, m.observacao)
+ where m.busca is null;
+
+create index if not exists movimentacao_busca_trgm_idx
+    on public.movimentacao using gin (busca extensions.gin_trgm_ops);
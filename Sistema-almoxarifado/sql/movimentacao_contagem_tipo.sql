@@ -0,0 +1,30 @@
+-- Contagem de movimentações por tipo para o gráfico do relatório (ver
+-- database_helpers.get_movimentacoes_contagem_por_tipo). Uma única consulta agrupada
+-- no servidor em vez de baixar o período inteiro e contar em Python; a tabela do
+-- relatório é paginada à parte (get_movimentacoes_report_page).
+--
+-- Mesmos filtros do relatório: período e termos da busca, já normalizados e com
+-- % e _ escapados pelo Python, que precisam aparecer todos em movimentacao.busca
+-- (busca nula não casa com nenhum termo; sem termos, todas as linhas contam).
+-- Requer sql/movimentacao_busca.sql. O substituto local (supabase_local.py) tem a
+-- função equivalente.
+
+create or replace function public.contar_movimentacoes_por_tipo(
+    p_inicio timestamp default null,
+    p_fim timestamp default null,
+    p_termos text[] default '{}')
+returns table(tipo text, total bigint)
+language sql
+stable
+as $$
+    select m.tipo::text, count(*)
+      from public.movimentacao m
+     where (p_inicio is null or m.data_movimentacao >= p_inicio)
+       and (p_fim is null or m.data_movimentacao <= p_fim)
+       and coalesce((select bool_and(coalesce(m.busca, '') ilike '%' || t || '%') from unnest(p_termos) t), true)
+     group by m.tipo
+$$;
+
+-- Período e páginas da tabela (order=data_movimentacao.desc,id.desc) sem varrer a tabela
+create index if not exists movimentacao_data_id_idx
+    on public.movimentacao (data_movimentacao, id);
@@ -0,0 +1,95 @@
+-- Totais diários de movimentação (ver movimentacao_diaria.py). O gráfico de 15 dias
+-- do dashboard, o histórico do item e as previsões de consumo leem esta tabela, com
+-- no máximo itens × dias × tipos linhas, em vez de baixar o livro de movimentações
+-- e agrupar por dia em Python.
+--
+-- Uma linha por (item_id, dia, tipo) com a soma das quantidades e o número de
+-- movimentações. Mantida por trigger em toda inclusão, exclusão ou alteração em
+-- movimentacao (inclusive as feitas por registrar_movimentacao e pelo estorno);
+-- linhas que chegam a zero movimentações são removidas.
+--
+-- dia = data_movimentacao::date, o mesmo dia que o Python extrai do texto devolvido
+-- pelo PostgREST (fuso da sessão, UTC no Supabase).
+--
+-- Carga inicial e reconstrução: select public.reconstruir_movimentacao_diaria();
+-- ou  python movimentacao_diaria.py --reconstruir
+
+create table if not exists public.movimentacao_diaria (
+    item_id        bigint   not null,
+    dia            date     not null,
+    tipo           text     not null,
+    quantidade     numeric  not null default 0,
+    movimentacoes  integer  not null default 0,
+    primary key (item_id, dia, tipo)
+);
+
+-- Gráfico do dashboard e previsões filtram só pelo período
+create index if not exists movimentacao_diaria_dia_idx
+    on public.movimentacao_diaria (dia);
+
+create or replace function public.movimentacao_diaria_somar(
+    p_item_id bigint, p_data timestamp, p_tipo text, p_quantidade numeric, p_sinal integer)
+returns void
+language plpgsql
+as $$
+begin
+    if p_item_id is null or p_data is null then
+        return;
+    end if;
+
+    insert into public.movimentacao_diaria as d (item_id, dia, tipo, quantidade, movimentacoes)
+    values (p_item_id, p_data::date, coalesce(p_tipo, ''), p_sinal * coalesce(p_quantidade, 0), p_sinal)
+    on conflict (item_id, dia, tipo) do update
+        set quantidade = d.quantidade + excluded.quantidade,
+            movimentacoes = d.movimentacoes + excluded.movimentacoes;
+
+    if p_sinal < 0 then
+        delete from public.movimentacao_diaria
+         where item_id = p_item_id and dia = p_data::date and tipo = coalesce(p_tipo, '')
+           and movimentacoes <= 0;
+    end if;
+end;
+$$;
+
+create or replace function public.movimentacao_diaria_trg()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.movimentacao_diaria_somar(old.item_id, old.data_movimentacao, old.tipo, old.quantidade, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.movimentacao_diaria_somar(new.item_id, new.data_movimentacao, new.tipo, new.quantidade, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists movimentacao_diaria on public.movimentacao;
+create trigger movimentacao_diaria
+    after insert or delete or update of item_id, data_movimentacao, tipo, quantidade on public.movimentacao
+    for each row execute function public.movimentacao_diaria_trg();
+
+-- Recalcula a tabela inteira a partir do livro, em uma única instrução agrupada.
+-- Trava movimentacao contra escrita durante a reconstrução para não perder deltas.
+create or replace function public.reconstruir_movimentacao_diaria()
+returns bigint
+language plpgsql
+as $$
+declare
+    v_linhas bigint;
+begin
+    lock table public.movimentacao in share mode;
+    delete from public.movimentacao_diaria;
+    insert into public.movimentacao_diaria (item_id, dia, tipo, quantidade, movimentacoes)
+    select item_id, data_movimentacao::date, coalesce(tipo, ''), coalesce(sum(quantidade), 0), count(*)
+      from public.movimentacao
+     where item_id is not null and data_movimentacao is not null
+     group by item_id, data_movimentacao::date, coalesce(tipo, '');
+    get diagnostics v_linhas = row_count;
+    return v_linhas;
+end;
+$$;
+
+select public.reconstruir_movimentacao_diaria();
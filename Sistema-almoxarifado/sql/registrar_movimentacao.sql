@@ -0,0 +1,340 @@
+-- Operações de estoque atômicas (ver movimentacoes.py).
+-- Cada chamada faz, em UMA transação e UMA ida ao banco (supabase.rpc), o que antes
+-- eram 4-6 requisições sequenciais: ajuste do lote, do total do item e o lançamento
+-- na tabela movimentacao. As linhas são travadas (FOR UPDATE) sempre na ordem
+-- movimentação -> item -> lote, de modo que operadores simultâneos não perdem atualizações.
+--
+-- Parâmetro único `p` (jsonb) com a chave 'operacao':
+--   ENTRADA      item_id, quantidade, lote, item_nf, nf, validade, estacao*, usuario, etapa, observacao
+--   SAIDA        item_id, detalhe_id, quantidade, usuario, etapa, observacao
+--   AJUSTE       item_id, detalhe_id, nova_quantidade, lote, item_nf, nf, validade, estacao,
+--                endereco, motivo, usuario
+--   ESTORNO      movimentacao_id
+--   EXCLUIR_LOTE item_id, detalhe_id
+-- (* opcional: sem estação, usa a do último lote do item ou 'Almoxarifado')
+--
+-- Retorna jsonb: {operacao, item, detalhe, movimentacao, lote_encontrado, movimentacoes_removidas}
+-- Erros: exceção com message = NAO_ENCONTRADO | LOTE_INVALIDO | ESTOQUE_INSUFICIENTE |
+--        OPERACAO_INVALIDA e a mensagem para o usuário em detail.
+
+create or replace function public.registrar_movimentacao(p jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_operacao    text    := upper(coalesce(p->>'operacao', ''));
+    v_lote        public.estoque_detalhe%rowtype;
+    v_quantidade  numeric := coalesce((p->>'quantidade')::numeric, 0);
+    v_item_id     bigint  := (p->>'item_id')::bigint;
+    v_item        public.item_estoque%rowtype;
+    v_detalhe     public.estoque_detalhe%rowtype;
+    v_mov         public.movimentacao%rowtype;
+    v_encontrado  boolean := false;
+    v_removidas   integer := 0;
+    v_anterior    numeric;
+    v_nova        numeric;
+    v_diferenca   numeric;
+    v_estacao     text;
+begin
+    if v_operacao not in ('ENTRADA', 'SAIDA', 'AJUSTE', 'ESTORNO', 'EXCLUIR_LOTE') then
+        raise exception using message = 'OPERACAO_INVALIDA',
+                              detail = format('Operação desconhecida: %s', v_operacao);
+    end if;
+
+    -- ESTORNO parte da movimentação: ela define o item
+    if v_operacao = 'ESTORNO' then
+        select * into v_mov from public.movimentacao
+         where id = (p->>'movimentacao_id')::bigint
+           for update;
+        if not found then
+            raise exception using message = 'NAO_ENCONTRADO', detail = 'Movimentação não encontrada.';
+        end if;
+        v_item_id := v_mov.item_id;
+        v_quantidade := coalesce(v_mov.quantidade, 0);
+    end if;
+
+    -- EXCLUIR_LOTE apaga as movimentações do lote: elas são travadas antes do item,
+    -- como no ESTORNO (o lote é lido sem trava só para saber quais são)
+    if v_operacao = 'EXCLUIR_LOTE' then
+        select * into v_lote from public.estoque_detalhe where id = (p->>'detalhe_id')::bigint;
+        if found then
+            perform 1 from public.movimentacao
+             where item_id = v_lote.item_estoque_id
+               and lote is not distinct from v_lote.lote
+               and nf   is not distinct from v_lote.nf
+             order by id
+               for update;
+        end if;
+    end if;
+
+    select * into v_item from public.item_estoque where id = v_item_id for update;
+    if not found then
+        raise exception using message = 'NAO_ENCONTRADO', detail = 'Item não encontrado.';
+    end if;
+
+    -- Lote informado por id (SAIDA, AJUSTE, EXCLUIR_LOTE)
+    if v_operacao in ('SAIDA', 'AJUSTE', 'EXCLUIR_LOTE') then
+        select * into v_detalhe from public.estoque_detalhe
+         where id = (p->>'detalhe_id')::bigint
+           for update;
+        if not found or v_detalhe.item_estoque_id <> v_item.id then
+            raise exception using message = 'LOTE_INVALIDO', detail = 'Lote/Item NF inválido para este item.';
+        end if;
+        -- Lote ou NF alterados depois da leitura sem trava: as movimentações travadas são outras
+        if v_operacao = 'EXCLUIR_LOTE'
+           and (v_detalhe.lote is distinct from v_lote.lote or v_detalhe.nf is distinct from v_lote.nf) then
+            raise exception using message = 'LOTE_INVALIDO',
+                                  detail = 'O lote foi alterado durante a exclusão. Tente novamente.';
+        end if;
+    end if;
+
+    if v_operacao = 'ENTRADA' then
+        select * into v_detalhe from public.estoque_detalhe
+         where item_estoque_id = v_item.id
+           and lote    is not distinct from p->>'lote'
+           and item_nf is not distinct from p->>'item_nf'
+           and nf      is not distinct from p->>'nf'
+         order by id
+         limit 1
+           for update;
+
+        if found then
+            update public.estoque_detalhe
+               set quantidade = coalesce(quantidade, 0) + v_quantidade
+             where id = v_detalhe.id
+            returning * into v_detalhe;
+        else
+            v_estacao := nullif(p->>'estacao', '');
+            if v_estacao is null then
+                select nullif(estacao, '') into v_estacao
+                  from public.estoque_detalhe
+                 where item_estoque_id = v_item.id
+                 order by data_entrada desc nulls last, id desc
+                 limit 1;
+            end if;
+
+            insert into public.estoque_detalhe
+                   (item_estoque_id, lote, item_nf, nf, validade, estacao, quantidade)
+            values (v_item.id, p->>'lote', p->>'item_nf', p->>'nf',
+                    nullif(p->>'validade', '')::date, coalesce(v_estacao, 'Almoxarifado'), v_quantidade)
+            returning * into v_detalhe;
+        end if;
+
+        update public.item_estoque
+           set qtd_estoque = coalesce(qtd_estoque, 0) + v_quantidade
+         where id = v_item.id
+        returning * into v_item;
+
+        insert into public.movimentacao
+               (item_id, tipo, quantidade, lote, item_nf, nf, usuario, etapa, observacao)
+        values (v_item.id, 'ENTRADA', v_quantidade, p->>'lote', p->>'item_nf', p->>'nf',
+                p->>'usuario', p->>'etapa', p->>'observacao')
+        returning * into v_mov;
+
+    elsif v_operacao = 'SAIDA' then
+        if coalesce(v_detalhe.quantidade, 0) < v_quantidade then
+            raise exception using message = 'ESTOQUE_INSUFICIENTE',
+                                  detail = format('Quantidade insuficiente no lote selecionado. Disponível: %s',
+                                                  coalesce(v_detalhe.quantidade, 0));
+        end if;
+
+        update public.estoque_detalhe
+           set quantidade = coalesce(quantidade, 0) - v_quantidade
+         where id = v_detalhe.id
+        returning * into v_detalhe;
+
+        update public.item_estoque
+           set qtd_estoque = coalesce(qtd_estoque, 0) - v_quantidade
+         where id = v_item.id
+        returning * into v_item;
+
+        insert into public.movimentacao
+               (item_id, tipo, quantidade, lote, item_nf, nf, usuario, etapa, observacao)
+        values (v_item.id, 'SAIDA', v_quantidade, v_detalhe.lote, v_detalhe.item_nf, v_detalhe.nf,
+                p->>'usuario', p->>'etapa', p->>'observacao')
+        returning * into v_mov;
+
+    elsif v_operacao = 'AJUSTE' then
+        v_anterior  := coalesce(v_detalhe.quantidade, 0);
+        v_nova      := (p->>'nova_quantidade')::numeric;
+        v_diferenca := v_nova - v_anterior;
+
+        update public.estoque_detalhe
+           set lote       = p->>'lote',
+               nf         = p->>'nf',
+               item_nf    = p->>'item_nf',
+               validade   = nullif(p->>'validade', '')::date,
+               estacao    = p->>'estacao',
+               quantidade = v_nova
+         where id = v_detalhe.id
+        returning * into v_detalhe;
+
+        update public.item_estoque
+           set endereco    = p->>'endereco',
+               qtd_estoque = coalesce(qtd_estoque, 0) + v_diferenca
+         where id = v_item.id
+        returning * into v_item;
+
+        if v_diferenca <> 0 then
+            insert into public.movimentacao
+                   (item_id, tipo, quantidade, lote, item_nf, nf, usuario, etapa, observacao)
+            values (v_item.id,
+                    case when v_diferenca > 0 then 'AJUSTE-ENTRADA' else 'AJUSTE-SAIDA' end,
+                    abs(v_diferenca), p->>'lote', p->>'item_nf', p->>'nf', p->>'usuario', 'AJUSTE',
+                    format('Ajuste manual. Motivo: %s. Qtd anterior: %s, Qtd nova: %s.',
+                           p->>'motivo', v_anterior, v_nova))
+            returning * into v_mov;
+        end if;
+
+    elsif v_operacao = 'ESTORNO' then
+        select * into v_detalhe from public.estoque_detalhe
+         where item_estoque_id = v_item.id
+           and lote is not distinct from v_mov.lote
+           and nf   is not distinct from v_mov.nf
+         order by id
+         limit 1
+           for update;
+        v_encontrado := found;
+
+        if position('ENTRADA' in v_mov.tipo) > 0 then
+            update public.item_estoque
+               set qtd_estoque = greatest(0, coalesce(qtd_estoque, 0) - v_quantidade)
+             where id = v_item.id
+            returning * into v_item;
+            if v_encontrado then
+                update public.estoque_detalhe
+                   set quantidade = greatest(0, coalesce(quantidade, 0) - v_quantidade)
+                 where id = v_detalhe.id
+                returning * into v_detalhe;
+            end if;
+        elsif position('SAIDA' in v_mov.tipo) > 0 then
+            update public.item_estoque
+               set qtd_estoque = coalesce(qtd_estoque, 0) + v_quantidade
+             where id = v_item.id
+            returning * into v_item;
+            if v_encontrado then
+                update public.estoque_detalhe
+                   set quantidade = coalesce(quantidade, 0) + v_quantidade
+                 where id = v_detalhe.id
+                returning * into v_detalhe;
+            end if;
+        end if;
+
+        delete from public.movimentacao where id = v_mov.id;
+
+    elsif v_operacao = 'EXCLUIR_LOTE' then
+        delete from public.movimentacao
+         where item_id = v_item.id
+           and lote is not distinct from v_detalhe.lote
+           and nf   is not distinct from v_detalhe.nf;
+        get diagnostics v_removidas = row_count;
+
+        update public.item_estoque
+           set qtd_estoque = greatest(0, coalesce(qtd_estoque, 0) - coalesce(v_detalhe.quantidade, 0))
+         where id = v_item.id
+        returning * into v_item;
+
+        delete from public.estoque_detalhe where id = v_detalhe.id;
+    end if;
+
+    return jsonb_build_object(
+        'operacao', v_operacao,
+        'item', to_jsonb(v_item),
+        'detalhe', case when v_detalhe.id is null then null else to_jsonb(v_detalhe) end,
+        'movimentacao', case when v_mov.id is null then null else to_jsonb(v_mov) end,
+        'lote_encontrado', v_encontrado,
+        'movimentacoes_removidas', v_removidas
+    );
+end;
+$$;
+
+
+
+-- Várias ENTRADAs em uma chamada (importação de planilha, ver importacao.py).
+--   p: jsonb array de parâmetros de ENTRADA (as mesmas chaves de registrar_movimentacao)
+-- Cada elemento passa por registrar_movimentacao, com os mesmos incrementos travados.
+-- Os elementos são processados por item e lote: importações simultâneas travam as
+-- linhas na mesma ordem (entradas se somam, então a ordem não muda o resultado).
+-- Um elemento recusado é desfeito sozinho (subtransação) e os demais seguem.
+-- Retorna jsonb array alinhado com p: o resultado de registrar_movimentacao ou
+-- {erro, mensagem} (erro = código de registrar_movimentacao ou a mensagem do banco).
+
+create or replace function public.registrar_movimentacoes(p jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_entrada   record;
+    v_saida     jsonb[] := array_fill(null::jsonb, array[jsonb_array_length(p)]);
+    v_erro      text;
+    v_detalhe   text;
+begin
+    for v_entrada in
+        select e.value, e.posicao::integer as posicao
+          from jsonb_array_elements(p) with ordinality as e(value, posicao)
+         order by (e.value->>'item_id')::bigint, e.value->>'lote', e.value->>'item_nf', e.value->>'nf', e.posicao
+    loop
+        if upper(coalesce(v_entrada.value->>'operacao', '')) <> 'ENTRADA' then
+            v_saida[v_entrada.posicao] := jsonb_build_object(
+                'erro', 'OPERACAO_INVALIDA', 'mensagem', 'Só ENTRADA é aceita em lote.');
+            continue;
+        end if;
+        begin
+            v_saida[v_entrada.posicao] := public.registrar_movimentacao(v_entrada.value);
+        exception when others then
+            get stacked diagnostics v_erro = message_text, v_detalhe = pg_exception_detail;
+            v_saida[v_entrada.posicao] := jsonb_build_object(
+                'erro', v_erro, 'mensagem', coalesce(nullif(v_detalhe, ''), v_erro));
+        end;
+    end loop;
+
+    return coalesce(to_jsonb(v_saida), '[]'::jsonb);
+end;
+$$;
+
+-- Movimentação de consumível: ajuste de quantidade_atual + lançamento, atomicamente.
+--   p: consumivel_id, tipo (ENTRADA | SAIDA), quantidade, usuario, setor_destino, observacao
+-- Retorna jsonb: {consumivel, movimentacao}
+
+create or replace function public.registrar_movimentacao_consumivel(p jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_tipo        text    := upper(coalesce(p->>'tipo', ''));
+    v_quantidade  numeric := coalesce((p->>'quantidade')::numeric, 0);
+    v_consumivel  public.consumivel_estoque%rowtype;
+    v_mov         public.movimentacao_consumivel%rowtype;
+begin
+    if v_tipo not in ('ENTRADA', 'SAIDA') then
+        raise exception using message = 'OPERACAO_INVALIDA',
+                              detail = format('Tipo de movimentação desconhecido: %s', v_tipo);
+    end if;
+
+    select * into v_consumivel from public.consumivel_estoque
+     where id = (p->>'consumivel_id')::bigint
+       for update;
+    if not found then
+        raise exception using message = 'NAO_ENCONTRADO', detail = 'Consumível não encontrado.';
+    end if;
+
+    if v_tipo = 'SAIDA' and coalesce(v_consumivel.quantidade_atual, 0) < v_quantidade then
+        raise exception using message = 'ESTOQUE_INSUFICIENTE',
+                              detail = format('Quantidade insuficiente. Disponível: %s',
+                                              coalesce(v_consumivel.quantidade_atual, 0));
+    end if;
+
+    update public.consumivel_estoque
+       set quantidade_atual = coalesce(quantidade_atual, 0)
+                              + case when v_tipo = 'ENTRADA' then v_quantidade else -v_quantidade end
+     where id = v_consumivel.id
+    returning * into v_consumivel;
+
+    insert into public.movimentacao_consumivel
+           (consumivel_id, tipo, quantidade, usuario, setor_destino, observacao)
+    values (v_consumivel.id, v_tipo, v_quantidade, p->>'usuario', p->>'setor_destino', p->>'observacao')
+    returning * into v_mov;
+
+    return jsonb_build_object('consumivel', to_jsonb(v_consumivel), 'movimentacao', to_jsonb(v_mov));
+end;
+$$;
@@ -6,7 +6,18 @@ Gerencia todas as conexões e operações com o Supabase via REST API (HTTPS/443
 """
 
 import os
-from typing import Optional, Dict, List, Any
+import copy
+import json
+import time
+import base64
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Any, Callable, Iterator
+import httpx
+from flask import g, has_request_context
+from postgrest.exceptions import APIError
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -17,10 +28,22 @@ load_dotenv('.env.supabase')
 SUPABASE_URL: str = os.getenv('SUPABASE_URL', '')
 SUPABASE_SERVICE_KEY: str = os.getenv('SUPABASE_SERVICE_KEY', '')
 
+# Máximo de linhas que o PostgREST devolve por resposta (config "max-rows"; padrão do Supabase: 1000).
+# Qualquer consulta sem paginação é silenciosamente truncada neste valor.
+SUPABASE_MAX_ROWS: int = int(os.getenv('SUPABASE_MAX_ROWS', '1000'))
+
 # Inicializa o cliente Supabase (inicialização segura para Vercel)
 # Se não houver chaves agora, o objeto 'supabase' será None ou falhará apenas ao ser usado.
+# Substituto local sobre SQLite (benchmark e testes offline, ver supabase_local.py)
+SUPABASE_LOCAL_DB: str = os.getenv('SUPABASE_LOCAL_DB', '')
+
 supabase: Optional[Client] = None
-if SUPABASE_URL and SUPABASE_SERVICE_KEY:
+if SUPABASE_LOCAL_DB:
+    from supabase_local import create_local_client
+    supabase = create_local_client(SUPABASE_LOCAL_DB)
+    print(f"🧪 Cliente Supabase LOCAL (SQLite: {SUPABASE_LOCAL_DB}, "
+          f"latência {supabase.transport.latencia_ms:g}ms ± {supabase.transport.jitter_ms:g}ms)")
+elif SUPABASE_URL and SUPABASE_SERVICE_KEY:
     try:
         supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
         print("✅ Cliente Supabase inicializado com sucesso (HTTPS/443)")
@@ -34,32 +57,270 @@ else:
 # FUNÇÕES HELPER PARA OPERAÇÕES COMUNS
 # ============================================================
 
-def safe_execute(query, operation: str = "query"):
+# ============================================================
+# RESILIÊNCIA (timeouts, retentativas e circuit breaker)
+# ============================================================
+# Toda consulta dos helpers passa por safe_execute:
+# - cada requisição HTTP tem timeout próprio (leitura / escrita);
+# - leituras (GET/HEAD, idempotentes) com falha transitória são repetidas com
+#   backoff exponencial e jitter; escritas e RPCs nunca são repetidas aqui;
+# - falhas transitórias seguidas abrem o circuito: por SUPABASE_CB_COOLDOWN
+#   segundos as consultas falham na hora (sem esperar timeout), e depois uma
+#   única consulta de teste decide se o circuito fecha de novo;
+# - o resultado traz 'error_kind', que distingue "sem linhas" de falha.
+
+SUPABASE_READ_TIMEOUT: float = float(os.getenv('SUPABASE_READ_TIMEOUT', '8'))
+SUPABASE_WRITE_TIMEOUT: float = float(os.getenv('SUPABASE_WRITE_TIMEOUT', '15'))
+SUPABASE_READ_RETRIES: int = int(os.getenv('SUPABASE_READ_RETRIES', '2'))
+SUPABASE_RETRY_BACKOFF: float = float(os.getenv('SUPABASE_RETRY_BACKOFF', '0.2'))
+SUPABASE_CB_THRESHOLD: int = int(os.getenv('SUPABASE_CB_THRESHOLD', '5'))
+SUPABASE_CB_COOLDOWN: float = float(os.getenv('SUPABASE_CB_COOLDOWN', '30'))
+
+# Tipos de erro (result['error_kind'] / SupabaseQueryError.kind)
+ERRO_TIMEOUT = 'timeout'               # requisição ou statement timeout do banco
+ERRO_INDISPONIVEL = 'indisponivel'     # rede, gateway 5xx, PostgREST sem conexão com o banco
+ERRO_CIRCUITO = 'circuito_aberto'      # não tentou: Supabase marcado como degradado
+ERRO_CONSULTA = 'consulta'             # erro da própria consulta (não adianta repetir)
+ERRO_CLIENTE = 'sem_cliente'           # cliente Supabase não inicializado
+
+# Códigos do PostgREST/Postgres que indicam falha passageira
+_CODIGOS_TIMEOUT = {'57014'}
+_CODIGOS_INDISPONIVEL = {'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003', '53300', '08000', '08001', '08006'}
+
+_falhas_capturadas: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar('supabase_falhas', default=None)
+
+
+class CircuitBreaker:
+    """Fechado -> aberto após N falhas transitórias seguidas -> meio-aberto (1 teste) após o cooldown."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.estado = 'fechado'
+        self.falhas = 0
+        self.aberto_em = 0.0
+        self.rejeitadas = 0
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == 'fechado':
+                return True
+            if self.estado == 'aberto' and time.monotonic() - self.aberto_em >= self.cooldown:
+                self.estado = 'meio-aberto'   # esta consulta é o teste
+                return True
+            self.rejeitadas += 1
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            if self.estado != 'fechado':
+                print("✅ Supabase respondeu: circuito fechado")
+            self.estado, self.falhas = 'fechado', 0
+
+    def falha(self):
+        with self._lock:
+            self.falhas += 1
+            if self.estado == 'meio-aberto' or (self.estado == 'fechado' and self.falhas >= self.threshold):
+                if self.estado == 'fechado':
+                    print(f"⛔ Supabase degradado ({self.falhas} falhas seguidas): circuito aberto "
+                          f"por {self.cooldown:.0f}s")
+                self.estado, self.aberto_em = 'aberto', time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'estado': self.estado, 'falhas_seguidas': self.falhas, 'rejeitadas': self.rejeitadas}
+
+
+circuit_breaker = CircuitBreaker(SUPABASE_CB_THRESHOLD, SUPABASE_CB_COOLDOWN)
+
+
+class _SessaoComTimeout:
+    """Repassa a sessão httpx do builder, acrescentando timeout às requisições."""
+
+    def __init__(self, session, timeout: float):
+        self._session = session
+        self._timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        return self._session.request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+def _classificar_erro(e: Exception) -> str:
+    if isinstance(e, httpx.TimeoutException):
+        return ERRO_TIMEOUT
+    if isinstance(e, httpx.TransportError):
+        return ERRO_INDISPONIVEL
+    if isinstance(e, APIError):
+        codigo = str(e.code or '')
+        if codigo in _CODIGOS_TIMEOUT:
+            return ERRO_TIMEOUT
+        if codigo in _CODIGOS_INDISPONIVEL or codigo.startswith('5'):  # 502/503/504 do gateway
+            return ERRO_INDISPONIVEL
+    return ERRO_CONSULTA
+
+
+@contextmanager
+def capture_failures():
     """
-    Executa uma query Supabase com error handling padrão.
+    Junta as falhas de safe_execute ocorridas no bloco (mesmo que o helper devolva
+    [] ou None), para que o chamador saiba que o resultado está incompleto:
+
+        with capture_failures() as falhas:
+            dados = get_lotes_alerta()
+        if falhas: ...
+    """
+    falhas: List[Dict[str, Any]] = []
+    token = _falhas_capturadas.set(falhas)
+    try:
+        yield falhas
+    finally:
+        _falhas_capturadas.reset(token)
+
+
+def record_failure(operation: str, error: str, error_kind: Optional[str]):
+    """Registra uma falha no capture_failures() ativo (se houver)."""
+    falhas = _falhas_capturadas.get()
+    if falhas is not None:
+        falhas.append({'operation': operation, 'error': error, 'error_kind': error_kind})
+
+
+def safe_execute(query, operation: str = "query", timeout: Optional[float] = None,
+                 retries: Optional[int] = None):
+    """
+    Executa uma query Supabase com timeout, retentativas (só leituras) e circuit breaker.
     
     Args:
         query: Query Supabase (ex: supabase.table('user').select('*'))
         operation: Nome da operação para logging
+        timeout: Segundos por tentativa (padrão: SUPABASE_READ_TIMEOUT / SUPABASE_WRITE_TIMEOUT)
+        retries: Retentativas em falha transitória (padrão: SUPABASE_READ_RETRIES em leituras, 0 em escritas)
     
     Returns:
-        dict com 'success', 'data', 'error'
+        dict com 'success', 'data', 'count' (com count= no select), 'error' e 'error_kind'
+        (None em caso de sucesso; ver ERRO_*). Falha nunca é devolvida como data vazia.
     """
-    try:
-        response = query.execute()
+    leitura = getattr(query, 'http_method', 'GET') in ('GET', 'HEAD')
+    if timeout is None:
+        timeout = SUPABASE_READ_TIMEOUT if leitura else SUPABASE_WRITE_TIMEOUT
+    if retries is None:
+        retries = SUPABASE_READ_RETRIES if leitura else 0
+    if timeout and hasattr(query, 'session') and not isinstance(query.session, _SessaoComTimeout):
+        query.session = _SessaoComTimeout(query.session, timeout)
+
+    tentativa = 0
+    while True:
+        if not circuit_breaker.permitir():
+            erro, kind = 'Supabase indisponível (circuito aberto)', ERRO_CIRCUITO
+            break
+        try:
+            response = query.execute()
+        except Exception as e:
+            erro, kind = str(e), _classificar_erro(e)
+            if kind == ERRO_CONSULTA:
+                circuit_breaker.sucesso()  # o servidor respondeu; o problema é a consulta
+                break
+            circuit_breaker.falha()
+            if tentativa >= retries:
+                break
+            espera = random.uniform(0, SUPABASE_RETRY_BACKOFF * (2 ** tentativa))
+            tentativa += 1
+            print(f"⚠️ {operation}: {kind} ({erro}); tentativa {tentativa + 1}/{retries + 1} em {espera:.2f}s")
+            time.sleep(espera)
+            continue
+        circuit_breaker.sucesso()
         return {
             'success': True,
             'data': response.data,
-            'error': None
-        }
-    except Exception as e:
-        print(f"❌ Erro em {operation}: {str(e)}")
-        return {
-            'success': False,
-            'data': None,
-            'error': str(e)
+            'count': response.count,
+            'error': None,
+            'error_kind': None
         }
 
+    if kind != ERRO_CIRCUITO:
+        print(f"❌ Erro em {operation}: {erro}")
+    record_failure(operation, erro, kind)
+    return {
+        'success': False,
+        'data': None,
+        'count': None,
+        'error': erro,
+        'error_kind': kind
+    }
+
+
+class SupabaseQueryError(Exception):
+    """Falha em uma consulta paginada (evita devolver resultados parciais em silêncio)."""
+
+    def __init__(self, message: str, kind: Optional[str] = None):
+        super().__init__(message)
+        self.kind = kind  # ver ERRO_*
+
+
+# ============================================================
+# IDENTITY MAP POR REQUISIÇÃO
+# ============================================================
+# Dentro de uma requisição Flask, select_one guarda cada linha lida em flask.g,
+# chaveada por (tabela, filtros, colunas). Releituras da mesma linha na mesma
+# requisição (ex.: item buscado por código e depois por id) não vão à rede.
+# Toda escrita feita pelos helpers deste módulo descarta as entradas da tabela
+# afetada (e as consultas que a embutem, ex.: 'movimentacao' com item_estoque(*)).
+# Fora de uma requisição (scripts) nada é guardado.
+
+def _request_cache() -> Optional[Dict[str, Any]]:
+    if not has_request_context():
+        return None
+    if 'supabase_identity_map' not in g:
+        g.supabase_identity_map = {'rows': {}, 'evitadas': 0, 'loaders': {}}
+    return g.supabase_identity_map
+
+
+def _cache_key(table: str, filters: Dict[str, Any], columns: str) -> tuple:
+    # str(valor): id vindo da URL ('5') e do banco (5) identificam a mesma linha
+    return (table, tuple(sorted((k, str(v)) for k, v in filters.items())), columns)
+
+
+def prime_request_cache(table: str, rows: List[Dict[str, Any]], columns: str = '*'):
+    """Registra linhas já lidas (com 'id') para que select_one(table, {'id': ...}) não vá à rede."""
+    cache = _request_cache()
+    if cache is None:
+        return
+    for row in rows:
+        if row and row.get('id') is not None:
+            cache['rows'][_cache_key(table, {'id': row['id']}, columns)] = copy.deepcopy(row)
+
+
+def invalidate_request_cache(*tables: str):
+    """Descarta as linhas guardadas das tabelas (chamado pelas escritas)."""
+    cache = _request_cache()
+    if not cache:
+        return
+    for (tabela, _), loader in cache['loaders'].items():
+        if tabela in tables:
+            loader.carregados.clear()
+    for key in list(cache['rows']):
+        tabela, _, columns = key
+        if tabela in tables or any(f'{t}(' in columns for t in tables):
+            del cache['rows'][key]
+
+
+def request_cache_stats() -> Dict[str, int]:
+    """Leituras evitadas, linhas guardadas e buscas por id agrupadas (BatchLoader) na requisição atual."""
+    cache = _request_cache()
+    if not cache:
+        return {'evitadas': 0, 'linhas': 0, 'agrupadas': 0, 'consultas_em_lote': 0}
+    loaders = cache['loaders'].values()
+    return {
+        'evitadas': cache['evitadas'],
+        'linhas': len(cache['rows']),
+        'agrupadas': sum(l.ids_carregados for l in loaders),
+        'consultas_em_lote': sum(l.consultas for l in loaders),
+    }
+
 
 def insert_one(table: str, data: Dict[str, Any]) -> Optional[Dict]:
     """
@@ -73,6 +334,7 @@ def insert_one(table: str, data: Dict[str, Any]) -> Optional[Dict]:
         Registro inserido ou None se houver erro
     """
     if not supabase: return None
+    invalidate_request_cache(table)
     result = safe_execute(
         supabase.table(table).insert(data),
         operation=f"INSERT em {table}"
@@ -80,6 +342,129 @@ def insert_one(table: str, data: Dict[str, Any]) -> Optional[Dict]:
     return result['data'][0] if result['success'] and result['data'] else None
 
 
+# Linhas por requisição nas escritas em lote (payload JSON moderado, bem abaixo dos limites do PostgREST)
+DEFAULT_BULK_CHUNK: int = int(os.getenv('SUPABASE_BULK_CHUNK', '500'))
+
+
+def _conflict_key(row: Dict[str, Any], keys: List[str]) -> tuple:
+    return tuple(str(row.get(k)) for k in keys)
+
+
+def _bulk_write(table: str, rows: List[Dict[str, Any]], build: Callable,
+                operation: str, chunk_size: int, on_conflict: str,
+                retry_rows: bool, client) -> Dict[str, Any]:
+    """
+    Núcleo de insert_many/upsert_many: envia `rows` em blocos e alinha o retorno com a entrada.
+    Um bloco com erro não interrompe os demais.
+    """
+    total = len(rows)
+    result = {
+        'success': True,
+        'data': [None] * total,   # registro gravado, na mesma ordem da entrada (None = não gravado)
+        'ids': [None] * total,
+        'count': 0,
+        'errors': []              # um item por bloco (ou linha, com retry_rows) que falhou
+    }
+    client = client or supabase
+    if not client:
+        result['success'] = False
+        result['errors'].append({'start': 0, 'end': total, 'error': 'Cliente Supabase não inicializado'})
+        return result
+    
+    invalidate_request_cache(table)
+    keys = [k.strip() for k in on_conflict.split(',')] if on_conflict else ['id']
+    chunk_size = max(1, chunk_size)
+    
+    def send(start: int, chunk: List[Dict[str, Any]]) -> tuple:
+        end = start + len(chunk)
+        response = safe_execute(build(client.table(table), chunk),
+                                operation=f"{operation} em {table} (linhas {start}-{end - 1})")
+        if not response['success']:
+            return False, response['error']
+        
+        returned = response['data'] or []
+        if len(returned) == len(chunk):
+            # PostgREST devolve as linhas na mesma ordem do payload
+            pares = zip(range(start, end), returned)
+        else:
+            # ignore_duplicates omite linhas: casa pelas chaves de conflito
+            por_chave = {_conflict_key(r, keys): r for r in returned}
+            pares = ((start + i, por_chave.get(_conflict_key(row, keys))) for i, row in enumerate(chunk))
+        
+        for pos, row in pares:
+            if row is not None:
+                result['data'][pos] = row
+                result['ids'][pos] = row.get('id')
+                result['count'] += 1
+        return True, None
+    
+    for start in range(0, total, chunk_size):
+        chunk = rows[start:start + chunk_size]
+        ok, error = send(start, chunk)
+        if ok:
+            continue
+        
+        if retry_rows and len(chunk) > 1:
+            # Isola as linhas problemáticas: as demais do bloco ainda são gravadas
+            for i, row in enumerate(chunk):
+                row_ok, row_error = send(start + i, [row])
+                if not row_ok:
+                    result['errors'].append({'start': start + i, 'end': start + i + 1, 'error': row_error})
+        else:
+            result['errors'].append({'start': start, 'end': start + len(chunk), 'error': error})
+    
+    result['success'] = not result['errors']
+    return result
+
+
+def insert_many(table: str, rows: List[Dict[str, Any]],
+                chunk_size: int = DEFAULT_BULK_CHUNK,
+                retry_rows: bool = False, client=None) -> Dict[str, Any]:
+    """
+    Insere vários registros, em blocos de `chunk_size` linhas por requisição.
+    
+    Args:
+        table: Nome da tabela
+        rows: Lista de dicionários (todos com as mesmas chaves)
+        chunk_size: Linhas por requisição
+        retry_rows: Se True, um bloco com erro é reenviado linha a linha
+                    para que só as linhas inválidas fiquem de fora
+        client: Cliente Supabase alternativo (scripts de migração)
+    
+    Returns:
+        dict com 'success', 'data' e 'ids' (alinhados com `rows`; None = falhou),
+        'count' (linhas gravadas) e 'errors' (lista de {'start', 'end', 'error'})
+    """
+    return _bulk_write(table, rows, lambda q, chunk: q.insert(chunk),
+                       operation="INSERT MANY", chunk_size=chunk_size, on_conflict='',
+                       retry_rows=retry_rows, client=client)
+
+
+def upsert_many(table: str, rows: List[Dict[str, Any]], on_conflict: str = 'id',
+                chunk_size: int = DEFAULT_BULK_CHUNK, ignore_duplicates: bool = False,
+                retry_rows: bool = False, client=None) -> Dict[str, Any]:
+    """
+    Insere ou atualiza vários registros (INSERT ... ON CONFLICT), em blocos.
+    
+    Args:
+        table: Nome da tabela
+        rows: Lista de dicionários (todos com as mesmas chaves)
+        on_conflict: Coluna(s) da restrição única, separadas por vírgula (ex.: 'codigo_produto')
+        chunk_size: Linhas por requisição
+        ignore_duplicates: Se True, linhas já existentes são mantidas (ON CONFLICT DO NOTHING)
+        retry_rows: Se True, um bloco com erro é reenviado linha a linha
+        client: Cliente Supabase alternativo
+    
+    Returns:
+        Mesmo formato de insert_many
+    """
+    return _bulk_write(table, rows,
+                       lambda q, chunk: q.upsert(chunk, on_conflict=on_conflict,
+                                                 ignore_duplicates=ignore_duplicates),
+                       operation="UPSERT MANY", chunk_size=chunk_size, on_conflict=on_conflict,
+                       retry_rows=retry_rows, client=client)
+
+
 def update_one(table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> Optional[Dict]:
     """
     Atualiza um registro em uma tabela.
@@ -93,6 +478,7 @@ def update_one(table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> Opt
         Registro atualizado ou None se houver erro
     """
     if not supabase: return None
+    invalidate_request_cache(table)
     query = supabase.table(table).update(data)
     for key, value in filters.items():
         query = query.eq(key, value)
@@ -101,6 +487,81 @@ def update_one(table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> Opt
     return result['data'][0] if result['success'] and result['data'] else None
 
 
+# Conflitos tolerados por update_cas antes de desistir, e base do backoff (segundos)
+CAS_MAX_RETRIES: int = int(os.getenv('SUPABASE_CAS_RETRIES', '8'))
+CAS_BACKOFF: float = float(os.getenv('SUPABASE_CAS_BACKOFF', '0.02'))
+
+
+class ConcurrencyError(Exception):
+    """A linha continuou sendo alterada por outros processos durante todas as tentativas de update_cas."""
+    pass
+
+
+def update_cas(table: str, row_id: Any, compute: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+               guard: Optional[List[str]] = None, current: Optional[Dict[str, Any]] = None,
+               max_retries: Optional[int] = None, client=None) -> Optional[Dict]:
+    """
+    Atualização otimista (compare-and-swap) de uma linha.
+
+    `compute(linha)` recebe a linha atual e devolve os novos valores (ou None para não
+    gravar; pode levantar exceção para abortar, ex.: saldo insuficiente). O UPDATE só
+    vale se as colunas de `guard` (padrão: as colunas alteradas) ainda tiverem os valores
+    lidos; se outra escrita chegou antes, nenhuma linha casa, a linha é relida e o cálculo
+    refeito, com backoff exponencial curto e jitter.
+
+    Args:
+        table: Nome da tabela
+        row_id: id da linha
+        compute: função linha -> valores a gravar
+        guard: colunas comparadas na gravação
+        current: linha já lida pelo chamador (poupa a primeira leitura)
+        max_retries: conflitos tolerados (padrão CAS_MAX_RETRIES)
+
+    Returns:
+        Linha gravada; a linha lida se compute devolveu None; None se a linha não existe
+
+    Raises:
+        ConcurrencyError após max_retries conflitos seguidos;
+        SupabaseQueryError se uma leitura/escrita falhar
+    """
+    client = client or supabase
+    if not client:
+        return None
+    tentativas = CAS_MAX_RETRIES if max_retries is None else max_retries
+    row = current
+
+    for tentativa in range(tentativas + 1):
+        if row is None:
+            result = safe_execute(client.table(table).select('*').eq('id', row_id).limit(1),
+                                  operation=f"SELECT (CAS) em {table}")
+            if not result['success']:
+                raise SupabaseQueryError(result['error'], result['error_kind'])
+            if not result['data']:
+                return None
+            row = result['data'][0]
+
+        valores = compute(row)
+        if valores is None:
+            return row
+
+        invalidate_request_cache(table)
+        query = client.table(table).update(valores).eq('id', row_id)
+        for coluna in (guard if guard is not None else list(valores)):
+            query = query.is_(coluna, 'null') if row.get(coluna) is None else query.eq(coluna, row[coluna])
+        result = safe_execute(query, operation=f"UPDATE (CAS) em {table}")
+        if not result['success']:
+            raise SupabaseQueryError(result['error'], result['error_kind'])
+        if result['data']:
+            return result['data'][0]
+
+        # Conflito: outra escrita mudou a linha entre a leitura e o UPDATE
+        row = None
+        if tentativa < tentativas:
+            time.sleep(random.uniform(0, CAS_BACKOFF * 2 ** tentativa))
+
+    raise ConcurrencyError(f"{table} id={row_id}: {tentativas + 1} conflitos seguidos")
+
+
 def select_one(table: str, filters: Dict[str, Any], columns: str = '*') -> Optional[Dict]:
     """
     Seleciona um único registro de uma tabela.
@@ -111,15 +572,28 @@ def select_one(table: str, filters: Dict[str, Any], columns: str = '*') -> Optio
         columns: Colunas a retornar (padrão: todas)
     
     Returns:
-        Registro encontrado ou None
+        Registro encontrado ou None (dentro de uma requisição, releituras vêm do identity map)
     """
     if not supabase: return None
+    cache = _request_cache()
+    key = _cache_key(table, filters, columns)
+    if cache is not None and key in cache['rows']:
+        cache['evitadas'] += 1
+        return copy.deepcopy(cache['rows'][key])
+
     query = supabase.table(table).select(columns)
-    for key, value in filters.items():
-        query = query.eq(key, value)
+    for coluna, value in filters.items():
+        query = query.eq(coluna, value)
     
     result = safe_execute(query.limit(1), operation=f"SELECT em {table}")
-    return result['data'][0] if result['success'] and result['data'] else None
+    if not result['success']:
+        return None  # falhas não são guardadas
+    row = result['data'][0] if result['data'] else None
+    if cache is not None:
+        cache['rows'][key] = copy.deepcopy(row)
+        if row and row.get('id') is not None:
+            cache['rows'].setdefault(_cache_key(table, {'id': row['id']}, columns), copy.deepcopy(row))
+    return row
 
 
 def select_many(table: str, filters: Optional[Dict[str, Any]] = None, 
@@ -150,11 +624,464 @@ def select_many(table: str, filters: Optional[Dict[str, Any]] = None,
         col = order_by.lstrip('-')
         query = query.order(col, desc=desc)
     
-    if limit:
+    if limit and limit <= SUPABASE_MAX_ROWS:
         query = query.limit(limit)
+        result = safe_execute(query, operation=f"SELECT MANY em {table}")
+        return result['data'] if result['success'] else []
+    
+    # Sem limite (ou acima do teto do PostgREST): pagina para não truncar em max-rows
+    try:
+        return select_all(table, filters=filters, columns=columns, order_by=order_by, limit=limit)
+    except SupabaseQueryError as e:
+        print(f"❌ Erro em SELECT MANY em {table}: {str(e)}")
+        return []
+
+
+# ============================================================
+# PAGINAÇÃO AUTOMÁTICA (streaming)
+# ============================================================
+
+def _top_level_columns(columns: str) -> List[str]:
+    """Separa a lista de colunas do select ignorando vírgulas dentro de joins (ex.: 'item_estoque(a, b)')."""
+    parts, depth, atual = [], 0, ''
+    for ch in columns:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            parts.append(atual.strip())
+            atual = ''
+        else:
+            atual += ch
+    if atual.strip():
+        parts.append(atual.strip())
+    return parts
+
+
+def _selects_id(columns: str) -> bool:
+    return any(col in ('*', 'id') for col in _top_level_columns(columns))
+
+
+def iter_chunks(table: str, filters: Optional[Dict[str, Any]] = None,
+                columns: str = '*', order_by: Optional[str] = None,
+                chunk_size: int = SUPABASE_MAX_ROWS,
+                refine: Optional[Callable] = None,
+                limit: Optional[int] = None,
+                client=None) -> Iterator[List[Dict]]:
+    """
+    Percorre uma tabela em blocos de até `chunk_size` linhas.
+    
+    Ordenando por 'id' (padrão) usa keyset (id > último id visto), que custa o
+    mesmo em qualquer profundidade. Com outra ordenação usa .range() (offset),
+    com 'id' como desempate para manter a ordem estável entre páginas.
+    
+    Args:
+        table: Nome da tabela
+        filters: Filtros de igualdade (como em select_many)
+        columns: Colunas a retornar (aceita joins, ex.: '*, item_estoque(codigo)')
+        order_by: Coluna para ordenação ('-coluna' para decrescente)
+        chunk_size: Linhas por requisição (limitado a SUPABASE_MAX_ROWS)
+        refine: Função opcional que recebe a query e aplica filtros extras (gte, or_, in_...)
+        limit: Total máximo de linhas
+        client: Cliente Supabase alternativo (scripts de migração)
+    
+    Yields:
+        Listas de registros
+    
+    Raises:
+        SupabaseQueryError se alguma página falhar
+    """
+    client = client or supabase
+    if not client: return
+    
+    chunk_size = max(1, min(chunk_size, SUPABASE_MAX_ROWS))
+    desc = bool(order_by) and order_by.startswith('-')
+    col = order_by.lstrip('-') if order_by else 'id'
+    has_id = _selects_id(columns)
+    keyset = col == 'id' and has_id
+    
+    last_id = None
+    offset = 0
+    fetched = 0
+    
+    while True:
+        size = chunk_size if limit is None else min(chunk_size, limit - fetched)
+        if size <= 0:
+            return
+        
+        query = client.table(table).select(columns)
+        if filters:
+            for key, value in filters.items():
+                query = query.eq(key, value)
+        if refine:
+            query = refine(query)
+        
+        if keyset:
+            if last_id is not None:
+                query = query.lt('id', last_id) if desc else query.gt('id', last_id)
+            query = query.order('id', desc=desc).limit(size)
+        else:
+            # 'col.desc,id.desc' / 'col,id' num único parâmetro order
+            if has_id and col != 'id':
+                query = query.order(f"{col}.desc,id" if desc else f"{col},id", desc=desc)
+            else:
+                query = query.order(col, desc=desc)
+            query = query.range(offset, offset + size - 1)
+        
+        result = safe_execute(query, operation=f"SELECT PAGINADO em {table}")
+        if not result['success']:
+            raise SupabaseQueryError(f"{table}: {result['error']}", result['error_kind'])
+        
+        rows = result['data'] or []
+        if rows:
+            yield rows
+        
+        fetched += len(rows)
+        offset += len(rows)
+        if len(rows) < size:
+            return
+        if keyset:
+            last_id = rows[-1]['id']
+
+
+def iter_rows(table: str, filters: Optional[Dict[str, Any]] = None,
+              columns: str = '*', order_by: Optional[str] = None,
+              chunk_size: int = SUPABASE_MAX_ROWS,
+              refine: Optional[Callable] = None,
+              limit: Optional[int] = None,
+              client=None) -> Iterator[Dict]:
+    """
+    Itera registro a registro, buscando em blocos (memória limitada a um bloco).
+    Mesmos argumentos de iter_chunks.
+    """
+    for chunk in iter_chunks(table, filters=filters, columns=columns, order_by=order_by,
+                             chunk_size=chunk_size, refine=refine, limit=limit, client=client):
+        yield from chunk
+
+
+def select_all(table: str, filters: Optional[Dict[str, Any]] = None,
+               columns: str = '*', order_by: Optional[str] = None,
+               chunk_size: int = SUPABASE_MAX_ROWS,
+               refine: Optional[Callable] = None,
+               limit: Optional[int] = None,
+               client=None) -> List[Dict]:
+    """
+    Seleciona TODOS os registros (sem o corte de max-rows do PostgREST).
+    Mesmos argumentos de iter_chunks.
+    
+    Raises:
+        SupabaseQueryError se alguma página falhar
+    """
+    rows: List[Dict] = []
+    for chunk in iter_chunks(table, filters=filters, columns=columns, order_by=order_by,
+                             chunk_size=chunk_size, refine=refine, limit=limit, client=client):
+        rows.extend(chunk)
+    return rows
+
+
+# ============================================================
+# PAGINAÇÃO POR CURSOR (keyset)
+# ============================================================
+# Páginas para telas: em vez de .range(offset) (que o Postgres percorre e descarta
+# linha a linha) e count='exact' a cada página, a próxima página começa logo depois
+# da última linha vista, na ordem (coluna, id). O custo é o mesmo na página 1 ou 400.
+# Os cursores são opacos para quem navega: base64 de [valor da coluna, id].
+
+# Validade (segundos) da contagem cacheada por count_rows
+SUPABASE_COUNT_TTL: int = int(os.getenv('SUPABASE_COUNT_TTL', '60'))
+
+_contagens: Dict[tuple, tuple] = {}
+_contagens_lock = threading.Lock()
+
+
+def encode_cursor(valor: Any, row_id: Any) -> str:
+    """Cursor opaco para a posição (valor, id)."""
+    texto = json.dumps([valor, row_id], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """(valor, id) do cursor, ou None se ausente/inválido (volta para a primeira página)."""
+    if not cursor:
+        return None
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        valor, row_id = json.loads(texto)
+        return (valor, row_id) if row_id is not None else None
+    except (ValueError, TypeError):
+        return None
+
+
+def _valor_filtro(valor: Any) -> str:
+    """Valor dentro de or=(...): entre aspas se tiver caracteres reservados do PostgREST."""
+    texto = str(valor)
+    if any(c in texto for c in ',.:()" '):
+        return '"' + texto.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return texto
+
+
+def _depois_do_cursor(query, col: str, valor: Any, row_id: Any, desc: bool):
+    """
+    Linhas depois de (valor, id) na ordem `col` (nulls por último no ASC e primeiro no
+    DESC, padrão do Postgres) com `id` como desempate na mesma direção.
+    """
+    op, op_id = ('lt', 'lt') if desc else ('gt', 'gt')
+    v, i = _valor_filtro(valor), _valor_filtro(row_id)
+    if valor is None:
+        if desc:
+            return query.or_(f"{col}.not.is.null,and({col}.is.null,id.{op_id}.{i})")
+        return query.is_(col, 'null').filter('id', op_id, row_id)
+    condicoes = f"{col}.{op}.{v},and({col}.eq.{v},id.{op_id}.{i})"
+    return query.or_(condicoes if desc else f"{condicoes},{col}.is.null")
+
+
+def select_page(table: str, columns: str = '*', order_by: str = 'id', size: int = 25,
+                after: Optional[str] = None, before: Optional[str] = None,
+                refine: Optional[Callable] = None, client=None) -> Dict[str, Any]:
+    """
+    Uma página por cursor, na ordem (order_by, id).
+
+    Args:
+        table: Nome da tabela
+        columns: Colunas a retornar (precisa incluir a coluna de ordenação e 'id')
+        order_by: Coluna de ordenação ('-coluna' para decrescente)
+        size: Linhas por página
+        after: Cursor next_cursor de uma página (avança)
+        before: Cursor prev_cursor de uma página (volta)
+        refine: Função opcional que recebe a query e aplica filtros extras
+        client: Cliente Supabase alternativo
+
+    Returns:
+        {'rows': [...], 'next_cursor': str|None, 'prev_cursor': str|None}
+        (cursor None = não há página naquela direção)
+
+    Raises:
+        SupabaseQueryError se a consulta falhar
+    """
+    client = client or supabase
+    if not client:
+        raise SupabaseQueryError("Cliente Supabase não inicializado", ERRO_CLIENTE)
+
+    desc = order_by.startswith('-')
+    col = order_by.lstrip('-')
+    cursor = decode_cursor(before) or decode_cursor(after)
+    voltando = cursor is not None and decode_cursor(before) is not None
+    # Voltar = avançar na ordem invertida e desinverter o resultado
+    ordem_desc = desc != voltando
+
+    query = client.table(table).select(columns)
+    if refine:
+        query = refine(query)
+    if cursor:
+        query = _depois_do_cursor(query, col, cursor[0], cursor[1], ordem_desc)
+    if ordem_desc:
+        query = query.order(f"{col}.desc.nullsfirst,id", desc=True)
+    else:
+        query = query.order(f"{col}.asc.nullslast,id")
+    # Uma linha a mais diz se existe página seguinte sem contar nada
+    query = query.limit(size + 1)
+
+    result = safe_execute(query, operation=f"SELECT PÁGINA em {table}")
+    if not result['success']:
+        raise SupabaseQueryError(f"{table}: {result['error']}", result['error_kind'])
+
+    rows = result['data'] or []
+    mais = len(rows) > size
+    rows = rows[:size]
+    if voltando:
+        rows.reverse()
+    tem_anterior = mais if voltando else cursor is not None
+    tem_proxima = True if voltando else mais
+    return {
+        'rows': rows,
+        'next_cursor': encode_cursor(rows[-1].get(col), rows[-1]['id']) if rows and tem_proxima else None,
+        'prev_cursor': encode_cursor(rows[0].get(col), rows[0]['id']) if rows and tem_anterior else None,
+    }
+
+
+def paginate_rows(rows: List[Dict[str, Any]], order_by: str = 'id', size: int = 25,
+                  after: Optional[str] = None, before: Optional[str] = None) -> Dict[str, Any]:
+    """
+    select_page sobre uma lista já carregada e ordenada (mesmos cursores e retorno).
+    Para caminhos de contingência que filtram em Python.
+    """
+    col = order_by.lstrip('-')
+    ids = [r['id'] for r in rows]
+    voltando = decode_cursor(before) is not None
+    cursor = decode_cursor(before) or decode_cursor(after)
+    pos = ids.index(cursor[1]) if cursor is not None and cursor[1] in ids else None
+    if voltando and pos is not None:
+        inicio = max(0, pos - size)
+        pagina, tem_proxima = rows[inicio:pos], True
+    else:
+        inicio = pos + 1 if pos is not None else 0
+        pagina = rows[inicio:inicio + size]
+        tem_proxima = inicio + size < len(rows)
+    return {
+        'rows': pagina,
+        'next_cursor': encode_cursor(pagina[-1].get(col), pagina[-1]['id']) if pagina and tem_proxima else None,
+        'prev_cursor': encode_cursor(pagina[0].get(col), pagina[0]['id']) if pagina and inicio > 0 else None,
+    }
+
+
+def count_rows(table: str, refine: Optional[Callable] = None, method: str = 'planned',
+               cache_key: Any = None, client=None) -> Optional[int]:
+    """
+    Total de linhas (opcional nas telas), cacheado por SUPABASE_COUNT_TTL segundos.
+
+    method: 'exact' (conta tudo), 'planned' (estimativa do planner, barata),
+    'estimated' (exata até o limite de max-rows, estimada acima) ou 'none'.
+    Retorna None se a contagem estiver desligada ou falhar.
+    """
+    client = client or supabase
+    if not client or method == 'none':
+        return None
+    chave = (table, method, cache_key)
+    agora = time.monotonic()
+    with _contagens_lock:
+        cache = _contagens.get(chave)
+        if cache and agora - cache[1] < SUPABASE_COUNT_TTL:
+            return cache[0]
+
+    query = client.table(table).select('id', count=method)
+    if refine:
+        query = refine(query)
+    result = safe_execute(query.limit(1), operation=f"COUNT ({method}) em {table}")
+    if not result['success']:
+        return None
+    total = result['count']
+    with _contagens_lock:
+        _contagens[chave] = (total, agora)
+    return total
+
+
+# Valores por filtro IN (mantém a URL da requisição em tamanho seguro)
+SUPABASE_IN_BATCH: int = int(os.getenv('SUPABASE_IN_BATCH', '200'))
+
+
+def select_in(table: str, column: str, values: List[Any],
+              columns: str = '*', filters: Optional[Dict[str, Any]] = None,
+              batch_size: int = SUPABASE_IN_BATCH,
+              client=None) -> List[Dict]:
+    """
+    Seleciona os registros cujo `column` está em `values` (WHERE column IN (...)).
+    Os valores são deduplicados e enviados em lotes; cada lote é paginado por select_all.
     
-    result = safe_execute(query, operation=f"SELECT MANY em {table}")
-    return result['data'] if result['success'] else []
+    Raises:
+        SupabaseQueryError se alguma página falhar
+    """
+    unicos = list(dict.fromkeys(v for v in values if v is not None))
+    rows: List[Dict] = []
+    for start in range(0, len(unicos), max(1, batch_size)):
+        lote = unicos[start:start + batch_size]
+        rows.extend(select_all(table, filters=filters, columns=columns, order_by='id',
+                               refine=lambda q, lote=lote: q.in_(column, lote), client=client))
+    return rows
+
+
+# ============================================================
+# CARREGAMENTO EM LOTE POR ID (DataLoader)
+# ============================================================
+# Buscas por id pedidas na mesma requisição são acumuladas e resolvidas com uma
+# única consulta IN. Quem sabe de antemão quais ids vai precisar (ex.: os modelos
+# com relações não embutidas na consulta) chama enqueue(); o primeiro load()
+# resolve todos os pendentes de uma vez. As linhas carregadas também entram no
+# identity map, e as escritas na tabela descartam o que foi carregado.
+
+class BatchLoader:
+    """Acumula ids de uma tabela e os resolve em lote com select_in."""
+
+    def __init__(self, table: str, columns: str = '*'):
+        self.table = table
+        self.columns = columns
+        self.pendentes: Dict[str, Any] = {}                 # str(id) -> id
+        self.carregados: Dict[str, Optional[Dict]] = {}     # str(id) -> linha (None = não existe)
+        self.ids_carregados = 0
+        self.consultas = 0
+
+    def enqueue(self, row_id: Any):
+        """Marca um id para a próxima carga (sem consultar agora)."""
+        if row_id is not None and str(row_id) not in self.carregados:
+            self.pendentes[str(row_id)] = row_id
+
+    def dispatch(self):
+        """Resolve todos os ids pendentes (uma consulta IN por SUPABASE_IN_BATCH ids)."""
+        if not self.pendentes:
+            return
+        pendentes, self.pendentes = self.pendentes, {}
+
+        cache = _request_cache()
+        faltando = []
+        for key, row_id in pendentes.items():
+            cache_key = _cache_key(self.table, {'id': key}, self.columns)
+            if cache is not None and cache_key in cache['rows']:
+                self.carregados[key] = cache['rows'][cache_key]
+            else:
+                faltando.append(row_id)
+        if not faltando:
+            return
+
+        try:
+            rows = select_in(self.table, 'id', faltando, columns=self.columns)
+        except SupabaseQueryError as e:
+            print(f"❌ Erro na carga em lote de {self.table}: {e}")
+            return  # nada é marcado como carregado; load() devolve None
+        self.consultas += (len(faltando) + SUPABASE_IN_BATCH - 1) // SUPABASE_IN_BATCH
+        self.ids_carregados += len(faltando)
+
+        encontrados = {str(r['id']): r for r in rows}
+        for row_id in faltando:
+            self.carregados[str(row_id)] = encontrados.get(str(row_id))
+        prime_request_cache(self.table, rows, self.columns)
+
+    def load(self, row_id: Any) -> Optional[Dict]:
+        """Linha com o id dado; resolve junto todos os ids pendentes."""
+        if row_id is None:
+            return None
+        self.enqueue(row_id)
+        self.dispatch()
+        row = self.carregados.get(str(row_id))
+        return copy.deepcopy(row) if row else None
+
+    def load_many(self, ids: List[Any]) -> Dict[Any, Optional[Dict]]:
+        """{id: linha ou None} para todos os ids, em uma só carga."""
+        for row_id in ids:
+            self.enqueue(row_id)
+        self.dispatch()
+        return {row_id: copy.deepcopy(self.carregados.get(str(row_id))) for row_id in ids}
+
+
+def batch_loader(table: str, columns: str = '*') -> Optional[BatchLoader]:
+    """Loader da requisição atual para a tabela (None fora de uma requisição)."""
+    cache = _request_cache()
+    if cache is None:
+        return None
+    chave = (table, columns)
+    if chave not in cache['loaders']:
+        cache['loaders'][chave] = BatchLoader(table, columns)
+    return cache['loaders'][chave]
+
+
+def load_by_id(table: str, row_id: Any, columns: str = '*') -> Optional[Dict]:
+    """select_one por id, agrupado com as demais buscas pendentes da requisição."""
+    loader = batch_loader(table, columns)
+    if loader is None:
+        return select_one(table, {'id': row_id}, columns)
+    return loader.load(row_id)
+
+
+def load_many_by_id(table: str, ids: List[Any], columns: str = '*') -> Dict[Any, Optional[Dict]]:
+    """{id: linha ou None} com uma consulta IN (também fora de requisições)."""
+    loader = batch_loader(table, columns) or BatchLoader(table, columns)
+    return loader.load_many(ids)
+
+
+def enqueue_load(table: str, row_id: Any, columns: str = '*'):
+    """Anuncia que a linha será necessária (resolvida junto com o próximo load da tabela)."""
+    loader = batch_loader(table, columns)
+    if loader is not None:
+        loader.enqueue(row_id)
 
 
 def delete_one(table: str, filters: Dict[str, Any]) -> bool:
@@ -169,6 +1096,7 @@ def delete_one(table: str, filters: Dict[str, Any]) -> bool:
         True se deletado com sucesso
     """
     if not supabase: return False
+    invalidate_request_cache(table)
     query = supabase.table(table).delete()
     for key, value in filters.items():
         query = query.eq(key, value)
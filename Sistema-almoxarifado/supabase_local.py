@@ -0,0 +1,653 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Supabase Local - Substituto do cliente Supabase sobre SQLite (benchmark e testes offline)
+Ativado por SUPABASE_LOCAL_DB=caminho/do/banco.db (ex.: o database_novo.db do repositório);
+supabase_client.py então expõe este cliente no lugar do real.
+
+Os construtores de consulta são os do próprio postgrest-py: select, eq/neq/gt/gte/lt/lte,
+like/ilike, or_, in_, is_, order, range, limit, count='exact', insert/upsert/update/delete
+e rpc montam a MESMA requisição HTTP que vai para o Supabase. Só o transporte muda: em vez
+da rede, SQLiteTransport interpreta a requisição PostgREST e responde a partir do SQLite
+(mesmo corpo JSON, Content-Range e erros no formato do PostgREST). Por isso safe_execute,
+timeouts, retentativas e a instrumentação de desempenho.py funcionam sem alteração.
+
+Suportado além dos filtros: recursos embutidos por chave estrangeira ('*, item_estoque(codigo)',
+muitos-para-um e um-para-muitos, '!inner'), limite de linhas por resposta (SUPABASE_MAX_ROWS)
+e as funções de registrar_movimentacao (mesma lógica SQLite de movimentacoes.py).
+
+Diferenças conhecidas do Postgres real:
+- colunas que existem só no Supabase (ex.: status_etiqueta) são criadas vazias no SQLite
+  na primeira vez que uma consulta as usa;
+- datas são texto: valores ISO com 'T' são gravados e comparados no formato do SQLite
+  ('AAAA-MM-DD HH:MM:SS');
+- colunas mantidas por trigger no Supabase (COLUNAS_CALCULADAS, ex.: movimentacao.busca
+  de sql/movimentacao_busca.sql) são calculadas na própria consulta, sem índice;
+- tabelas mantidas por trigger (TABELAS_LOCAIS, ex.: movimentacao_diaria) são criadas no
+  SQLite, com triggers equivalentes e carga inicial, na primeira vez que são usadas.
+
+Latência simulada (por requisição): SUPABASE_LOCAL_LATENCIA_MS + até SUPABASE_LOCAL_JITTER_MS
+aleatórios; ajustável em tempo de execução com client.set_latency(ms, jitter_ms).
+"""
+
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+
+SUPABASE_LOCAL_LATENCIA_MS: float = float(os.getenv('SUPABASE_LOCAL_LATENCIA_MS', '0'))
+SUPABASE_LOCAL_JITTER_MS: float = float(os.getenv('SUPABASE_LOCAL_JITTER_MS', '0'))
+# Mesmo limite "max-rows" do PostgREST que supabase_client considera
+SUPABASE_MAX_ROWS: int = int(os.getenv('SUPABASE_MAX_ROWS', '1000'))
+
+BASE_URL = 'http://supabase.local/rest/v1'
+
+# Parâmetros da URL que não são filtros
+_RESERVADOS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+_OPERADORES = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+# Colunas com DEFAULT now() no Supabase
+_COLUNAS_DATA_PADRAO = {'data_movimentacao', 'data_entrada', 'data_cadastro', 'created_at'}
+# Colunas NOT NULL que o Supabase preenche por DEFAULT e o SQLite local não
+# (mesmos valores que migrate_to_supabase usa quando a coluna vem vazia)
+_COLUNAS_PADRAO = {
+    'item_estoque': {'qtd_estoque': 0, 'estoque_minimo': 5},
+    'estoque_detalhe': {'quantidade': 0},
+    'consumivel_estoque': {'quantidade_atual': 0},
+}
+# Mensagem de sqlite3.IntegrityError -> (status HTTP, SQLSTATE) que o PostgREST devolveria
+_ERROS_INTEGRIDADE = (
+    ('NOT NULL constraint failed', 400, '23502'),
+    ('FOREIGN KEY constraint failed', 409, '23503'),
+    ('UNIQUE constraint failed', 409, '23505'),
+    ('PRIMARY KEY', 409, '23505'),
+    ('CHECK constraint failed', 400, '23514'),
+)
+# Colunas que o Supabase mantém por trigger: expressão SQLite equivalente
+COLUNAS_CALCULADAS = {
+    'movimentacao': {
+        'busca': '(SELECT normalizar_busca(i."codigo", i."descricao", "movimentacao"."lote", '
+                 '"movimentacao"."usuario", "movimentacao"."observacao") '
+                 'FROM "item_estoque" i WHERE i."id" = "movimentacao"."item_id")',
+    },
+}
+# Tabelas que o Supabase mantém por trigger: DDL SQLite equivalente (ver _criar_tabela_local)
+_DIARIA_CHAVE = 'item_id = {0}.item_id AND dia = date({0}.data_movimentacao) AND tipo = coalesce({0}.tipo, \'\')'
+_DIARIA_SOMAR = (
+    'INSERT INTO "movimentacao_diaria" (item_id, dia, tipo, quantidade, movimentacoes) '
+    'VALUES (NEW.item_id, date(NEW.data_movimentacao), coalesce(NEW.tipo, \'\'), coalesce(NEW.quantidade, 0), 1) '
+    'ON CONFLICT (item_id, dia, tipo) DO UPDATE SET quantidade = quantidade + excluded.quantidade, '
+    'movimentacoes = movimentacoes + 1;'
+)
+_DIARIA_ESTORNAR = (
+    'UPDATE "movimentacao_diaria" SET quantidade = quantidade - coalesce(OLD.quantidade, 0), '
+    f'movimentacoes = movimentacoes - 1 WHERE {_DIARIA_CHAVE.format("OLD")}; '
+    f'DELETE FROM "movimentacao_diaria" WHERE {_DIARIA_CHAVE.format("OLD")} AND movimentacoes <= 0;'
+)
+_DIARIA_NOVA = 'NEW.item_id IS NOT NULL AND NEW.data_movimentacao IS NOT NULL'
+_DIARIA_ANTIGA = 'OLD.item_id IS NOT NULL AND OLD.data_movimentacao IS NOT NULL'
+_DIARIA_RECONSTRUIR = (
+    'INSERT INTO "movimentacao_diaria" (item_id, dia, tipo, quantidade, movimentacoes) '
+    'SELECT item_id, date(data_movimentacao), coalesce(tipo, \'\'), coalesce(SUM(quantidade), 0), COUNT(*) '
+    'FROM "movimentacao" WHERE item_id IS NOT NULL AND data_movimentacao IS NOT NULL '
+    'GROUP BY item_id, date(data_movimentacao), coalesce(tipo, \'\')'
+)
+TABELAS_LOCAIS = {
+    # sql/movimentacao_diaria.sql
+    'movimentacao_diaria': {
+        'ddl': [
+            'CREATE TABLE IF NOT EXISTS "movimentacao_diaria" (item_id INTEGER NOT NULL, dia TEXT NOT NULL, '
+            'tipo TEXT NOT NULL, quantidade REAL NOT NULL DEFAULT 0, movimentacoes INTEGER NOT NULL DEFAULT 0, '
+            'PRIMARY KEY (item_id, dia, tipo))',
+            'CREATE INDEX IF NOT EXISTS "movimentacao_diaria_dia_idx" ON "movimentacao_diaria" (dia)',
+            f'CREATE TRIGGER IF NOT EXISTS "movimentacao_diaria_ins" AFTER INSERT ON "movimentacao" '
+            f'WHEN {_DIARIA_NOVA} BEGIN {_DIARIA_SOMAR} END',
+            f'CREATE TRIGGER IF NOT EXISTS "movimentacao_diaria_del" AFTER DELETE ON "movimentacao" '
+            f'WHEN {_DIARIA_ANTIGA} BEGIN {_DIARIA_ESTORNAR} END',
+            f'CREATE TRIGGER IF NOT EXISTS "movimentacao_diaria_upd_old" AFTER UPDATE OF item_id, '
+            f'data_movimentacao, tipo, quantidade ON "movimentacao" WHEN {_DIARIA_ANTIGA} BEGIN {_DIARIA_ESTORNAR} END',
+            f'CREATE TRIGGER IF NOT EXISTS "movimentacao_diaria_upd_new" AFTER UPDATE OF item_id, '
+            f'data_movimentacao, tipo, quantidade ON "movimentacao" WHEN {_DIARIA_NOVA} BEGIN {_DIARIA_SOMAR} END',
+        ],
+        'carga': _DIARIA_RECONSTRUIR,
+    },
+}
+_ISO_DATA_HORA = re.compile(r'^\d{4}-\d{2}-\d{2}T\d')
+_SQLITE_DATA_HORA = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}')
+_LOTE_IN = 500
+
+
+class ErroPostgrest(Exception):
+    """Erro devolvido no formato do PostgREST (vira APIError no postgrest-py)."""
+
+    def __init__(self, status: int, code: str, message: str, details: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.corpo = {'code': code, 'message': message, 'details': details, 'hint': None}
+
+
+# ============================================================
+# PARSE DA SINTAXE DO POSTGREST
+# ============================================================
+
+def _dividir(texto: str) -> List[str]:
+    """Divide por vírgulas de primeiro nível (fora de parênteses e aspas)."""
+    partes, atual, nivel, aspas = [], [], 0, False
+    for c in texto:
+        if c == '"':
+            aspas = not aspas
+        elif not aspas and c == '(':
+            nivel += 1
+        elif not aspas and c == ')':
+            nivel -= 1
+        elif not aspas and nivel == 0 and c == ',':
+            partes.append(''.join(atual).strip())
+            atual = []
+            continue
+        atual.append(c)
+    if ''.join(atual).strip():
+        partes.append(''.join(atual).strip())
+    return partes
+
+
+def _sem_aspas(valor: str) -> str:
+    if len(valor) >= 2 and valor[0] == valor[-1] == '"':
+        return valor[1:-1]
+    return valor
+
+
+def _parse_select(texto: str) -> Tuple[List[Tuple[str, str]], List[Dict[str, Any]]]:
+    """'*, a, b:c, rel!inner(x, y)' -> ([(alias, coluna)], [recursos embutidos])."""
+    colunas, embutidos = [], []
+    for parte in _dividir(texto or '*'):
+        if '(' in parte and parte.endswith(')'):
+            cabeca, sub = parte[:-1].split('(', 1)
+            alias, _, nome = cabeca.rpartition(':')
+            nome, *dicas = nome.split('!')
+            embutidos.append({'alias': alias or nome, 'tabela': nome, 'select': sub,
+                              'inner': 'inner' in dicas,
+                              'fk': next((d for d in dicas if d not in ('inner', 'left')), None)})
+        else:
+            parte = parte.split('::')[0]
+            alias, _, coluna = parte.rpartition(':')
+            colunas.append((alias or coluna, coluna))
+    return colunas, embutidos
+
+
+def _valor(valor: str) -> Any:
+    """Texto da URL -> valor para o SQLite (booleanos como 0/1, datas ISO no formato do SQLite)."""
+    valor = _sem_aspas(valor)
+    if valor in ('true', 'false'):
+        return 1 if valor == 'true' else 0
+    if _ISO_DATA_HORA.match(valor):
+        return valor.replace('T', ' ', 1)
+    return valor
+
+
+def _valor_gravado(valor: Any) -> Any:
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    if isinstance(valor, str) and _ISO_DATA_HORA.match(valor):
+        return valor.replace('T', ' ', 1)
+    return valor
+
+
+def _saida_json(valor: Any) -> Any:
+    """Timestamps como o PostgREST os devolve ('2025-01-30T10:00:00', não o formato do SQLite)."""
+    if isinstance(valor, list):
+        return [_saida_json(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: _saida_json(v) for k, v in valor.items()}
+    if isinstance(valor, str) and _SQLITE_DATA_HORA.match(valor):
+        return valor.replace(' ', 'T', 1)
+    return valor
+
+
+def _normalizar_busca(*campos: Any) -> str:
+    """public.normalizar_busca(concat_ws(' | ', ...)): sem acentos, maiúsculo, espaços simples."""
+    texto = ' | '.join(str(c) for c in campos if c is not None)
+    texto = unicodedata.normalize('NFKD', texto.replace('º', '').replace('°', '').replace('ª', ''))
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch))
+    return ' '.join(texto.upper().split())
+
+
+def _like(valor: Any, padrao: Any, sem_caixa: int) -> Optional[int]:
+    """LIKE/ILIKE do Postgres ('*' também é curinga na URL do PostgREST; '\\' escapa)."""
+    if valor is None or padrao is None:
+        return None
+    partes, escapado = [], False
+    for c in str(padrao):
+        if escapado:
+            partes.append(re.escape(c))
+            escapado = False
+        elif c == '\\':
+            escapado = True
+        else:
+            partes.append('.*' if c in '%*' else '.' if c == '_' else re.escape(c))
+    regex = ''.join(partes)
+    flags = re.DOTALL | (re.IGNORECASE if sem_caixa else 0)
+    return 1 if re.fullmatch(regex, str(valor), flags) else 0
+
+
+# ============================================================
+# BANCO (interpreta as requisições PostgREST no SQLite)
+# ============================================================
+
+class BancoLocal:
+    """Uma conexão SQLite por thread; cada requisição é uma transação, como no PostgREST."""
+
+    def __init__(self, caminho: str):
+        if not os.path.exists(caminho):
+            raise FileNotFoundError(f"Banco SQLite não encontrado: {caminho}")
+        self.caminho = caminho
+        self.rpcs: Dict[str, Callable] = {}
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._colunas: Dict[str, List[str]] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.create_function('pg_like', 3, _like, deterministic=True)
+            conn.create_function('normalizar_busca', -1, _normalizar_busca, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    # ---------------- esquema ----------------
+
+    def colunas(self, tabela: str) -> List[str]:
+        with self._lock:
+            if tabela not in self._colunas:
+                info = self._conn().execute(f'PRAGMA table_info("{tabela}")').fetchall()
+                if not info and tabela in TABELAS_LOCAIS:
+                    self._transacao(lambda conn: _criar_tabela_local(conn, tabela))
+                    info = self._conn().execute(f'PRAGMA table_info("{tabela}")').fetchall()
+                if not info:
+                    raise ErroPostgrest(404, '42P01', f'relation "public.{tabela}" does not exist')
+                self._colunas[tabela] = [r['name'] for r in info]
+            return self._colunas[tabela]
+
+    def coluna(self, tabela: str, coluna: str) -> str:
+        """Nome da coluna entre aspas; cria a coluna se ela só existe no Supabase."""
+        calculada = COLUNAS_CALCULADAS.get(tabela, {}).get(coluna)
+        if calculada:
+            return calculada
+        if coluna not in self.colunas(tabela):
+            if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', coluna):
+                raise ErroPostgrest(400, '42703', f'column {tabela}.{coluna} does not exist')
+            with self._lock:
+                if coluna not in self.colunas(tabela):
+                    self._conn().execute(f'ALTER TABLE "{tabela}" ADD COLUMN "{coluna}"')
+                    self._colunas[tabela].append(coluna)
+                    print(f"🧩 Supabase local: coluna {tabela}.{coluna} criada (existe só no Supabase)")
+        return f'"{coluna}"'
+
+    def _relacao(self, tabela: str, embutido: Dict[str, Any]) -> Tuple[str, str, str, bool]:
+        """(coluna local, coluna remota, tabela remota, muitos) a partir das chaves estrangeiras."""
+        alvo = embutido['tabela']
+        self.colunas(alvo)
+        conn = self._conn()
+        for fk in conn.execute(f'PRAGMA foreign_key_list("{tabela}")').fetchall():
+            if fk['table'] == alvo and embutido['fk'] in (None, fk['from']):
+                return fk['from'], fk['to'] or 'id', alvo, False
+        for fk in conn.execute(f'PRAGMA foreign_key_list("{alvo}")').fetchall():
+            if fk['table'] == tabela and embutido['fk'] in (None, fk['from']):
+                return fk['to'] or 'id', fk['from'], alvo, True
+        raise ErroPostgrest(400, 'PGRST200', f"Could not find a relationship between '{tabela}' and '{alvo}'")
+
+    # ---------------- filtros ----------------
+
+    def _condicao(self, tabela: str, coluna: str, expr: str, args: List[Any]) -> str:
+        if '.' in coluna:
+            raise ErroPostgrest(400, 'PGRST100', f'filtro em recurso embutido não suportado localmente: {coluna}')
+        negar = expr.startswith('not.')
+        if negar:
+            expr = expr[4:]
+        op, _, valor = expr.partition('.')
+        col = self.coluna(tabela, coluna)
+        if op in _OPERADORES:
+            sql = f'{col} {_OPERADORES[op]} ?'
+            args.append(_valor(valor))
+        elif op in ('like', 'ilike'):
+            sql = f'pg_like({col}, ?, {int(op == "ilike")})'
+            args.append(_sem_aspas(valor))
+        elif op == 'is':
+            if valor == 'null':
+                sql = f'{col} IS NULL'
+            elif valor in ('true', 'false'):
+                sql = f'{col} = {int(valor == "true")}'
+            else:
+                raise ErroPostgrest(400, 'PGRST100', f'valor inválido para is: {valor}')
+        elif op == 'in':
+            valores = [_valor(v) for v in _dividir(valor.strip()[1:-1])]
+            args.extend(valores)
+            sql = f'{col} IN ({", ".join("?" for _ in valores)})' if valores else '0'
+        else:
+            raise ErroPostgrest(400, 'PGRST100', f'operador não suportado localmente: {op}')
+        return f'NOT ({sql})' if negar else sql
+
+    def _logica(self, tabela: str, operador: str, texto: str, args: List[Any]) -> str:
+        """or=(a.eq.1,b.is.null,and(c.gt.1,d.lt.2))"""
+        partes = []
+        for item in _dividir(texto.strip()[1:-1]):
+            negar = item.startswith('not.')
+            if negar:
+                item = item[4:]
+            if item.startswith(('and(', 'or(')):
+                sub, resto = item.split('(', 1)
+                sql = self._logica(tabela, sub, '(' + resto, args)
+                partes.append(f'NOT ({sql})' if negar else sql)
+            else:
+                coluna, _, expr = item.partition('.')
+                partes.append(self._condicao(tabela, coluna, ('not.' if negar else '') + expr, args))
+        return '(' + f' {operador.upper()} '.join(partes or ['1']) + ')'
+
+    def _where(self, tabela: str, params: List[Tuple[str, str]]) -> Tuple[str, List[Any]]:
+        condicoes, args = [], []
+        for chave, valor in params:
+            if chave in _RESERVADOS:
+                continue
+            if chave in ('or', 'and', 'not.or', 'not.and'):
+                sql = self._logica(tabela, chave.split('.')[-1], valor, args)
+                condicoes.append(f'NOT {sql}' if chave.startswith('not.') else sql)
+            else:
+                condicoes.append(self._condicao(tabela, chave, valor, args))
+        return (' WHERE ' + ' AND '.join(condicoes)) if condicoes else '', args
+
+    def _order(self, tabela: str, texto: Optional[str]) -> str:
+        if not texto:
+            return ''
+        termos = []
+        for parte in _dividir(texto):
+            coluna, *mods = parte.split('.')
+            desc = 'desc' in mods
+            nulos = 'FIRST' if 'nullsfirst' in mods else 'LAST' if 'nullslast' in mods else ('FIRST' if desc else 'LAST')
+            termos.append(f'{self.coluna(tabela, coluna)} {"DESC" if desc else "ASC"} NULLS {nulos}')
+        return ' ORDER BY ' + ', '.join(termos)
+
+    # ---------------- leitura ----------------
+
+    def _projetar(self, tabela: str, linhas: List[Dict[str, Any]], select: str) -> List[Dict[str, Any]]:
+        colunas, embutidos = _parse_select(select)
+        saida = []
+        for linha in linhas:
+            nova = {}
+            for alias, coluna in colunas:
+                if coluna == '*':
+                    nova.update(linha)
+                else:
+                    self.coluna(tabela, coluna)
+                    nova[alias] = linha.get(coluna)
+            saida.append(nova)
+        for embutido in embutidos:
+            local, remota, alvo, muitos = self._relacao(tabela, embutido)
+            chaves = list({l[local] for l in linhas if l.get(local) is not None})
+            relacionadas: Dict[Any, List[Dict[str, Any]]] = {}
+            for i in range(0, len(chaves), _LOTE_IN):
+                lote = chaves[i:i + _LOTE_IN]
+                rows = self._conn().execute(
+                    f'SELECT * FROM "{alvo}" WHERE "{remota}" IN ({", ".join("?" for _ in lote)}) ORDER BY "id"',
+                    lote).fetchall()
+                rows = [dict(r) for r in rows]
+                for linha, projetada in zip(rows, self._projetar(alvo, rows, embutido['select'])):
+                    relacionadas.setdefault(linha[remota], []).append(projetada)
+            for linha, nova in zip(linhas, saida):
+                achadas = relacionadas.get(linha.get(local), [])
+                nova[embutido['alias']] = achadas if muitos else (achadas[0] if achadas else None)
+        if any(e['inner'] for e in embutidos):
+            saida = [n for n in saida if all(n[e['alias']] for e in embutidos if e['inner'])]
+        return saida
+
+    def select(self, tabela: str, params: List[Tuple[str, str]], contar: bool) -> Tuple[List[Dict], Optional[int], int]:
+        self.colunas(tabela)
+        p = dict(params)
+        where, args = self._where(tabela, params)
+        conn = self._conn()
+        total = conn.execute(f'SELECT COUNT(*) FROM "{tabela}"{where}', args).fetchone()[0] if contar else None
+        if p.get('select', '').replace(' ', '') == 'count':
+            if total is None:
+                total = conn.execute(f'SELECT COUNT(*) FROM "{tabela}"{where}', args).fetchone()[0]
+            return [{'count': total}], total, 0
+        offset = int(p.get('offset', 0))
+        limit = min(int(p['limit']), SUPABASE_MAX_ROWS) if 'limit' in p else SUPABASE_MAX_ROWS
+        sql = f'SELECT * FROM "{tabela}"{where}{self._order(tabela, p.get("order"))} LIMIT ? OFFSET ?'
+        linhas = [dict(r) for r in conn.execute(sql, [*args, limit, offset]).fetchall()]
+        return self._projetar(tabela, linhas, p.get('select', '*')), total, offset
+
+    # ---------------- escrita ----------------
+
+    def _transacao(self, operacao: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = operacao(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return resultado
+
+    def insert(self, tabela: str, params: List[Tuple[str, str]], corpo: Any, prefer: str) -> List[Dict]:
+        linhas = corpo if isinstance(corpo, list) else [corpo]
+        p = dict(params)
+        conflito = None
+        if 'resolution=' in prefer:
+            chaves = ', '.join(self.coluna(tabela, c.strip()) for c in p.get('on_conflict', 'id').split(','))
+            conflito = (chaves, 'ignore-duplicates' in prefer)
+        agora = str(datetime.now())
+
+        def gravar(conn):
+            gravadas = []
+            for linha in linhas:
+                valores = {c: _valor_gravado(v) for c, v in linha.items()}
+                enviadas = [self.coluna(tabela, c) for c in valores]
+                for c in _COLUNAS_DATA_PADRAO & set(self.colunas(tabela)) - set(valores):
+                    valores[c] = agora
+                for c, padrao in _COLUNAS_PADRAO.get(tabela, {}).items():
+                    valores.setdefault(c, padrao)
+                colunas = [self.coluna(tabela, c) for c in valores]
+                sql = f'INSERT INTO "{tabela}" ({", ".join(colunas)}) VALUES ({", ".join("?" for _ in colunas)})'
+                if conflito:
+                    # como no PostgREST: o UPDATE só mexe nas colunas enviadas
+                    chaves, ignorar = conflito
+                    atualizar = [c for c in enviadas if c not in chaves.split(', ')]
+                    acao = 'NOTHING' if ignorar or not atualizar else \
+                        'UPDATE SET ' + ', '.join(f'{c} = excluded.{c}' for c in atualizar)
+                    sql += f' ON CONFLICT ({chaves}) DO {acao}'
+                gravadas.extend(dict(r) for r in conn.execute(sql + ' RETURNING *', list(valores.values())))
+            return gravadas
+
+        return self._transacao(gravar)
+
+    def update(self, tabela: str, params: List[Tuple[str, str]], corpo: Dict[str, Any]) -> List[Dict]:
+        where, args = self._where(tabela, params)
+        sets = [f'{self.coluna(tabela, c)} = ?' for c in corpo]
+        valores = [_valor_gravado(v) for v in corpo.values()]
+        sql = f'UPDATE "{tabela}" SET {", ".join(sets)}{where} RETURNING *'
+        return self._transacao(lambda conn: [dict(r) for r in conn.execute(sql, [*valores, *args])])
+
+    def delete(self, tabela: str, params: List[Tuple[str, str]]) -> List[Dict]:
+        where, args = self._where(tabela, params)
+        sql = f'DELETE FROM "{tabela}"{where} RETURNING *'
+        return self._transacao(lambda conn: [dict(r) for r in conn.execute(sql, args)])
+
+    # ---------------- rpc ----------------
+
+    def rpc(self, funcao: str, corpo: Dict[str, Any]) -> Any:
+        operacao = self.rpcs.get(funcao) or _rpcs_padrao().get(funcao)
+        if operacao is None:
+            raise ErroPostgrest(404, 'PGRST202', f'Could not find the function public.{funcao} in the schema cache')
+        return self._transacao(lambda conn: operacao(conn, **(corpo or {})))
+
+
+def _criar_tabela_local(conn: sqlite3.Connection, tabela: str, carga: bool = True) -> bool:
+    """Cria uma tabela de TABELAS_LOCAIS (com triggers) se faltar; True se foi criada."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)).fetchone():
+        return False
+    definicao = TABELAS_LOCAIS[tabela]
+    for comando in definicao['ddl']:
+        conn.execute(comando)
+    if carga:
+        conn.execute(definicao['carga'])
+    print(f"🧩 Supabase local: tabela {tabela} criada com triggers (existe só no Supabase)")
+    return True
+
+
+def _reconstruir_movimentacao_diaria(conn: sqlite3.Connection) -> int:
+    """public.reconstruir_movimentacao_diaria (sql/movimentacao_diaria.sql)."""
+    _criar_tabela_local(conn, 'movimentacao_diaria', carga=False)
+    conn.execute('DELETE FROM "movimentacao_diaria"')
+    return conn.execute(TABELAS_LOCAIS['movimentacao_diaria']['carga']).rowcount
+
+
+def _contar_movimentacoes_por_tipo(conn: sqlite3.Connection, p_inicio: Optional[str] = None,
+                                   p_fim: Optional[str] = None,
+                                   p_termos: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """public.contar_movimentacoes_por_tipo (sql/movimentacao_contagem_tipo.sql)."""
+    where, args = [], []
+    if p_inicio:
+        where.append('"data_movimentacao" >= ?')
+        args.append(_valor_gravado(p_inicio))
+    if p_fim:
+        where.append('"data_movimentacao" <= ?')
+        args.append(_valor_gravado(p_fim))
+    for termo in p_termos or []:
+        where.append(f"pg_like({COLUNAS_CALCULADAS['movimentacao']['busca']}, ?, 1)")
+        args.append(f'%{termo}%')
+    sql = 'SELECT "tipo", COUNT(*) AS "total" FROM "movimentacao"'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return [dict(r) for r in conn.execute(sql + ' GROUP BY "tipo"', args)]
+
+
+def _rpcs_padrao() -> Dict[str, Callable]:
+    """Equivalentes locais das funções SQL instaladas no Supabase (sql/*.sql)."""
+    # Import tardio: movimentacoes importa supabase_client, que cria este cliente
+    import movimentacoes
+    from movimentacoes import MovimentacaoError
+
+    def envolver(operacao):
+        def rpc(conn, p):
+            try:
+                return operacao(conn, p)
+            except MovimentacaoError as e:
+                # RAISE EXCEPTION '%', codigo USING DETAIL = mensagem
+                raise ErroPostgrest(400, 'P0001', e.codigo, e.mensagem)
+        return rpc
+
+    return {
+        'registrar_movimentacao': envolver(movimentacoes._sqlite_movimentacao),
+        'registrar_movimentacoes': envolver(movimentacoes._sqlite_movimentacoes),
+        'registrar_movimentacao_consumivel': envolver(movimentacoes._sqlite_movimentacao_consumivel),
+        'contar_movimentacoes_por_tipo': _contar_movimentacoes_por_tipo,
+        'reconstruir_movimentacao_diaria': _reconstruir_movimentacao_diaria,
+    }
+
+
+# ============================================================
+# TRANSPORTE HTTP
+# ============================================================
+
+class SQLiteTransport(httpx.BaseTransport):
+    """Transporte httpx que responde às requisições PostgREST a partir do BancoLocal."""
+
+    def __init__(self, banco: BancoLocal, latencia_ms: float = 0, jitter_ms: float = 0):
+        self.banco = banco
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.requisicoes = 0
+
+    def _esperar(self):
+        atraso = self.latencia_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if atraso > 0:
+            time.sleep(atraso / 1000)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.requisicoes += 1
+        self._esperar()
+        recurso = request.url.path.split('/rest/v1/', 1)[-1].strip('/')
+        params = list(request.url.params.multi_items())
+        prefer = request.headers.get('prefer', '')
+        corpo = json.loads(request.content) if request.content else None
+        headers = {}
+        try:
+            if recurso.startswith('rpc/'):
+                status, dados = 200, self.banco.rpc(recurso[4:], corpo)
+            elif request.method in ('GET', 'HEAD'):
+                contar = 'count=' in prefer
+                dados, total, offset = self.banco.select(recurso, params, contar)
+                faixa = f'{offset}-{offset + len(dados) - 1}' if dados else '*'
+                headers['content-range'] = f'{faixa}/{total if total is not None else "*"}'
+                status = 200
+            elif request.method == 'POST':
+                status, dados = 201, self.banco.insert(recurso, params, corpo, prefer)
+            elif request.method == 'PATCH':
+                status, dados = 200, self.banco.update(recurso, params, corpo or {})
+            elif request.method == 'DELETE':
+                status, dados = 200, self.banco.delete(recurso, params)
+            else:
+                raise ErroPostgrest(405, 'PGRST117', f'método não suportado: {request.method}')
+            if request.method in ('POST', 'PATCH', 'DELETE') and not recurso.startswith('rpc/') and 'count=' in prefer:
+                headers['content-range'] = f'*/{len(dados)}'
+        except ErroPostgrest as e:
+            status, dados = e.status, e.corpo
+        except sqlite3.IntegrityError as e:
+            status, codigo = next(((st, cod) for msg, st, cod in _ERROS_INTEGRIDADE if msg in str(e)), (409, '23000'))
+            dados = {'code': codigo, 'message': str(e), 'details': None, 'hint': None}
+        except sqlite3.Error as e:
+            status, dados = 400, {'code': 'XX000', 'message': str(e), 'details': None, 'hint': None}
+        conteudo = json.dumps(_saida_json(dados), ensure_ascii=False, default=str).encode('utf-8')
+        headers['content-type'] = 'application/json; charset=utf-8'
+        return httpx.Response(status, content=conteudo, headers=headers, request=request)
+
+
+# ============================================================
+# CLIENTE
+# ============================================================
+
+class LocalClient:
+    """Mesma interface usada do supabase.Client: table/from_, rpc e postgrest.session."""
+
+    def __init__(self, caminho: str, latencia_ms: float = SUPABASE_LOCAL_LATENCIA_MS,
+                 jitter_ms: float = SUPABASE_LOCAL_JITTER_MS):
+        self.banco = BancoLocal(caminho)
+        self.transport = SQLiteTransport(self.banco, latencia_ms, jitter_ms)
+        self.postgrest = SyncPostgrestClient(BASE_URL)
+        self.postgrest.session = SyncClient(base_url=BASE_URL, headers=dict(self.postgrest.session.headers),
+                                            transport=self.transport)
+
+    def table(self, table_name: str):
+        return self.postgrest.from_(table_name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None):
+        return self.postgrest.rpc(fn, params or {})
+
+    def register_rpc(self, nome: str, funcao: Callable):
+        """Equivalente local de uma função SQL: funcao(conn, **parametros), dentro de uma transação."""
+        self.banco.rpcs[nome] = funcao
+
+    def set_latency(self, latencia_ms: float, jitter_ms: float = 0):
+        self.transport.latencia_ms = latencia_ms
+        self.transport.jitter_ms = jitter_ms
+
+    @property
+    def requisicoes(self) -> int:
+        """Idas ao "servidor" desde a criação (cada uma pagou a latência simulada)."""
+        return self.transport.requisicoes
+
+
+def create_local_client(caminho: str) -> LocalClient:
+    return LocalClient(caminho)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste das previsões em lote (analise_estoque.py) - sem banco
+Confere as tendências vetorizadas contra np.polyfit item a item e os casos de borda:
+conjunto de itens sem nenhuma saída no período e item com um único dia de saída.
+
+    python teste_analise_estoque.py
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from analise_estoque import matriz_diaria, tendencias_lineares, consumo_previsto
+
+
+def saidas(linhas):
+    return pd.DataFrame({
+        'item_id': [l[0] for l in linhas],
+        'dia': pd.to_datetime([l[1] for l in linhas]),
+        'quantidade': [float(l[2]) for l in linhas],
+    }, columns=['item_id', 'dia', 'quantidade'])
+
+
+def main():
+    falhas = 0
+
+    # Itens sem nenhuma movimentação no período
+    quantidades, presenca, _ = matriz_diaria(saidas([]), [1, 2, 3])
+    tendencias = tendencias_lineares(quantidades, presenca)
+    consumo = consumo_previsto(tendencias, np.array([7, 7, 7]))
+    if tendencias['tem_historico'].any() or consumo.any() or tendencias['m'].shape != (3,):
+        print(f"❌ Sem movimentações: {tendencias} consumo={consumo}")
+        falhas += 1
+    else:
+        print("✅ Sem movimentações: nenhuma tendência nem consumo previsto")
+
+    # Tendências contra np.polyfit na janela de cada item
+    inicio = date(2026, 1, 1)
+    rng = np.random.default_rng(7)
+    linhas = [(item, inicio + timedelta(days=int(d)), rng.integers(0, 20))
+              for item in (1, 2, 3) for d in rng.choice(30, size=8 * item, replace=False)]
+    linhas.append((4, inicio + timedelta(days=5), 3))  # um único dia: sem previsão
+    quantidades, presenca, _ = matriz_diaria(saidas(linhas), [1, 2, 3, 4, 5])
+    tendencias = tendencias_lineares(quantidades, presenca)
+    for i in range(3):
+        dias = np.flatnonzero(presenca[i])
+        y = quantidades[i, dias[0]:dias[-1] + 1]
+        m, b = np.polyfit(np.arange(len(y)), y, 1)
+        if not np.allclose([tendencias['m'][i], tendencias['b'][i]], [m, b]):
+            print(f"❌ Item {i + 1}: m,b={tendencias['m'][i]},{tendencias['b'][i]} polyfit={m},{b}")
+            falhas += 1
+    consumo = consumo_previsto(tendencias, np.array([7, 7, 7, 7, 7]))
+    if consumo[3] or consumo[4] or tendencias['tem_historico'][4]:
+        print(f"❌ Itens 4/5 não deveriam ter previsão: consumo={consumo}")
+        falhas += 1
+    if not falhas:
+        print("✅ Tendências conferem com np.polyfit")
+
+    raise SystemExit(1 if falhas else 0)
+
+
+if __name__ == '__main__':
+    main()
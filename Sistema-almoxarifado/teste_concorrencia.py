@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Teste de concorrência - várias SAÍDAS simultâneas contra o MESMO lote.
+
+Cria um item de teste com um lote de ESTOQUE unidades e dispara SAIDAS saídas de
+1 unidade em THREADS threads. Ao final confere que:
+- exatamente min(ESTOQUE, SAIDAS) saídas foram aceitas e as demais recusadas por saldo;
+  no caminho compare-and-swap, saídas abortadas por CONFLITO podem ter recusado por saldo
+  outras que entrariam, então ali vale só o limite superior;
+- o lote e o item terminaram com ESTOQUE menos as saídas aceitas (nenhuma atualização
+  perdida e nada gravado pelas abortadas: um CONFLITO desfaz os passos já feitos);
+- há uma movimentação de SAIDA por saída aceita.
+O item de teste é apagado no final.
+
+Backend usado (o mesmo de movimentacoes.py):
+    SUPABASE_LOCAL_DB=copia.db python teste_concorrencia.py   # Supabase local (SQLite; use uma cópia do banco)
+    python teste_concorrencia.py                              # Supabase (função SQL)
+    MOVIMENTACAO_CAS=1 python teste_concorrencia.py           # Supabase (compare-and-swap)
+
+Opções: --estoque 20 --saidas 40 --threads 16
+"""
+
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import movimentacoes
+from movimentacoes import registrar_movimentacao, MovimentacaoError
+from supabase_client import supabase, insert_one, select_one, select_many, SUPABASE_LOCAL_DB
+
+
+# ============================================================
+# PREPARAÇÃO / LIMPEZA
+# ============================================================
+
+def criar_item_teste(estoque: float) -> Tuple[Any, Any]:
+    """Cria item + lote de teste (sem movimentação). Retorna (item_id, detalhe_id)."""
+    codigo = f'TESTE-CONC-{uuid.uuid4().hex[:8].upper()}'
+    item = insert_one('item_estoque', {'codigo': codigo, 'descricao': 'ITEM DE TESTE DE CONCORRÊNCIA',
+                                       'qtd_estoque': estoque, 'estoque_minimo': 0})
+    detalhe = insert_one('estoque_detalhe', {'item_estoque_id': item['id'], 'lote': 'LOTE-TESTE', 'item_nf': '1',
+                                             'nf': 'NF-TESTE', 'estacao': 'Almoxarifado', 'quantidade': estoque})
+    return item['id'], detalhe['id']
+
+
+def ler_estado(item_id: Any, detalhe_id: Any) -> Dict[str, float]:
+    """Saldo do item, saldo do lote e número de SAÍDAS registradas."""
+    return {
+        'item': select_one('item_estoque', {'id': item_id})['qtd_estoque'],
+        'lote': select_one('estoque_detalhe', {'id': detalhe_id})['quantidade'],
+        'saidas': len(select_many('movimentacao', filters={'item_id': item_id, 'tipo': 'SAIDA'})),
+    }
+
+
+def apagar_item_teste(item_id: Any):
+    supabase.table('movimentacao').delete().eq('item_id', item_id).execute()
+    supabase.table('estoque_detalhe').delete().eq('item_estoque_id', item_id).execute()
+    supabase.table('item_estoque').delete().eq('id', item_id).execute()
+
+
+# ============================================================
+# TESTE
+# ============================================================
+
+def disparar_saidas(item_id: Any, detalhe_id: Any, saidas: int, threads: int) -> List[str]:
+    """Dispara as saídas em paralelo. Retorna o resultado de cada uma ('OK' ou o código do erro)."""
+    def sair(n: int) -> str:
+        try:
+            registrar_movimentacao('SAIDA', item_id=item_id, detalhe_id=detalhe_id, quantidade=1,
+                                   usuario='teste_concorrencia', etapa='TESTE', observacao=f'saída {n}')
+            return 'OK'
+        except MovimentacaoError as e:
+            return e.codigo
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(sair, range(saidas)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Saídas simultâneas contra o mesmo lote')
+    parser.add_argument('--estoque', type=int, default=20, help='saldo inicial do lote')
+    parser.add_argument('--saidas', type=int, default=40, help='saídas de 1 unidade a disparar')
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    if not supabase:
+        print('❌ Configure o Supabase (.env.supabase) ou SUPABASE_LOCAL_DB')
+        return 1
+    backend = f'Supabase local ({SUPABASE_LOCAL_DB})' if SUPABASE_LOCAL_DB else 'Supabase'
+    backend += ' (compare-and-swap)' if movimentacoes.FORCAR_CAS else ' (registrar_movimentacao)'
+
+    print('🔀 TESTE DE CONCORRÊNCIA')
+    print('=' * 60)
+    print(f'Backend: {backend}')
+    print(f'Lote com {args.estoque} un., {args.saidas} saídas de 1 un. em {args.threads} threads')
+
+    item_id, detalhe_id = criar_item_teste(args.estoque)
+    try:
+        inicio = time.perf_counter()
+        resultados = disparar_saidas(item_id, detalhe_id, args.saidas, args.threads)
+        duracao = time.perf_counter() - inicio
+
+        aceitas = resultados.count('OK')
+        contagem = {codigo: resultados.count(codigo) for codigo in sorted(set(resultados))}
+        estado = ler_estado(item_id, detalhe_id)
+        esperado = min(args.estoque, args.saidas)
+        conflitos = contagem.get('CONFLITO', 0)
+
+        print(f'\nResultados: {contagem} em {duracao:.2f}s ({args.saidas / duracao:.1f} op/s)')
+        print(f"Saldo do lote: {estado['lote']}  |  saldo do item: {estado['item']}  |  SAÍDAS gravadas: {estado['saidas']}")
+
+        falhas = []
+        # Com CONFLITO o saldo reservado e devolvido por uma saída abortada pode ter
+        # recusado outras; o que não pode acontecer é aceitar mais que o estoque
+        if aceitas > esperado or (not conflitos and aceitas != esperado):
+            falhas.append(f'{aceitas} saídas aceitas, esperado {esperado}')
+        if float(estado['lote']) != args.estoque - aceitas:
+            falhas.append(f"saldo do lote {estado['lote']} != {args.estoque - aceitas}")
+        if float(estado['item']) != args.estoque - aceitas:
+            falhas.append(f"saldo do item {estado['item']} != {args.estoque - aceitas}")
+        if estado['saidas'] != aceitas:
+            falhas.append(f"{estado['saidas']} movimentações de SAIDA para {aceitas} saídas aceitas")
+        if set(contagem) - {'OK', 'ESTOQUE_INSUFICIENTE', 'CONFLITO'}:
+            falhas.append(f'erros inesperados: {contagem}')
+
+        print()
+        if falhas:
+            for falha in falhas:
+                print(f'❌ {falha}')
+            return 1
+        print('✅ Nenhuma atualização perdida: saldos e histórico consistentes')
+        return 0
+    finally:
+        apagar_item_teste(item_id)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
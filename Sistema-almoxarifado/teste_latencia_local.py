@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark de latência - quanto cada página paga em idas ao banco.
+
+Roda as rotas abaixo contra o substituto local do Supabase (supabase_local.py) com
+várias latências simuladas por requisição e mostra, por rota, o número de consultas
+e o tempo total. Rotas cujo tempo cresce muito com a latência fazem muitas idas
+sequenciais ao banco (N+1, paginação serial). Os caches em memória (catálogo e
+snapshot do dashboard) são descartados antes de cada requisição: mede-se o caminho frio.
+
+Usa uma CÓPIA do banco (as rotas não gravam, mas o substituto pode criar colunas
+que só existem no Supabase):
+    python teste_latencia_local.py --db database_novo.db --latencias 0 5 20
+
+Opções: --rotas /dashboard /estoque --repeticoes 3 --usuario 1
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+ROTAS = ['/dashboard', '/api/kpis', '/estoque', '/relatorio/movimentacoes', '/consumivel', '/api/sugestoes-compra']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='database_novo.db')
+    parser.add_argument('--latencias', type=float, nargs='+', default=[0, 5, 20])
+    parser.add_argument('--rotas', nargs='+', default=ROTAS)
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--usuario', default='1', help='id do usuário (admin) da sessão')
+    args = parser.parse_args()
+
+    copia = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    shutil.copy(args.db, copia)
+    os.environ['SUPABASE_LOCAL_DB'] = copia
+    os.environ.setdefault('QUERY_BUDGET_MODE', 'off')
+
+    import main as app_main
+    import catalogo
+    import dashboard_snapshot
+    from supabase_client import supabase
+
+    client = app_main.app.test_client()
+    with client.session_transaction() as sessao:
+        sessao['_user_id'] = args.usuario
+        sessao['_fresh'] = True
+
+    print(f"\n{'rota':<28}{'latência':>10}{'consultas':>11}{'mediana (ms)':>14}")
+    print('-' * 63)
+    for rota in args.rotas:
+        for latencia in args.latencias:
+            supabase.set_latency(latencia)
+            tempos, consultas, status = [], 0, None
+            for _ in range(args.repeticoes):
+                catalogo.invalidate()
+                dashboard_snapshot.invalidate()
+                antes = supabase.requisicoes
+                inicio = time.perf_counter()
+                resposta = client.get(rota)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+                consultas = supabase.requisicoes - antes
+                status = resposta.status_code
+            aviso = '' if status == 200 else f'  (HTTP {status})'
+            print(f"{rota:<28}{latencia:>8g}ms{consultas:>11}{statistics.median(tempos):>14.1f}{aviso}")
+
+    shutil.rmtree(os.path.dirname(copia), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()